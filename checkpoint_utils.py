@@ -0,0 +1,118 @@
+'''
+Write TensorFlow checkpoints from a background thread.
+
+With the big configurations (e.g. GoogleConfig: two 1M x 512 embedding tables
+plus their Adagrad accumulators) a synchronous saver.save() stalls training
+for a long time. AsyncCheckpointWriter copies the variable values into host
+memory and hands them to a thread that writes them to disk, so the training
+loop only waits for the copy.
+
+Checkpoints are written in the usual V2 format together with a meta graph so
+they can be loaded with tf.train.import_meta_graph() + restore() as before.
+'''
+import os
+import sys
+import threading
+import queue
+
+import tensorflow as tf
+from tensorflow.python.ops import io_ops
+
+
+def is_optimizer_slot(var):
+    ''' Adagrad accumulators are named like "Model/word_embedding/Adagrad" '''
+    return var.op.name.split('/')[-1].startswith('Adagrad')
+
+
+class AsyncCheckpointWriter(object):
+    '''
+    Drop-in replacement for Saver.save() that writes in the background.
+
+    saver: a tf.train.Saver over var_list, used to export the meta graph so
+    that the checkpoints can be restored with the usual tools
+    var_list: variables to write, must be the ones covered by saver
+    max_to_keep: keep the last K checkpoints (and maintain the "checkpoint"
+    state file as Saver does). If None, the checkpoint is overwritten in
+    place every time, which is what we want for the best model.
+
+    At most one snapshot waits in the queue while another is being written.
+    save() takes its snapshot before it blocks on the full queue, so the
+    memory overhead is bounded by three copies of the variables.
+    '''
+
+    def __init__(self, saver, var_list, max_to_keep=None):
+        self.saver = saver
+        self.var_list = list(var_list)
+        self.max_to_keep = max_to_keep
+        self.last_checkpoints = []
+        self._error = None
+        self._queue = queue.Queue(maxsize=1)
+        # a tiny graph of its own: SaveV2 fed directly from the snapshot
+        # so that no second copy of the variables lives in a session
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            self._prefix = tf.placeholder(tf.string, shape=[])
+            self._values = [tf.placeholder(v.dtype.base_dtype, shape=v.get_shape())
+                            for v in self.var_list]
+            self._save_op = io_ops.save_v2(self._prefix,
+                                           [v.op.name for v in self.var_list],
+                                           [''] * len(self.var_list),
+                                           self._values)
+        self._sess = tf.Session(graph=self._graph,
+                                config=tf.ConfigProto(device_count={'GPU': 0}))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def save(self, sess, save_path, global_step=None):
+        ''' Take a snapshot of the variables and return immediately. '''
+        self._raise_pending_error()
+        if global_step is not None:
+            save_path = '%s-%d' %(save_path, global_step)
+        values = sess.run(self.var_list)
+        meta_graph_def = self.saver.export_meta_graph()
+        self._queue.put((save_path, meta_graph_def, values))
+        return save_path
+
+    def close(self):
+        ''' Wait for pending checkpoints to be written. '''
+        self._queue.put(None)
+        self._thread.join()
+        self._sess.close()
+        self._raise_pending_error()
+
+    def _raise_pending_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None: break
+            try:
+                self._write(*item)
+            except Exception as e:
+                sys.stderr.write('Failed to write checkpoint %s: %s\n' %(item[0], e))
+                self._error = e
+
+    def _write(self, save_path, meta_graph_def, values):
+        save_dir = os.path.dirname(save_path)
+        if save_dir: os.makedirs(save_dir, exist_ok=True)
+        feed_dict = dict(zip(self._values, values))
+        feed_dict[self._prefix] = save_path
+        self._sess.run(self._save_op, feed_dict)
+        # the meta graph goes last so that a visible .meta means a complete checkpoint
+        with open(save_path + '.meta', 'wb') as f:
+            f.write(meta_graph_def.SerializeToString())
+        if self.max_to_keep is not None:
+            if save_path in self.last_checkpoints:
+                self.last_checkpoints.remove(save_path)
+            self.last_checkpoints.append(save_path)
+            while len(self.last_checkpoints) > max(self.max_to_keep, 1):
+                self._delete(self.last_checkpoints.pop(0))
+            tf.train.update_checkpoint_state(save_dir, save_path,
+                                             self.last_checkpoints)
+
+    def _delete(self, save_path):
+        for path in tf.gfile.Glob(save_path + '.*'):
+            tf.gfile.Remove(path)
@@ -0,0 +1,278 @@
+'''
+Precompiled index (lemma, pos) -> candidate synsets.
+
+perform_wsd.py asks NLTK's WordNet reader for the synsets of every instance,
+which loads and parses the WordNet files first. A CandidateIndex answers the
+same questions from a directory of memory-mapped .npy files:
+
+    meta.json                       WordNet version and sizes
+    entry_blob.npy, entry_offsets   the keys 'lemma<TAB>pos' (pos is empty for None)
+    table.npy                       open addressing hash table: slot -> entry
+    candidate_offsets, candidates   the synsets (rows) of each entry, in WordNet order
+    synset_ids.npy                  identifier of each synset (eng-VERSION-OFFSET-POS)
+    lemma_offsets.npy               the lemmas of each synset
+    name_blob, name_offsets         lemma names
+    key_blob, key_offsets           lemma sense keys
+
+A lookup hashes the key and probes the table, nothing is read at load time.
+synsets() returns IndexedSynset objects that provide the part of the NLTK
+Synset interface that morpho_utils.candidate_selection, synset2identifier and
+official_scorer use (offset, pos, lemmas, lemma_names), so an index can be
+passed wherever perform_wsd.py passes wn.
+
+The index contains the synsets of all WordNet lemma names (as returned by
+wn.synsets, i.e. after morphy) and of the (target_lemma, pos) pairs of the
+given competition dataframes:
+
+python3 candidate_index.py -w 30 -o resources/candidates-30.index \
+        higher_level_annotations/se2-aw-framework-synset-30_semcor.bin
+'''
+import os
+import json
+import zlib
+import argparse
+import numpy as np
+
+
+def _pack_strings(strings):
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in encoded])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def _unpack_string(blob, offsets, i):
+    return blob[offsets[i]:offsets[i+1]].tobytes().decode('utf-8')
+
+
+def _entry_key(lemma, pos):
+    return '%s\t%s' %(lemma, pos or '')
+
+
+def _hash(key):
+    return zlib.crc32(key.encode('utf-8'))
+
+
+class IndexedLemma(object):
+    ''' the part of nltk.corpus.reader.wordnet.Lemma that is used here '''
+    __slots__ = ('_name', '_key')
+
+    def __init__(self, name, key):
+        self._name = name
+        self._key = key
+
+    def name(self):
+        return self._name
+
+    def key(self):
+        return self._key
+
+
+class IndexedSynset(object):
+    ''' the part of nltk.corpus.reader.wordnet.Synset that is used here '''
+
+    def __init__(self, index, row):
+        self.index = index
+        self.row = row
+        self.identifier = index.synset_ids[row].decode('ascii')
+
+    def offset(self):
+        return int(self.identifier.split('-')[2])
+
+    def pos(self):
+        return self.identifier.split('-')[3]
+
+    def lemmas(self):
+        return [IndexedLemma(self.index.lemma_name(i), self.index.lemma_key(i))
+                for i in range(self.index.lemma_offsets[self.row],
+                               self.index.lemma_offsets[self.row+1])]
+
+    def lemma_names(self):
+        return [lemma.name() for lemma in self.lemmas()]
+
+    def __eq__(self, other):
+        return isinstance(other, IndexedSynset) and self.identifier == other.identifier
+
+    def __hash__(self):
+        return hash(self.identifier)
+
+    def __repr__(self):
+        return "IndexedSynset('%s')" %self.identifier
+
+
+class CandidateIndex(object):
+    '''
+    store_dir: directory written by build_candidate_index()
+    fallback: WordNet reader for (lemma, pos) pairs that are not in the index
+    (e.g. nltk.corpus.wordnet, which is only loaded when it is needed).
+    Without a fallback such lookups raise a KeyError.
+    '''
+
+    def __init__(self, store_dir, fallback=None, mmap_mode='r'):
+        with open(os.path.join(store_dir, 'meta.json')) as infile:
+            meta = json.load(infile)
+        self.wn_version = meta['wn_version']
+        self.fallback = fallback
+        load = lambda name: np.load(os.path.join(store_dir, name + '.npy'), mmap_mode=mmap_mode)
+        self.entry_blob = load('entry_blob')
+        self.entry_offsets = load('entry_offsets')
+        self.table = load('table')
+        self.candidate_offsets = load('candidate_offsets')
+        self.candidates = load('candidates')
+        self.synset_ids = load('synset_ids')
+        self.lemma_offsets = load('lemma_offsets')
+        self.name_blob = load('name_blob')
+        self.name_offsets = load('name_offsets')
+        self.key_blob = load('key_blob')
+        self.key_offsets = load('key_offsets')
+        self.synset_rows = None
+
+    def entry(self, lemma, pos=None):
+        ''' Row of the entry of (lemma, pos), -1 if there is none '''
+        key = _entry_key(lemma, pos)
+        mask = len(self.table) - 1
+        slot = _hash(key) & mask
+        while True:
+            entry = self.table[slot]
+            if entry < 0 or _unpack_string(self.entry_blob, self.entry_offsets, entry) == key:
+                return int(entry)
+            slot = (slot + 1) & mask
+
+    def __contains__(self, lemma_pos):
+        return self.entry(*lemma_pos) >= 0
+
+    def candidate_identifiers(self, lemma, pos=None):
+        ''' Identifiers of the candidate synsets, in the order of wn.synsets() '''
+        entry = self.entry(lemma, pos)
+        if entry < 0:
+            raise KeyError((lemma, pos))
+        rows = self.candidates[self.candidate_offsets[entry]:self.candidate_offsets[entry+1]]
+        return [synset_id.decode('ascii') for synset_id in self.synset_ids[rows]]
+
+    def synsets(self, lemma, pos=None):
+        ''' Same as wn.synsets(lemma, pos) '''
+        entry = self.entry(lemma, pos)
+        if entry < 0:
+            if self.fallback is None:
+                raise KeyError('(%s, %s) is not in the candidate index' %(lemma, pos))
+            return self.fallback.synsets(lemma, pos)
+        return [IndexedSynset(self, row)
+                for row in self.candidates[self.candidate_offsets[entry]:self.candidate_offsets[entry+1]]]
+
+    def synset(self, identifier):
+        '''
+        Synset of an identifier (eng-VERSION-OFFSET-POS). A synset that
+        fallback.synsets() returned is not in the index, it is loaded from
+        the fallback.
+        '''
+        if self.synset_rows is None:
+            self.synset_rows = dict((synset_id.decode('ascii'), row)
+                                    for row, synset_id in enumerate(self.synset_ids))
+        row = self.synset_rows.get(identifier)
+        if row is not None:
+            return IndexedSynset(self, row)
+        if self.fallback is None:
+            raise KeyError('%s is not in the candidate index and there is no fallback' %identifier)
+        eng, version, offset, pos = identifier.split('-')
+        return self.fallback._synset_from_pos_and_offset(pos, int(offset))
+
+    def lemma_name(self, i):
+        return _unpack_string(self.name_blob, self.name_offsets, i)
+
+    def lemma_key(self, i):
+        return _unpack_string(self.key_blob, self.key_offsets, i)
+
+
+def build_candidate_index(wn, wn_version, store_dir, lemma_pos_pairs=()):
+    '''
+    write the index of all lemma names of wn plus lemma_pos_pairs
+    (pos can be None) to store_dir
+    '''
+    from perform_wsd import synset2identifier
+
+    keys = []
+    seen = set()
+    for pos in ['n', 'v', 'a', 'r']:
+        for lemma in wn.all_lemma_names(pos):
+            keys.append((lemma, pos))
+    keys.extend(lemma_pos_pairs)
+
+    entry_keys = []
+    candidate_rows = []
+    synset_rows = dict()
+    synset_ids = []
+    lemma_names = []
+    lemma_keys = []
+    lemma_offsets = [0]
+    for lemma, pos in keys:
+        key = _entry_key(lemma, pos)
+        if key in seen: continue
+        seen.add(key)
+        rows = []
+        for synset in wn.synsets(lemma, pos):
+            identifier = synset2identifier(synset, wn_version)
+            if identifier not in synset_rows:
+                synset_rows[identifier] = len(synset_ids)
+                synset_ids.append(identifier)
+                for synset_lemma in synset.lemmas():
+                    lemma_names.append(synset_lemma.name())
+                    lemma_keys.append(synset_lemma.key())
+                lemma_offsets.append(len(lemma_names))
+            rows.append(synset_rows[identifier])
+        entry_keys.append(key)
+        candidate_rows.append(rows)
+
+    # open addressing with linear probing, at most half full
+    table = np.full(1 << max(1, (2 * len(entry_keys) - 1).bit_length()), -1, dtype=np.int32)
+    mask = len(table) - 1
+    for entry, key in enumerate(entry_keys):
+        slot = _hash(key) & mask
+        while table[slot] >= 0:
+            slot = (slot + 1) & mask
+        table[slot] = entry
+
+    candidate_offsets = np.zeros(len(candidate_rows) + 1, dtype=np.int64)
+    candidate_offsets[1:] = np.cumsum([len(rows) for rows in candidate_rows])
+    candidates = np.array([row for rows in candidate_rows for row in rows], dtype=np.int32)
+
+    os.makedirs(store_dir, exist_ok=True)
+    save = lambda name, array: np.save(os.path.join(store_dir, name + '.npy'), array)
+    entry_blob, entry_offsets = _pack_strings(entry_keys)
+    save('entry_blob', entry_blob)
+    save('entry_offsets', entry_offsets)
+    save('table', table)
+    save('candidate_offsets', candidate_offsets)
+    save('candidates', candidates)
+    save('synset_ids', np.array(synset_ids, dtype=np.bytes_))
+    save('lemma_offsets', np.array(lemma_offsets, dtype=np.int64))
+    name_blob, name_offsets = _pack_strings(lemma_names)
+    save('name_blob', name_blob)
+    save('name_offsets', name_offsets)
+    key_blob, key_offsets = _pack_strings(lemma_keys)
+    save('key_blob', key_blob)
+    save('key_offsets', key_offsets)
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as outfile:
+        json.dump({'wn_version': wn_version,
+                   'num_entries': len(entry_keys),
+                   'num_synsets': len(synset_ids)}, outfile)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the candidate index of a WordNet version')
+    parser.add_argument('-w', dest='wn_version', default='30', help='30 | 171')
+    parser.add_argument('-o', dest='output_dir', required=True, help='directory where the index is written')
+    parser.add_argument('wsd_df_paths', nargs='*', help='competition dataframes whose (target_lemma, pos) pairs are added')
+    args = parser.parse_args()
+
+    import pandas
+    from wn_snapshot import load_wordnet
+    wn = load_wordnet(args.wn_version)
+
+    lemma_pos_pairs = []
+    for wsd_df_path in args.wsd_df_paths:
+        wsd_df = pandas.read_pickle(wsd_df_path)
+        lemma_pos_pairs.extend(zip(wsd_df['target_lemma'], wsd_df['pos']))
+
+    build_candidate_index(wn, args.wn_version, args.output_dir, lemma_pos_pairs)
+    print('Written %s' %args.output_dir)
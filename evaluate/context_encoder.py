@@ -0,0 +1,209 @@
+'''
+Compute context embeddings of target words with a trained LSTM model.
+
+All scripts that need the predicted context embedding of (sentence, target
+index) pairs go through ContextEncoder: it maps tokens to ids, sorts the
+sentences by length and groups them into batches of similar length so that
+little time is wasted on padding, and returns the embeddings in input order.
+
+The model can either be the TensorFlow graph (TFModel) or the NumPy
+reimplementation (numpy_lstm.NumpyLSTM), both are callables that take
+(x, lens) and return predicted_context_embs.
+
+If an embedding_cache.EmbeddingCache is given, sentences that were encoded
+before (with the same model) are looked up instead of run through the LSTM.
+'''
+from contextlib import contextmanager
+from collections import OrderedDict
+import numpy as np
+from tensor_utils import load_model
+
+
+class TFModel(object):
+    ''' Run a trained model in a TensorFlow session '''
+
+    def __init__(self, sess, model_path):
+        self.sess = sess
+        self.x, self.predicted_context_embs, self.lens = load_model(sess, model_path)
+
+    def __call__(self, x, lens):
+        return self.sess.run(self.predicted_context_embs, {self.x: x, self.lens: lens})
+
+
+class ContextEncoder(object):
+    '''
+    vocab: mapping word -> id as saved by prepare-lstm-wsd.py
+    model: callable (x, lens) -> predicted_context_embs
+    token_budget: maximum number of cells (sentences x max length) in a batch
+    max_batch_size: maximum number of sentences in a batch (0 for no limit)
+    cache: optional EmbeddingCache of the same model
+    '''
+
+    def __init__(self, vocab, model, token_budget=60000, max_batch_size=0, cache=None):
+        self.vocab = vocab
+        self.model = model
+        self.cache = cache
+        self.token_budget = token_budget
+        self.max_batch_size = max_batch_size
+        self.target_id = vocab['<target>']
+        self.unkn_id = vocab['<unkn>']
+        self.pad_id = vocab['<pad>']
+
+    def to_ids(self, sentence_tokens, target_index=None):
+        sentence_as_ids = [self.vocab.get(w) or self.unkn_id for w in sentence_tokens]
+        if target_index is not None:
+            sentence_as_ids[target_index] = self.target_id
+        return sentence_as_ids
+
+    def _batches(self, lens, sizes=None):
+        '''
+        Yield arrays of sentence indices, shortest sentences first.
+        sizes: number of rows that each sentence takes in the model (default 1)
+        '''
+        if sizes is None:
+            sizes = np.ones(len(lens), dtype=np.int32)
+        batch, batch_size = [], 0
+        for index in np.argsort(lens, kind='mergesort'):
+            # sentences are sorted so the current one is the longest of the batch
+            size = sizes[index]
+            full = batch and ((batch_size+size) * lens[index] > self.token_budget or
+                              (self.max_batch_size > 0 and batch_size+size > self.max_batch_size))
+            if full:
+                yield np.array(batch)
+                batch, batch_size = [], 0
+            batch.append(index)
+            batch_size += size
+        if batch:
+            yield np.array(batch)
+
+    def encode_ids(self, sentences, unmodified=None):
+        '''
+        sentences: list of lists of word ids where the target word has
+        already been replaced by <target>
+        unmodified: optional list of (sentence ids without <target>, target
+        index), one for each sentence. If given and the model supports it
+        (numpy_lstm.NumpyLSTM does), targets in the same sentence share the
+        computation of the words in front of them.
+
+        return: matrix of context embeddings, one row per sentence
+        '''
+        if self.cache is None:
+            return self._run_model(sentences, unmodified)
+        keys = [self.cache.key(s) for s in sentences]
+        embs = [self.cache.get(key) for key in keys]
+        missing = OrderedDict() # the same sentence is encoded only once
+        for i, emb in enumerate(embs):
+            if emb is None:
+                missing.setdefault(keys[i], []).append(i)
+        first_indices = [indices[0] for indices in missing.values()]
+        new_embs = self._run_model([sentences[i] for i in first_indices],
+                                   unmodified and [unmodified[i] for i in first_indices])
+        for (key, indices), emb in zip(missing.items(), new_embs):
+            self.cache.put(key, emb)
+            for i in indices:
+                embs[i] = emb
+        if not embs:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(embs)
+
+    def _pad(self, sentences, lens):
+        x = np.empty((len(sentences), lens.max()), dtype=np.int32)
+        x.fill(self.pad_id)
+        for i, s in enumerate(sentences):
+            x[i, :lens[i]] = s
+        return x
+
+    def _run_model(self, sentences, unmodified=None):
+        if unmodified is not None and hasattr(self.model, 'encode_targets'):
+            return self._run_shared_prefixes(sentences, unmodified)
+        lens = np.array([len(s) for s in sentences], dtype=np.int32)
+        output = None
+        for batch in self._batches(lens):
+            embs = self.model(self._pad([sentences[i] for i in batch], lens[batch]),
+                              lens[batch])
+            if output is None:
+                output = np.empty((len(sentences), embs.shape[1]), dtype=embs.dtype)
+            output[batch] = embs
+        if output is None:
+            output = np.empty((0, 0), dtype=np.float32)
+        return output
+
+    def _run_shared_prefixes(self, sentences, unmodified):
+        # group the targets by sentence, sentences with only one target
+        # gain nothing and go through the normal path
+        groups = OrderedDict()
+        for i, (sentence_as_ids, target_index) in enumerate(unmodified):
+            groups.setdefault(tuple(sentence_as_ids), []).append(i)
+        groups = list(groups.items())
+        singles = [indices[0] for _, indices in groups if len(indices) == 1]
+        groups = [group for group in groups if len(group[1]) >= 2]
+        single_output = self._run_model([sentences[i] for i in singles])
+        if not groups:
+            return single_output
+        output = None
+        lens = np.array([len(sentence_as_ids) for sentence_as_ids, _ in groups], dtype=np.int32)
+        sizes = np.array([len(indices) for _, indices in groups], dtype=np.int32)
+        for batch in self._batches(lens, sizes):
+            rows, target_indices, output_indices = [], [], []
+            for row, group_index in enumerate(batch):
+                for i in groups[group_index][1]:
+                    rows.append(row)
+                    target_indices.append(unmodified[i][1])
+                    output_indices.append(i)
+            x = self._pad([groups[group_index][0] for group_index in batch], lens[batch])
+            embs = self.model.encode_targets(x, lens[batch], rows, target_indices,
+                                             self.target_id, self.pad_id)
+            if output is None:
+                output = np.empty((len(sentences), embs.shape[1]), dtype=embs.dtype)
+            output[output_indices] = embs
+        if singles:
+            output[singles] = single_output
+        return output
+
+    def encode(self, instances):
+        '''
+        instances: iterable of (sentence_tokens, target_index)
+
+        return: matrix of context embeddings in the same order as the input
+        '''
+        unmodified = [(self.to_ids(sentence_tokens), target_index)
+                      for sentence_tokens, target_index in instances]
+        sentences = []
+        for sentence_as_ids, target_index in unmodified:
+            sentence_as_ids = list(sentence_as_ids)
+            sentence_as_ids[target_index] = self.target_id
+            sentences.append(sentence_as_ids)
+        return self.encode_ids(sentences, unmodified)
+
+
+def open_cache(model_path, cache_dir, cache_size_mb=2048):
+    ''' Return the EmbeddingCache of the model or None if cache_dir is None '''
+    if cache_dir is None:
+        return None
+    from embedding_cache import EmbeddingCache, model_fingerprint
+    return EmbeddingCache(cache_dir, model_fingerprint(model_path), cache_size_mb)
+
+
+@contextmanager
+def open_encoder(model_path, vocab, backend='tensorflow', cache_dir=None,
+                 cache_size_mb=2048, **kwargs):
+    '''
+    Load a ContextEncoder backed by TensorFlow (in a session that is closed
+    at the end of the with block) or by NumPy (see numpy_lstm.py).
+    If cache_dir is given, embeddings are read from and written to an
+    EmbeddingCache there.
+    '''
+    cache = open_cache(model_path, cache_dir, cache_size_mb)
+    try:
+        if backend == 'numpy':
+            from numpy_lstm import NumpyLSTM
+            yield ContextEncoder(vocab, NumpyLSTM.load(model_path), cache=cache, **kwargs)
+        elif backend == 'tensorflow':
+            import tensorflow as tf
+            with tf.Session() as sess:
+                yield ContextEncoder(vocab, TFModel(sess, model_path), cache=cache, **kwargs)
+        else:
+            raise ValueError('Unknown encoder backend: %s' %backend)
+    finally:
+        if cache is not None:
+            cache.close()
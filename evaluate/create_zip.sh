@@ -16,6 +16,8 @@ cp evaluate/README.md $out
 cp evaluate/sense_annotations2lstm_format.py $out
 cp evaluate/mapping_utils.py $out
 cp evaluate/wn_utils.py $out
+cp evaluate/wn_snapshot.py $out
+cp evaluate/hypernym_index.py $out
 cp evaluate/wsd_datasets_classes.py $out
 
 #bash scripts to run conversion
@@ -26,6 +28,13 @@ cp evaluate/convert_sense_annotations_se13_framework.job $out
 #python scripts to run train sense embeddings and perform wsd
 cp evaluate/test-lstm_v2.py $out
 cp evaluate/tensor_utils.py $out
+cp evaluate/context_encoder.py $out
+cp evaluate/numpy_lstm.py $out
+cp evaluate/embedding_cache.py $out
+cp evaluate/embedding_accumulator.py $out
+cp evaluate/line_shards.py $out
+cp evaluate/sense_store.py $out
+cp evaluate/candidate_index.py $out
 cp evaluate/perform_wsd.py $out
 
 cp evaluate/morpho_utils.py $out
@@ -37,6 +46,7 @@ cp evaluate/official_scorer.py $out
 cp evaluate/evaluate_in_parallel.sh $out
 cp evaluate/one_experiment.job $out
 cp evaluate/one_full_experiment_v2.sh $out
+cp evaluate/evaluate_all.py $out
 
 #result tables
 cp evaluate/official_results.py $out
@@ -47,3 +57,7 @@ cp evaluate/run_lp.job $out
 cp evaluate/all_lp_jobs.sh $out
 cp evaluate/debug_lp.py $out
 cp evaluate/label_propagation.py $out
+cp evaluate/knn_graph.py $out
+cp evaluate/lp_solver.py $out
+cp evaluate/streaming_lp.py $out
+cp evaluate/lp_sweep.py $out
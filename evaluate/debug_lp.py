@@ -1,16 +1,21 @@
 """Evaluate label propagation on a development set.
 
 Usage:
-  debug_lp.py --system_input=<system_input> --model=<model> --vocab=<vocab> --algo=<algo> --sim=<func> --gamma=<val>
+  debug_lp.py --system_input=<system_input> --model=<model> --vocab=<vocab> --algo=<algo> --sim=<func> --gamma=<val> [--cache_dir=<dir>] [--knn_min_size=<n>] [--workers=<n>] [--solver=<solver>] [--stable_iterations=<n>]
 
 Options:
   -h --help     Show this screen.
   --system_input=<system_input> Path to system input (for gold suffix _gold is added)
   --model=<model> path to model
   --vocab=<vocab> path to vocab
-  --algo=<algo> Choose the algorithm (propagate, spread, or nearest) [default: propagate]
+  --algo=<algo> Choose the algorithm (propagate, spread, stream, or nearest) [default: propagate]
   --sim=<func>  Choose the similarity function to test (either rbf or expander)
   --gamma=<val> Value of gamma for RBF function
+  --cache_dir=<dir> Directory of the context embedding cache (see embedding_cache.py)
+  --workers=<n> Number of processes that propagate labels (one lemma each) [default: 1]
+  --solver=<solver> Solver of propagate and spread (native or sklearn, see lp_solver.py) [default: native]
+  --stable_iterations=<n> Stop the native solver early when the labels have not changed for n iterations (approximate)
+  --knn_min_size=<n> Use an approximate k-nearest-neighbour graph (see knn_graph.py) for lemmas with at least n instances
 """
 
 import os
@@ -18,6 +23,8 @@ from datetime import datetime
 from collections import defaultdict
 from label_propagation import LabelPropagation, expander, RBF, NearestNeighbor,\
     LabelSpreading, NearestNeighborOfAverage
+from streaming_lp import StreamingLabelPropagation
+from knn_graph import KNNGraph
 from docopt import docopt
 #from version import version
 
@@ -98,6 +105,7 @@ def score_lp(system_input, system_output, gold, path_dev_score, debug=False):
         one_row = ['all', 'all', str(accuracy)]
         print(one_row)
         outfile.write('\t'.join(one_row) + '\n')
+    return accuracy
 
 if __name__ == '__main__':
     import pickle
@@ -110,6 +118,13 @@ if __name__ == '__main__':
         sim_func = RBF(float(arguments['--gamma']))
     else:
         raise ValueError('Unknown similarity function: %s' %arguments['--sim'])
+    stable_iterations = None
+    if arguments['--stable_iterations']:
+        stable_iterations = int(arguments['--stable_iterations'])
+    knn_graph = None
+    if arguments['--knn_min_size']:
+        knn_graph = KNNGraph(metric='euclidean' if arguments['--sim'] == 'rbf' else 'dot',
+                             min_size=int(arguments['--knn_min_size']))
 
     #model_path='/var/scratch/mcpostma/testing/model-google-65/model-google/lstm-wsd-gigaword-google'
     #vocab_path='/var/scratch/mcpostma/wsd-dynamic-sense-vector/output/gigaword-lstm-wsd.index.pkl'
@@ -141,13 +156,26 @@ if __name__ == '__main__':
     import tensorflow as tf
     with tf.Session() as sess:
         if arguments['--algo'] in ('propagate', 'LabelPropagation'): 
-            lp = LabelPropagation(sess, vocab_path, model_path, 1000, sim_func=sim_func)
+            lp = LabelPropagation(sess, vocab_path, model_path, 1000, sim_func=sim_func,
+                                  cache_dir=arguments['--cache_dir'], knn_graph=knn_graph,
+                                  num_workers=int(arguments['--workers']),
+                                  solver=arguments['--solver'],
+                                  stable_iterations=stable_iterations)
         elif arguments['--algo'] in ('spread', 'LabelSpreading'):
-            lp = LabelSpreading(sess, vocab_path, model_path, 1000, sim_func=sim_func)
+            lp = LabelSpreading(sess, vocab_path, model_path, 1000, sim_func=sim_func,
+                                cache_dir=arguments['--cache_dir'], knn_graph=knn_graph,
+                                num_workers=int(arguments['--workers']),
+                                solver=arguments['--solver'],
+                                stable_iterations=stable_iterations)
+        elif arguments['--algo'] in ('stream', 'StreamingLabelPropagation'):
+            lp = StreamingLabelPropagation(sess, vocab_path, model_path, 1000, sim_func=sim_func,
+                                           cache_dir=arguments['--cache_dir'])
         elif arguments['--algo'] in ('nearest', 'NearestNeighbor'):
-            lp = NearestNeighbor(sess, vocab_path, model_path, 1000, sim_func=sim_func)
+            lp = NearestNeighbor(sess, vocab_path, model_path, 1000, sim_func=sim_func,
+                                 cache_dir=arguments['--cache_dir'])
         elif arguments['--algo'] in ('average', 'NearestNeighborOfAverage'):
-            lp = NearestNeighborOfAverage(sess, vocab_path, model_path, 1000, sim_func=sim_func)
+            lp = NearestNeighborOfAverage(sess, vocab_path, model_path, 1000, sim_func=sim_func,
+                                          cache_dir=arguments['--cache_dir'])
         else:
             raise ValueError('Unknown algorithm: %s' %arguments['--algo'])
         system_output = lp.predict(system_input)
@@ -0,0 +1,166 @@
+'''
+Accumulate meaning (sense) embeddings from a stream of instance embeddings.
+
+SenseAccumulator keeps a running count, sum, mean value and sum of squared
+deviations per meaning so that memory only grows with the number of meanings,
+not with the corpus.
+
+InstanceWriter optionally keeps the instance embeddings too: the rows are
+appended to a raw float32 (or float16) file, <path>.data, and a small index
+maps every meaning to its rows. load_instances() memory-maps the file and
+also reads the old format (a pickled dict of lists of embeddings).
+'''
+import os
+import shutil
+import pickle
+from collections import defaultdict
+from collections.abc import Mapping
+import numpy as np
+
+
+class SenseAccumulator(object):
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.sums = dict()
+        # mean and sum of squared deviations of all values of all embeddings,
+        # E[x^2] - mean^2 would lose the precision of the std by cancellation
+        self.value_means = defaultdict(float)
+        self.squared_deviations = defaultdict(float)
+
+    def _add_values(self, sense, num_values, mean, squared_deviations):
+        ''' combine the value statistics of two sets (Chan et al., 1979) '''
+        num_before = (self.counts[sense] * len(self.sums[sense])) if sense in self.sums else 0
+        num_after = num_before + num_values
+        delta = mean - self.value_means[sense]
+        self.value_means[sense] += delta * num_values / num_after
+        self.squared_deviations[sense] += (squared_deviations +
+                                           delta * delta * num_before * num_values / num_after)
+
+    def add(self, sense, embedding):
+        embedding = embedding.astype(np.float64)
+        mean = embedding.mean()
+        deviations = embedding - mean
+        self._add_values(sense, len(embedding), mean, np.dot(deviations, deviations))
+        self.counts[sense] += 1
+        if sense in self.sums:
+            self.sums[sense] += embedding
+        else:
+            self.sums[sense] = embedding
+
+    def merge(self, other):
+        ''' Add the statistics of another accumulator (e.g. of another shard) '''
+        for sense, count in other.counts.items():
+            self._add_values(sense, count * len(other.sums[sense]),
+                             other.value_means[sense], other.squared_deviations[sense])
+            self.counts[sense] += count
+            if sense in self.sums:
+                self.sums[sense] += other.sums[sense]
+            else:
+                self.sums[sense] = other.sums[sense]
+
+    def averages(self):
+        '''
+        return: dict sense -> (average embedding, std) where std is the
+        standard deviation over all values of all embeddings of the sense
+        (same as np.std(list_of_embeddings))
+        '''
+        sense2avg_embedding = dict()
+        for sense, embedding_sum in self.sums.items():
+            count = self.counts[sense]
+            average = (embedding_sum / count).astype(np.float32)
+            variance = self.squared_deviations[sense] / (count * len(embedding_sum))
+            sense2avg_embedding[sense] = average, np.float32(np.sqrt(variance))
+        return sense2avg_embedding
+
+
+class InstanceWriter(object):
+    '''
+    path: the index is written to path + '.index' and the embeddings
+    to path + '.data'
+    dtype: float32 or float16 (halves the size)
+    '''
+
+    def __init__(self, path, dtype=np.float32):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.dims = None
+        self.num_rows = 0
+        self.index = defaultdict(list) # sense -> rows
+        self.data_file = open(path + '.data', 'wb')
+
+    def add(self, senses, embeddings):
+        embeddings = np.asarray(embeddings, dtype=self.dtype)
+        if len(embeddings) == 0: return
+        if self.dims is None:
+            self.dims = embeddings.shape[1]
+        assert embeddings.shape[1] == self.dims
+        embeddings.tofile(self.data_file)
+        for row, sense in enumerate(senses, self.num_rows):
+            self.index[sense].append(row)
+        self.num_rows += len(embeddings)
+
+    def append_file(self, path):
+        ''' Append the instances written by another (closed) InstanceWriter '''
+        with open(path + '.index', 'rb') as infile:
+            meta = pickle.load(infile)
+        if meta['num_rows'] == 0: return
+        assert np.dtype(meta['dtype']) == self.dtype
+        if self.dims is None:
+            self.dims = meta['dims']
+        assert meta['dims'] == self.dims
+        with open(path + '.data', 'rb') as infile:
+            shutil.copyfileobj(infile, self.data_file)
+        for sense, rows in meta['index'].items():
+            self.index[sense].extend(int(row) + self.num_rows for row in rows)
+        self.num_rows += meta['num_rows']
+
+    def close(self):
+        self.data_file.close()
+        meta = {'dtype': self.dtype.str,
+                'dims': self.dims,
+                'num_rows': self.num_rows,
+                'index': dict((sense, np.array(rows, dtype=np.int64))
+                              for sense, rows in self.index.items())}
+        with open(self.path + '.index', 'wb') as outfile:
+            pickle.dump(meta, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def remove_instances(path):
+    for suffix in ('.index', '.data'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def load_instances(path, mmap_mode='r'):
+    '''
+    return: mapping sense -> matrix of instance embeddings (one row per
+    instance) or, for files in the old format, dict of lists of embeddings
+    '''
+    if not os.path.exists(path + '.index'):
+        with open(path, 'rb') as infile:
+            return pickle.load(infile)
+    with open(path + '.index', 'rb') as infile:
+        meta = pickle.load(infile)
+    if meta['num_rows'] == 0:
+        return dict()
+    data = np.memmap(path + '.data', dtype=np.dtype(meta['dtype']), mode=mmap_mode,
+                     shape=(meta['num_rows'], meta['dims']))
+    return InstanceEmbeddings(data, meta['index'])
+
+
+class InstanceEmbeddings(Mapping):
+    ''' Read-only dict sense -> matrix of instance embeddings, read on access '''
+
+    def __init__(self, data, index):
+        self.data = data
+        self.index = index
+
+    def __getitem__(self, sense):
+        return self.data[self.index[sense]]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
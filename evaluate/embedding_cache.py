@@ -0,0 +1,136 @@
+'''
+On-disk cache of context embeddings.
+
+Evaluations for different granularities (sensekey, synset, blc20, ...) and
+MFS settings encode the very same sentences again and again. EmbeddingCache
+stores the output of the LSTM in a memory-mapped matrix so that repeated runs
+only look the embeddings up.
+
+Entries are keyed by the word-id sequence of the sentence in which the target
+word has been replaced by <target> (so the key covers the target index too).
+Each model gets its own directory named after model_fingerprint() so that a
+retrained model never reads the embeddings of an older one. When the cache is
+full, the least recently used entries are dropped, an eighth at a time.
+
+The cache is not safe for concurrent writers: give every process that writes
+to it a different cache directory.
+'''
+import os
+import sys
+import hashlib
+import pickle
+from collections import OrderedDict
+import numpy as np
+
+
+def model_fingerprint(model_path):
+    '''
+    Hash of the trained weights: the checkpoint index (which changes with
+    every save) or, for an exported NumPy model, its weight files.
+    '''
+    if os.path.exists(model_path + '.index'):
+        paths = [model_path + '.index']
+    else:
+        weights_dir = model_path
+        if not os.path.isdir(weights_dir):
+            weights_dir = model_path + '-inference.numpy'
+        paths = [os.path.join(weights_dir, name + '.npy')
+                 for name in ('kernel', 'bias', 'context_layer_weights')]
+    sha1 = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class EmbeddingCache(object):
+    '''
+    cache_dir: root directory of the cache, shared by all models
+    fingerprint: identifies the model, see model_fingerprint()
+    size_mb: maximum size of the embedding matrix on disk
+
+    Call flush() or close() (or use a with block) to write the index to
+    disk, otherwise the new entries are lost.
+    '''
+
+    def __init__(self, cache_dir, fingerprint, size_mb=2048):
+        self.dir = os.path.join(cache_dir, fingerprint)
+        os.makedirs(self.dir, exist_ok=True)
+        self.index_path = os.path.join(self.dir, 'index.pkl')
+        self.matrix_path = os.path.join(self.dir, 'embeddings.npy')
+        self.size_mb = size_mb
+        self.slots = OrderedDict() # key -> row of matrix, least recently used first
+        self.free_slots = []
+        self.matrix = None
+        self.hits = self.misses = 0
+        if os.path.exists(self.index_path) and os.path.exists(self.matrix_path):
+            with open(self.index_path, 'rb') as f:
+                self.slots, self.free_slots = pickle.load(f)
+            self.matrix = np.load(self.matrix_path, mmap_mode='r+')
+
+    @staticmethod
+    def key(sentence_as_ids):
+        return hashlib.sha1(np.asarray(sentence_as_ids, dtype=np.int32).tobytes()).digest()
+
+    def get(self, key):
+        ''' Return a copy of the cached embedding or None '''
+        slot = self.slots.get(key)
+        if slot is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.slots.move_to_end(key)
+        return np.array(self.matrix[slot])
+
+    def put(self, key, embedding):
+        if self.matrix is None:
+            self._create_matrix(embedding)
+        slot = self.slots.pop(key, None)
+        if slot is None:
+            if not self.free_slots:
+                self._evict()
+            slot = self.free_slots.pop()
+        self.slots[key] = slot
+        self.matrix[slot] = embedding
+
+    def _evict(self):
+        '''
+        Free the least recently used eighth of the entries. The pages of the
+        memmap can reach the disk at any time, so the index is written before
+        the slots are reused: the index on disk never points at a slot that
+        holds the embedding of another sentence.
+        '''
+        for _ in range(max(1, len(self.slots) // 8)):
+            _, slot = self.slots.popitem(last=False)
+            self.free_slots.append(slot)
+        self.flush()
+
+    def _create_matrix(self, embedding):
+        embedding = np.asarray(embedding)
+        capacity = max(1, self.size_mb * 2**20 // embedding.nbytes)
+        self.matrix = np.lib.format.open_memmap(self.matrix_path, mode='w+',
+                                                dtype=embedding.dtype,
+                                                shape=(capacity, len(embedding)))
+        self.free_slots = list(range(capacity-1, -1, -1))
+
+    def flush(self):
+        ''' Write the matrix and the index to disk '''
+        if self.matrix is None: return
+        self.matrix.flush()
+        # write to a temporary file first so that a crash leaves the old index
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((self.slots, self.free_slots), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        self.flush()
+        sys.stderr.write('Embedding cache %s: %d hits, %d misses, %d entries\n'
+                         %(self.dir, self.hits, self.misses, len(self.slots)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,207 @@
+'''
+Run many perform_wsd.py configurations in one process.
+
+evaluate_in_parallel.sh starts one perform_wsd.py job per experiment and every
+job loads the LSTM model, the vocabulary and WordNet again and encodes the
+same competition again. This driver loads the model once, computes the target
+embeddings once per competition and the candidates once per competition and
+granularity, and then scores all experiments in a thread pool. Each experiment
+folder gets the same files as with perform_wsd.py (wsd_output.bin,
+results.txt, results.json, settings.json, system.key and the official scorer
+output).
+
+The meaning embeddings must have been created before, in
+<out_dir>/<experiment>/meaning_embeddings.bin (see one_full_experiment_v2.sh).
+
+python3 evaluate_all.py -m resources/model-h2048p512/lstm-wsd-gigaword-google \
+        -v resources/model-h2048p512/gigaword-lstm-wsd.index.pkl -o debug -f True,False
+
+With several values for -f, the output of each value goes to
+<experiment>-mfs_fallback_<value>.
+'''
+import os
+import sys
+import json
+import pickle
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+import numpy as np
+import pandas
+from context_encoder import open_encoder
+from sense_store import load_sense_store
+from wn_snapshot import load_wordnet
+from perform_wsd import encode_instances, select_candidates, disambiguate
+import score_utils
+import official_scorer
+
+
+# (experiment, base path of the competition files, granularity, use label propagation)
+# the same experiments as evaluate_in_parallel.sh
+framework_experiments = [
+    ('synset-se2-framework-semcor', 'higher_level_annotations/se2-aw-framework-synset-30_semcor', 'synset', False),
+    ('synset-se2-framework-omsti', 'higher_level_annotations/se2-aw-framework-synset-30_mun', 'synset', False),
+    ('synset-se2-framework-semcor_mun', 'higher_level_annotations/se2-aw-framework-synset-30_semcor_mun', 'synset', False),
+    ('synset-se2-framework-semcor_mun-lp', 'higher_level_annotations/se2-aw-framework-synset-30_semcor_mun', 'synset', True),
+    ('sensekey-se2-framework-semcor', 'higher_level_annotations/se2-aw-framework-sensekey-30_semcor', 'sensekey', False),
+    ('sensekey-se2-framework-omsti', 'higher_level_annotations/se2-aw-framework-sensekey-30_mun', 'sensekey', False),
+    ('sensekey-se2-framework-semcor_mun', 'higher_level_annotations/se2-aw-framework-sensekey-30_semcor_mun', 'sensekey', False),
+    ('synset-se13-framework-semcor', 'higher_level_annotations/se13-aw-framework-synset-30_semcor', 'synset', False),
+    ('synset-se13-framework-omsti', 'higher_level_annotations/se13-aw-framework-synset-30_mun', 'synset', False),
+    ('synset-se13-framework-semcor_mun', 'higher_level_annotations/se13-aw-framework-synset-30_semcor_mun', 'synset', False),
+    ('synset-se13-framework-semcor_mun-lp', 'higher_level_annotations/se13-aw-framework-synset-30_semcor_mun', 'synset', True),
+    ('sensekey-se13-framework-semcor', 'higher_level_annotations/se13-aw-framework-sensekey-30_semcor', 'sensekey', False),
+    ('sensekey-se13-framework-omsti', 'higher_level_annotations/se13-aw-framework-sensekey-30_mun', 'sensekey', False),
+    ('sensekey-se13-framework-semcor_mun', 'higher_level_annotations/se13-aw-framework-sensekey-30_semcor_mun', 'sensekey', False),
+]
+
+
+def read_experiments(path):
+    '''
+    read experiments from a file with one experiment per line:
+    experiment base granularity use_lp (separated by whitespace)
+    '''
+    experiments = []
+    with open(path) as infile:
+        for line in infile:
+            if not line.strip() or line.startswith('#'):
+                continue
+            name, base, gran, use_lp = line.split()
+            experiments.append((name, base, gran, use_lp == 'True'))
+    return experiments
+
+
+def wn_version_of(wsd_df_path):
+    ''' the same choice of WordNet as in perform_wsd.py '''
+    return '171' if '171' in wsd_df_path else '30'
+
+
+def load_pickle_if_exists(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as infile:
+        return pickle.load(infile)
+
+
+def run_experiment(settings, wsd_df, target_embeddings, candidates, wn, wn_lock):
+    '''
+    score one configuration and write its output the same way as perform_wsd.py
+
+    :rtype: float
+    :return: elapsed seconds
+    '''
+    start_sec = time()
+    exp_folder = settings['exp_folder']
+    os.makedirs(exp_folder, exist_ok=True)
+    with open(os.path.join(exp_folder, 'settings.json'), 'w') as outfile:
+        json.dump(settings, outfile)
+
+    sense_embeddings = load_sense_store(settings['sense_embeddings_path'])
+    # columns are replaced, not modified, so a shallow copy is enough
+    wsd_df = wsd_df.copy(deep=False)
+    num_correct = disambiguate(wsd_df, target_embeddings, candidates, sense_embeddings,
+                               sense_embeddings.meaning_freqs, settings['gran'],
+                               settings['mfs_fallback'])
+    print('%s: %d' %(exp_folder, num_correct))
+
+    wsd_df.to_pickle(settings['output_path'])
+    with open(settings['results'], 'w') as outfile:
+        outfile.write('%s' % num_correct)
+    results = score_utils.experiment_results(wsd_df, settings['mfs_fallback'], settings['wsd_df_path'])
+    with open(settings['results'].replace('.txt', '.json'), 'w') as outfile:
+        json.dump(results, outfile)
+
+    # WordNet readers share their file handles
+    with wn_lock:
+        official_scorer.create_key_file(wn, exp_folder, debug=1)
+    official_scorer.score_using_official_scorer(exp_folder,
+                                                scorer_folder='resources/WSD_Unified_Evaluation_Datasets')
+    return time() - start_sec
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Perform WSD for many experiments with one loaded LSTM model')
+    parser.add_argument('-m', dest='model_path', required=True, help='path to model trained LSTM model')
+    parser.add_argument('-v', dest='vocab_path', required=True, help='path to LSTM vocabulary')
+    parser.add_argument('-o', dest='out_dir', required=True, help='folder with one subfolder (with meaning_embeddings.bin) per experiment')
+    parser.add_argument('-f', dest='mfs_fallback', default='True', help='True, False or True,False')
+    parser.add_argument('-x', dest='experiments_path', help='file with experiments (default: the ones of evaluate_in_parallel.sh)')
+    parser.add_argument('-n', dest='num_threads', type=int, default=4, help='number of experiments scored at the same time')
+    parser.add_argument('-e', dest='encoder', default='tensorflow', help='tensorflow | numpy (requires export-inference-model.py)')
+    parser.add_argument('--cache_dir', help='directory of the context embedding cache (no caching if not given)')
+    parser.add_argument('--cache_size_mb', type=int, default=2048, help='maximum size of the embedding cache')
+    args = parser.parse_args()
+
+    experiments = framework_experiments
+    if args.experiments_path:
+        experiments = read_experiments(args.experiments_path)
+    mfs_fallbacks = [value == 'True' for value in args.mfs_fallback.split(',')]
+
+    # group the experiments by competition
+    competitions = dict()
+    for name, base, gran, use_lp in experiments:
+        competitions.setdefault(base + '.bin', []).append((name, base, gran, use_lp))
+
+    vocab = np.load(args.vocab_path)
+    wn_lock = threading.Lock()
+    timings = dict()
+    with open_encoder(args.model_path, vocab, args.encoder, cache_dir=args.cache_dir,
+                      cache_size_mb=args.cache_size_mb) as encoder, \
+            ThreadPoolExecutor(args.num_threads) as executor:
+        futures = []
+        for wsd_df_path, competition_experiments in competitions.items():
+            start_sec = time()
+            wsd_df = pandas.read_pickle(wsd_df_path)
+            target_embeddings = encode_instances(wsd_df, encoder)
+            timings['encoding %s' %wsd_df_path] = time() - start_sec
+
+            the_wn_version = wn_version_of(wsd_df_path)
+            wn = load_wordnet(the_wn_version)
+            candidates_cache = dict()
+            for name, base, gran, use_lp in competition_experiments:
+                lp_info = load_pickle_if_exists(base + '.lp.out') if use_lp else dict()
+                if lp_info is None:
+                    sys.stderr.write('Skipping %s: %s not found (run the label propagation first)\n'
+                                     %(name, base + '.lp.out'))
+                    continue
+                key = (gran, use_lp)
+                if key not in candidates_cache:
+                    start_sec = time()
+                    # the morphological strategies are not used in the experiments
+                    with wn_lock:
+                        candidates_cache[key] = select_candidates(wsd_df, wn, the_wn_version, gran,
+                                                                  False, False, None, None,
+                                                                  use_lp, lp_info)
+                    timings['candidates %s %s' %(wsd_df_path, key)] = time() - start_sec
+
+                for mfs_fallback in mfs_fallbacks:
+                    exp_folder = os.path.join(args.out_dir, name)
+                    sense_embeddings_path = os.path.join(exp_folder, 'meaning_embeddings.bin')
+                    if len(mfs_fallbacks) > 1:
+                        exp_folder += '-mfs_fallback_%s' %mfs_fallback
+                    if not os.path.exists(sense_embeddings_path):
+                        sys.stderr.write('Skipping %s: %s not found (run test-lstm_v2.py first)\n'
+                                         %(exp_folder, sense_embeddings_path))
+                        continue
+                    settings = {'model_path': args.model_path,
+                                'vocab_path': args.vocab_path,
+                                'wsd_df_path': wsd_df_path,
+                                'exp_folder': exp_folder,
+                                'sense_embeddings_path': sense_embeddings_path,
+                                'output_path': os.path.join(exp_folder, 'wsd_output.bin'),
+                                'results': os.path.join(exp_folder, 'results.txt'),
+                                'gran': gran,
+                                'mfs_fallback': mfs_fallback,
+                                'use_lp': use_lp,
+                                'path_lp': base + '.lp.out',
+                                'encoder': args.encoder}
+                    futures.append((exp_folder, executor.submit(run_experiment, settings, wsd_df,
+                                                                target_embeddings,
+                                                                candidates_cache[key], wn, wn_lock)))
+
+        for exp_folder, future in futures:
+            timings['scoring %s' %exp_folder] = future.result()
+
+    for stage, elapsed_sec in timings.items():
+        print('%s: %.2f sec' %(stage, elapsed_sec))
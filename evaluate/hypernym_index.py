@@ -0,0 +1,295 @@
+'''
+Hypernym closure of every synset, for synsets_graph_info().
+
+synsets_graph_info() (preprocess_hdn.py and wn_utils.py) calls
+lowest_common_hypernyms() and shortest_path_distance() for every ordered pair
+of synsets of a lemma and walks all hypernym_paths() of each synset. All of
+these search the hypernym graph again. HypernymIndex stores, for every
+synset, its ancestors (itself included) as a sorted array of rows together
+with their shortest distance, so that the lowest common hypernym is an
+intersection of two arrays:
+
+    meta.json                           WordNet version, reader, number of synsets, rank of *ROOT*
+    synset_keys, synset_order           (offset, data file) of each synset, sorted
+    synset_offsets, synset_pos          offset and pos of each synset
+    max_depths                          Synset.max_depth()
+    name_ranks                          rank of the synset name (ties of lowest_common_hypernyms)
+    ancestor_offsets, ancestors         sorted rows of the ancestors of each synset
+    ancestor_distances                  shortest distance to each of these ancestors
+    hypernym_offsets, hypernyms         hypernyms() + instance_hypernyms() of each synset
+
+under_lcs() gives the same result as the loops in synsets_graph_info() with
+simulate_root=True, provided the index was built from a reader that returns
+the hypernyms in the same order (the snapshot of wn_snapshot.py or NLTK 3.2).
+
+python3 hypernym_index.py -w 30
+'''
+import os
+import json
+import shutil
+import tempfile
+import argparse
+from collections import deque
+import numpy as np
+
+
+FILE_POS_CODE = {'n': 0, 'v': 1, 'a': 2, 's': 2, 'r': 3}
+
+ROOT = -1 # the root that simulate_root adds
+
+
+def default_index_path(wn_version):
+    cwd = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(cwd, 'resources', 'wordnet-%s.hypernyms' %wn_version)
+
+
+def _synset_key(synset):
+    return synset.offset() * 4 + FILE_POS_CODE[synset.pos()]
+
+
+def reader_tag(wn):
+    ''' the reader that an index is built from, readers can order the hypernyms differently '''
+    if type(wn).__name__ == 'WordNetSnapshot':
+        return 'snapshot'
+    import nltk
+    return 'nltk-%s' %nltk.__version__
+
+
+def num_synsets(wn):
+    if type(wn).__name__ == 'WordNetSnapshot':
+        return len(wn.synset_offsets)
+    return sum(1 for _ in wn.all_synsets())
+
+
+def _pack_lists(lists, dtype=np.int32):
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(values) for values in lists])
+    values = np.array([value for values in lists for value in values], dtype=dtype)
+    return values, offsets
+
+
+class HypernymIndex(object):
+    ''' index_dir: directory written by build_hypernym_index() '''
+
+    def __init__(self, index_dir, mmap_mode='r'):
+        with open(os.path.join(index_dir, 'meta.json')) as infile:
+            self.meta = json.load(infile)
+        self.root_rank = self.meta['root_rank']
+        # plain ndarray views: slicing a np.memmap is several times slower
+        load = lambda name: np.load(os.path.join(index_dir, name + '.npy'),
+                                    mmap_mode=mmap_mode).view(np.ndarray)
+        for name in ['synset_keys', 'synset_order', 'synset_offsets', 'synset_pos',
+                     'max_depths', 'name_ranks',
+                     'ancestor_offsets', 'ancestors', 'ancestor_distances',
+                     'hypernym_offsets', 'hypernyms']:
+            setattr(self, name, load(name))
+
+    def row(self, synset):
+        key = _synset_key(synset)
+        i = np.searchsorted(self.synset_keys, key)
+        assert i < len(self.synset_keys) and self.synset_keys[i] == key, 'unknown synset %s' %synset
+        return int(self.synset_order[i])
+
+    def synset(self, wn_instance, row):
+        return wn_instance._synset_from_pos_and_offset(self.synset_pos[row].decode('ascii'),
+                                                       int(self.synset_offsets[row]))
+
+    def _ancestors(self, row):
+        start, end = self.ancestor_offsets[row], self.ancestor_offsets[row+1]
+        return self.ancestors[start:end], self.ancestor_distances[start:end]
+
+    def lowest_common_hypernym(self, row1, row2):
+        ''' sy1.lowest_common_hypernyms(sy2, simulate_root=True)[0] (ROOT for the root) '''
+        common = np.intersect1d(self._ancestors(row1)[0], self._ancestors(row2)[0],
+                                assume_unique=True)
+        best_depth = self.max_depths[common].max() if len(common) else 0
+        candidates = common[self.max_depths[common] == best_depth]
+        best = ROOT
+        best_rank = self.root_rank if best_depth == 0 else None
+        for candidate in candidates:
+            rank = self.name_ranks[candidate]
+            if best_rank is None or rank < best_rank:
+                best, best_rank = int(candidate), rank
+        return best
+
+    def shortest_path_distance(self, row, ancestor):
+        ''' sy.shortest_path_distance(ancestor, simulate_root=True) for an ancestor of sy '''
+        if row == ancestor:
+            return 0
+        ancestors, distances = self._ancestors(row)
+        root_distance = distances.max() + 1
+        if ancestor == ROOT:
+            return int(root_distance)
+        ancestor_ancestors, ancestor_distances = self._ancestors(ancestor)
+        # the ancestors of ancestor are ancestors of row too
+        positions = np.searchsorted(ancestors, ancestor_ancestors)
+        distance = (distances[positions] + ancestor_distances).min()
+        return int(min(distance, root_distance + ancestor_distances.max() + 1))
+
+    def _reaches(self, row, ancestor):
+        ancestors = self._ancestors(row)[0]
+        i = np.searchsorted(ancestors, ancestor)
+        return i < len(ancestors) and ancestors[i] == ancestor
+
+    def under_lcs(self, wn_instance, synset, synsets):
+        '''
+        The part of synsets_graph_info() for one synset: the closest lowest
+        common hypernym with the other synsets (in the order of iteration)
+        and the last hypernym path through it.
+
+        :rtype: tuple
+        :return: (under_lcs, path_to_under_lcs) as synsets of wn_instance or
+        None if synset gets no entry
+        '''
+        row = self.row(synset)
+        min_path_distance = 100
+        closest_lcs = None
+        for other in synsets:
+            if other != synset:
+                lcs = self.lowest_common_hypernym(row, self.row(other))
+                path_distance = self.shortest_path_distance(row, lcs)
+                if path_distance < min_path_distance:
+                    closest_lcs = lcs
+                    min_path_distance = path_distance
+
+        if closest_lcs is None or closest_lcs == ROOT or closest_lcs == row:
+            return None
+
+        # the last of hypernym_paths() that contains closest_lcs: go up
+        # through the last hypernym from which closest_lcs can be reached
+        below_lcs = [row]
+        while below_lcs[-1] != closest_lcs:
+            current = below_lcs[-1]
+            hypernyms = self.hypernyms[self.hypernym_offsets[current]:self.hypernym_offsets[current+1]]
+            for hypernym in hypernyms[::-1]:
+                if self._reaches(int(hypernym), closest_lcs):
+                    below_lcs.append(int(hypernym))
+                    break
+        under_lcs = below_lcs[-2]
+        path_to_under_lcs = below_lcs[-3:0:-1]
+        return (self.synset(wn_instance, under_lcs),
+                [self.synset(wn_instance, path_row) for path_row in path_to_under_lcs])
+
+
+def build_hypernym_index(wn, wn_version, index_dir):
+    '''
+    Write the hypernym index of the WordNet reader wn to index_dir. The index
+    is written to a temporary directory first, an interrupted build leaves
+    index_dir as it was.
+    '''
+    parent_dir = os.path.dirname(os.path.abspath(index_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent_dir, prefix=os.path.basename(index_dir) + '.tmp')
+    try:
+        _write_hypernym_index(wn, wn_version, tmp_dir)
+        if os.path.exists(index_dir):
+            old_dir = tmp_dir + '.old'
+            os.replace(index_dir, old_dir)
+            os.replace(tmp_dir, index_dir)
+            shutil.rmtree(old_dir)
+        else:
+            os.replace(tmp_dir, index_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def _write_hypernym_index(wn, wn_version, index_dir):
+    synsets = list(wn.all_synsets())
+    keys = [_synset_key(synset) for synset in synsets]
+    row_of_key = dict((key, row) for row, key in enumerate(keys))
+    hypernym_rows = [[row_of_key[_synset_key(hypernym)]
+                      for hypernym in synset.hypernyms() + synset.instance_hypernyms()]
+                     for synset in synsets]
+
+    # breadth first like Synset._shortest_hypernym_paths
+    ancestor_lists = []
+    distance_lists = []
+    for row in range(len(synsets)):
+        distances = dict()
+        queue = deque([(row, 0)])
+        while queue:
+            current, distance = queue.popleft()
+            if current in distances:
+                continue
+            distances[current] = distance
+            queue.extend((hypernym, distance + 1) for hypernym in hypernym_rows[current])
+        ancestors = sorted(distances)
+        ancestor_lists.append(ancestors)
+        distance_lists.append([distances[ancestor] for ancestor in ancestors])
+
+    # like Synset.max_depth(), without recursion
+    max_depths = np.full(len(synsets), -1, dtype=np.int32)
+    for row in range(len(synsets)):
+        stack = [row]
+        while stack:
+            current = stack[-1]
+            pending = [hypernym for hypernym in hypernym_rows[current] if max_depths[hypernym] < 0]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            if hypernym_rows[current]:
+                max_depths[current] = 1 + max(max_depths[hypernym] for hypernym in hypernym_rows[current])
+            else:
+                max_depths[current] = 0
+
+    names = [synset.name() for synset in synsets] + ['*ROOT*']
+    name_ranks = np.empty(len(names), dtype=np.int32)
+    name_ranks[np.argsort(np.array(names, dtype=np.str_), kind='stable')] = np.arange(len(names))
+
+    save = lambda name, array: np.save(os.path.join(index_dir, name + '.npy'), array)
+    keys = np.array(keys, dtype=np.int64)
+    order = np.argsort(keys, kind='stable')
+    save('synset_keys', keys[order])
+    save('synset_order', order.astype(np.int32))
+    save('synset_offsets', np.array([synset.offset() for synset in synsets], dtype=np.int64))
+    save('synset_pos', np.array([synset.pos() for synset in synsets], dtype=np.bytes_))
+    save('max_depths', max_depths)
+    save('name_ranks', name_ranks[:-1])
+    ancestors, ancestor_offsets = _pack_lists(ancestor_lists)
+    save('ancestors', ancestors)
+    save('ancestor_offsets', ancestor_offsets)
+    save('ancestor_distances', _pack_lists(distance_lists)[0])
+    hypernyms, hypernym_offsets = _pack_lists(hypernym_rows)
+    save('hypernyms', hypernyms)
+    save('hypernym_offsets', hypernym_offsets)
+    with open(os.path.join(index_dir, 'meta.json'), 'w') as outfile:
+        json.dump({'wn_version': wn_version,
+                   'reader': reader_tag(wn),
+                   'num_synsets': len(synsets),
+                   'root_rank': int(name_ranks[-1])}, outfile)
+
+
+def _matches(index_dir, wn, wn_version):
+    ''' whether index_dir has a complete index built from the same reader as wn '''
+    meta_path = os.path.join(index_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as infile:
+        meta = json.load(infile)
+    return (meta['wn_version'] == wn_version and meta.get('reader') == reader_tag(wn) and
+            meta['num_synsets'] == num_synsets(wn))
+
+
+def load_hypernym_index(wn, wn_version):
+    '''
+    The index in resources, (re)built from wn first if there is none or if
+    it was built from another reader
+    '''
+    index_dir = default_index_path(wn_version)
+    if not _matches(index_dir, wn, wn_version):
+        build_hypernym_index(wn, wn_version, index_dir)
+    return HypernymIndex(index_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the hypernym index of a WordNet version')
+    parser.add_argument('-w', dest='wn_version', default='30', help='30 | 171')
+    parser.add_argument('-o', dest='output_dir', help='default: resources/wordnet-<wn_version>.hypernyms')
+    args = parser.parse_args()
+
+    from wn_snapshot import load_wordnet
+    output_dir = args.output_dir or default_index_path(args.wn_version)
+    build_hypernym_index(load_wordnet(args.wn_version), args.wn_version, output_dir)
+    print('Written %s' %output_dir)
@@ -42,6 +42,13 @@ cd ..
 # git clone WordNetMapper
 git clone --depth=1 https://github.com/MartenPostma/WordNetMapper
 
+# compile the WordNet snapshots (fast loading, see wn_snapshot.py)
+python3 wn_snapshot.py -w 30
+python3 wn_snapshot.py -w 171
+
+# hypernym closure index (synsets_graph_info, see hypernym_index.py)
+python3 hypernym_index.py -w 30
+
 echo `date`
 
 
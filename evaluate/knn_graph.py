@@ -0,0 +1,212 @@
+'''
+Approximate k-nearest-neighbour graphs for label propagation.
+
+LabelPropagation.affinity_func() computes the similarities of all n x n
+pairs of instances of a lemma, which does not fit in memory for lemmas
+with tens of thousands of instances. KNNGraph builds a sparse graph that
+connects every instance to (approximately) its k most similar instances:
+
+1. random projection forest: every tree splits the instances recursively
+   at the median of their projection on a random direction until at most
+   leaf_size instances are left; similarities are only computed within
+   the leaves
+2. neighbour-of-neighbour refinement (one step of NN-descent): the
+   neighbours of the neighbours of an instance are candidates too
+
+The similarities are those of sim_func (expander or RBF in
+label_propagation.py), computed on blocks of instances. With the dot
+product (expander) the largest similarities are not the nearest vectors,
+so the trees split vectors that are augmented with sqrt(M^2 - |x|^2),
+which turns the largest dot products into the smallest euclidean
+distances (Bachrach et al., 2014).
+
+Recall against the exact graph, on the lemmas with the most instances:
+
+python3 knn_graph.py -m model -v vocab.index.pkl -i system_input -s expander
+'''
+import argparse
+from time import time
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def _top_columns(sims, k):
+    ''' column indices of the k largest values of each row (unordered) '''
+    if k >= sims.shape[1]:
+        return np.tile(np.arange(sims.shape[1]), (sims.shape[0], 1))
+    return np.argpartition(-sims, k-1, axis=1)[:,:k]
+
+
+def _merge(indices, sims, new_indices, new_sims, k):
+    ''' the k most similar of two candidate lists per row, without duplicates '''
+    indices = np.concatenate([indices, new_indices], axis=1)
+    sims = np.concatenate([sims, new_sims], axis=1)
+    order = np.argsort(indices, axis=1, kind='stable')
+    indices = np.take_along_axis(indices, order, axis=1)
+    sims = np.take_along_axis(sims, order, axis=1)
+    duplicate = np.zeros(indices.shape, dtype=bool)
+    duplicate[:,1:] = indices[:,1:] == indices[:,:-1]
+    sims[duplicate | (indices < 0)] = -np.inf
+    top = _top_columns(sims, k)
+    return np.take_along_axis(indices, top, axis=1), np.take_along_axis(sims, top, axis=1)
+
+
+class KNNGraph(object):
+    '''
+    num_neighbors: k, the number of neighbours of each instance
+    metric: 'dot' (expander) or 'euclidean' (RBF), how the trees split
+    min_size: smaller lemmas should use the exact (dense) graph
+    '''
+
+    def __init__(self, num_neighbors=10, metric='dot', num_trees=8, leaf_size=128,
+                 num_refinements=1, min_size=5000, seed=93285):
+        self.num_neighbors = num_neighbors
+        self.metric = metric
+        self.num_trees = num_trees
+        self.leaf_size = leaf_size
+        self.num_refinements = num_refinements
+        self.min_size = min_size
+        self.seed = seed
+
+    def _split_vectors(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if self.metric == 'dot':
+            norms = (X*X).sum(axis=1)
+            X = np.hstack([X, np.sqrt(norms.max() - norms)[:,np.newaxis]])
+        return X
+
+    def _leaves(self, X, rng):
+        ''' the leaves of one random projection tree '''
+        leaves = []
+        stack = [np.arange(len(X))]
+        while stack:
+            node = stack.pop()
+            if len(node) <= self.leaf_size:
+                leaves.append(node)
+                continue
+            projections = X[node].dot(rng.randn(X.shape[1]))
+            half = len(node) // 2
+            order = np.argpartition(projections, half)
+            stack.append(node[order[:half]])
+            stack.append(node[order[half:]])
+        return leaves
+
+    def neighbors(self, X, sim_func):
+        '''
+        :return: (indices, sims), two [n, k] matrices, the neighbours of each
+        instance and their similarities (-inf and an arbitrary index where an
+        instance has fewer than k neighbours)
+        '''
+        n, k = len(X), min(self.num_neighbors, len(X)-1)
+        indices = np.full((n, k), -1, dtype=np.int64)
+        sims = np.full((n, k), -np.inf)
+        if k <= 0:
+            return indices, sims
+        rng = np.random.RandomState(self.seed)
+        split_vectors = self._split_vectors(X)
+        first_leaves = None
+        for _ in range(self.num_trees):
+            leaves = self._leaves(split_vectors, rng)
+            if first_leaves is None:
+                first_leaves = leaves
+            new_indices = np.full((n, k), -1, dtype=np.int64)
+            new_sims = np.full((n, k), -np.inf)
+            for leaf in leaves:
+                leaf_sims = np.asarray(sim_func(X[leaf], X[leaf]), dtype=np.float64)
+                np.fill_diagonal(leaf_sims, -np.inf)
+                top = _top_columns(leaf_sims, min(k, len(leaf)))
+                new_indices[leaf,:top.shape[1]] = leaf[top]
+                new_sims[leaf,:top.shape[1]] = np.take_along_axis(leaf_sims, top, axis=1)
+            indices, sims = _merge(indices, sims, new_indices, new_sims, k)
+
+        for _ in range(self.num_refinements):
+            new_indices = np.full((n, k*k), -1, dtype=np.int64)
+            new_sims = np.full((n, k*k), -np.inf)
+            # the instances of a leaf have similar neighbours, so a leaf
+            # needs one block of similarities
+            for leaf in first_leaves:
+                candidates = np.where(indices[leaf] >= 0, indices[leaf], leaf[:,np.newaxis])
+                candidates = indices[candidates].reshape(len(leaf), -1)
+                columns, positions = np.unique(candidates, return_inverse=True)
+                positions = positions.reshape(candidates.shape)
+                block = np.asarray(sim_func(X[leaf], X[columns]), dtype=np.float64)
+                new_sims[leaf] = np.take_along_axis(block, positions, axis=1)
+                new_indices[leaf] = candidates
+            new_sims[new_indices == np.arange(n)[:,np.newaxis]] = -np.inf
+            indices, sims = _merge(indices, sims, new_indices, new_sims, k)
+        return indices, sims
+
+    def __call__(self, X, sim_func):
+        '''
+        :return: symmetric csr_matrix of similarities, an edge (u, v) exists
+        if v is a neighbour of u or u a neighbour of v
+        '''
+        n = len(X)
+        indices, sims = self.neighbors(X, sim_func)
+        rows = np.repeat(np.arange(n), indices.shape[1])
+        cols, sims = indices.ravel(), sims.ravel()
+        valid = np.isfinite(sims)
+        rows, cols, sims = rows[valid], cols[valid], sims[valid]
+        rows, cols, sims = (np.concatenate([rows, cols]), np.concatenate([cols, rows]),
+                            np.concatenate([sims, sims]))
+        _, first = np.unique(rows * n + cols, return_index=True)
+        return csr_matrix((sims[first], (rows[first], cols[first])), shape=(n, n))
+
+
+def exact_neighbors(X, sim_func, k, block_size=1024):
+    ''' like KNNGraph.neighbors, computed exactly (row blocks of sim_func) '''
+    n, k = len(X), min(k, len(X)-1)
+    indices = np.empty((n, k), dtype=np.int64)
+    for start in range(0, n, block_size):
+        stop = min(n, start+block_size)
+        block = np.asarray(sim_func(X[start:stop], X), dtype=np.float64)
+        block[np.arange(stop-start), np.arange(start, stop)] = -np.inf
+        indices[start:stop] = _top_columns(block, k)
+    return indices
+
+
+def recall(indices, exact_indices):
+    ''' the proportion of the exact neighbours that are found '''
+    found = sum(len(np.intersect1d(row, exact_row))
+                for row, exact_row in zip(indices, exact_indices))
+    return found / float(exact_indices.size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recall of the approximate kNN graph on the largest lemmas of a label propagation input')
+    parser.add_argument('-m', dest='model_path', required=True, help='path to model trained LSTM model')
+    parser.add_argument('-v', dest='vocab_path', required=True, help='path to LSTM vocabulary')
+    parser.add_argument('-i', dest='system_input', required=True, help='label propagation input (pickle, see debug_lp.py)')
+    parser.add_argument('-s', dest='sim', default='expander', help='expander | rbf')
+    parser.add_argument('-g', dest='gamma', type=float, default=1.0, help='gamma of the RBF kernel')
+    parser.add_argument('-k', dest='num_neighbors', type=int, default=10)
+    parser.add_argument('-n', dest='num_lemmas', type=int, default=10, help='number of lemmas (the ones with the most instances)')
+    parser.add_argument('--num_trees', type=int, default=8)
+    parser.add_argument('--leaf_size', type=int, default=128)
+    parser.add_argument('--cache_dir', help='directory of the context embedding cache (no caching if not given)')
+    args = parser.parse_args()
+
+    import pickle
+    from label_propagation import LabelPropagation, expander, RBF
+    sim_func = RBF(args.gamma) if args.sim == 'rbf' else expander
+    graph = KNNGraph(args.num_neighbors, 'euclidean' if args.sim == 'rbf' else 'dot',
+                     num_trees=args.num_trees, leaf_size=args.leaf_size)
+    with open(args.system_input, 'rb') as infile:
+        system_input = pickle.load(infile)
+    lemmas = sorted(system_input, key=lambda lemma: len(system_input[lemma]), reverse=True)
+    sample = dict((lemma, system_input[lemma]) for lemma in lemmas[:args.num_lemmas])
+    # without a session, the NumPy implementation of the LSTM is used
+    lp = LabelPropagation(None, args.vocab_path, args.model_path, 1000, sim_func=sim_func,
+                          cache_dir=args.cache_dir)
+    converted_data, _ = lp._convert_sense_ids(sample)
+    lemma2contexts = lp._run_lstm(converted_data)
+    print('\t'.join(['lemma', '#', 'recall', 'approximate_sec', 'exact_sec']))
+    for lemma, contexts in lemma2contexts.items():
+        start_sec = time()
+        indices, _ = graph.neighbors(contexts, sim_func)
+        approximate_sec = time() - start_sec
+        start_sec = time()
+        exact_indices = exact_neighbors(contexts, sim_func, args.num_neighbors)
+        exact_sec = time() - start_sec
+        print('%s\t%d\t%.4f\t%.2f\t%.2f' %(lemma, len(contexts), recall(indices, exact_indices),
+                                           approximate_sec, exact_sec))
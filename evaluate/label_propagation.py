@@ -4,8 +4,45 @@ from sklearn.metrics.pairwise import euclidean_distances
 from collections import Counter
 from scipy.sparse.csr import csr_matrix
 import sys
+from multiprocessing import Pool
 from sklearn import semi_supervised
 from _collections import defaultdict
+from context_encoder import ContextEncoder, TFModel, open_cache
+from numpy_lstm import NumpyLSTM
+from knn_graph import KNNGraph
+from lp_solver import propagate_labels
+
+# statistics of affinity_func() and the solver, summed over the worker processes
+GRAPH_COUNTERS = ('adding_edges_elapsed_sec', 'num_low_degree_vertices',
+                  'num_added_edges', 'num_total_edges', 'num_iterations')
+# what the worker processes need to run _apply_label_propagation_model()
+WORKER_SETTINGS = ('sim_func', 'knn_graph', 'similarity_threshold',
+                   'minimum_vertex_degree', 'solver', 'stable_iterations',
+                   'warm_start', 'debugging')
+
+
+def _init_worker(lp_class, settings, shm_name, shape, dtype):
+    global worker_lp, worker_shm, worker_contexts
+    from multiprocessing import shared_memory
+    # no model is loaded in the workers, only the graph settings are needed
+    worker_lp = lp_class.__new__(lp_class)
+    worker_lp.__dict__.update(settings)
+    worker_shm = shared_memory.SharedMemory(name=shm_name)
+    worker_contexts = np.ndarray(shape, dtype=dtype, buffer=worker_shm.buf)
+
+
+def _propagate_lemma(lemma, start, stop, labels, previous_run):
+    for name in GRAPH_COUNTERS:
+        setattr(worker_lp, name, 0)
+    # the warm start distributions travel with the lemma
+    worker_lp.lemma2distributions = {}
+    if previous_run is not None:
+        worker_lp.lemma2distributions[lemma] = previous_run
+    predicted_indices = worker_lp._apply_label_propagation_model(
+            worker_contexts[start:stop], labels, lemma)
+    return (lemma, list(predicted_indices),
+            dict((name, getattr(worker_lp, name)) for name in GRAPH_COUNTERS),
+            worker_lp.lemma2distributions.get(lemma))
 
 class RBF(object):
     def __init__(self, gamma):
@@ -21,24 +58,71 @@ def expander(X, Y):
     '''
     return X.dot(Y.T)
 
+def largest_indices(values, k, mask=None, ordered=True):
+    '''
+    Flat indices of the k largest values, ties are broken by position, i.e.
+    the first k of a stable argsort of -values, without sorting all values.
+    
+    mask: only consider the positions where mask is True
+    ordered: return the indices in the order of the argsort
+    '''
+    values = values.ravel()
+    candidates = values if mask is None else values[mask.ravel()]
+    k = max(0, min(k, len(candidates)))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    threshold = np.partition(candidates, len(candidates)-k)[len(candidates)-k]
+    above, ties = values > threshold, values == threshold
+    if mask is not None:
+        above &= mask.ravel()
+        ties &= mask.ravel()
+    above = np.flatnonzero(above)
+    indices = np.concatenate([above, np.flatnonzero(ties)[:k-len(above)]])
+    if ordered:
+        indices = indices[np.lexsort((indices, -values[indices]))]
+    return indices
+
 class LabelPropagation(object):
     
-    def __init__(self, sess, vocab_path, model_path, batch_size, sim_func=expander):
+    variant = 'propagation'
+    
+    def __init__(self, sess, vocab_path, model_path, batch_size, sim_func=expander,
+                 cache_dir=None, knn_graph=None, num_workers=1, solver='native',
+                 stable_iterations=None, warm_start=False):
+        '''
+        knn_graph: a knn_graph.KNNGraph, lemmas with at least knn_graph.min_size
+        instances get an approximate k-nearest-neighbour graph instead of the
+        dense one (see affinity_func)
+        num_workers: number of processes that propagate the labels of
+        different lemmas (see _propagate_in_parallel)
+        solver: 'native' (lp_solver.propagate_labels) or 'sklearn'
+        stable_iterations: the native solver stops when the labels have not
+        changed for so many iterations (None: the exact result of sklearn;
+        10 is about 3x faster and changes about 0.1% of the labels)
+        warm_start: the native solver starts from the label distributions of
+        the previous prediction of a lemma (same instances and senses)
+        model_path: None for an instance without an LSTM, whose contexts are
+        computed elsewhere (see lp_sweep.py)
+        '''
         self.sess = sess
+        self.knn_graph = knn_graph
+        self.num_workers = num_workers
+        self.solver = solver
+        self.stable_iterations = stable_iterations
+        self.warm_start = warm_start
+        self.lemma2distributions = {}
         self.batch_size = batch_size
         self.sim_func = sim_func
-        self.vocab = np.load(vocab_path)
-        import tensorflow as tf
-        saver = tf.train.import_meta_graph(model_path + '.meta', clear_devices=True)
-        start_sec = time()
-        sys.stdout.write('Loading model from %s... ' %model_path)
-        saver.restore(sess, model_path)
-        sys.stdout.write('Done (%.0f sec).\n' %(time()-start_sec))
-#         self.predicted_context_embs = sess.graph.get_tensor_by_name('Model/predicted_context_embs:0')
-#         self.x = sess.graph.get_tensor_by_name('Model/x:0')
-        self.x = sess.graph.get_tensor_by_name('Model_1/x:0')
-        self.predicted_context_embs = sess.graph.get_tensor_by_name('Model_1/predicted_context_embs:0')
-        self.lens = sess.graph.get_tensor_by_name('Model_1/lens:0')
+        self.encoder = None
+        if model_path is not None:
+            self.vocab = np.load(vocab_path)
+            start_sec = time()
+            sys.stdout.write('Loading model from %s... ' %model_path)
+            # without a session, use the NumPy implementation of the LSTM
+            model = TFModel(sess, model_path) if sess is not None else NumpyLSTM.load(model_path)
+            self.encoder = ContextEncoder(self.vocab, model, max_batch_size=batch_size,
+                                          cache=open_cache(model_path, cache_dir))
+            sys.stdout.write('Done (%.0f sec).\n' %(time()-start_sec))
         self.similarity_threshold = 0.95
         self.minimum_vertex_degree = 10
         self.predicting_elapsed_sec = 0
@@ -47,6 +131,7 @@ class LabelPropagation(object):
         self.num_all_vertices = 0
         self.num_added_edges = 0
         self.num_total_edges = 0
+        self.num_iterations = 0
         self.debugging = False
         
     def _convert_sense_ids(self, data):
@@ -65,76 +150,79 @@ class LabelPropagation(object):
                 data2[lemma].append((sense_id, sentence_tokens, target_index))
         return data2, ids
         
-    def _apply_label_propagation_model(self, contexts, labels):
-        label_prop_model = semi_supervised.LabelPropagation(kernel=self.affinity_func)
-        label_prop_model.fit(contexts, labels)
-        return label_prop_model.transduction_
+    def _apply_label_propagation_model(self, contexts, labels, lemma=None):
+        if self.solver == 'sklearn':
+            label_prop_model = self._sklearn_model()
+            label_prop_model.fit(contexts, labels)
+            return label_prop_model.transduction_
+        initial_distributions = None
+        if self.warm_start and lemma in self.lemma2distributions:
+            previous_labels, previous_distributions = self.lemma2distributions[lemma]
+            if np.array_equal(previous_labels, labels):
+                initial_distributions = previous_distributions
+        graph = self.affinity_func(contexts, contexts)
+        classes, distributions, num_iterations = propagate_labels(
+                graph, labels, self.variant, stable_iterations=self.stable_iterations,
+                initial_distributions=initial_distributions)
+        self.num_iterations += num_iterations
+        if self.warm_start:
+            self.lemma2distributions[lemma] = (np.array(labels), distributions)
+        return classes[np.argmax(distributions, axis=1)]
+
+    def _sklearn_model(self):
+        return semi_supervised.LabelPropagation(kernel=self.affinity_func)
             
     def affinity_func(self, X1, X2):
         assert X1 is X2, "Unsupported case: two different sets of vectors"
         contexts = X1
         num_examples = len(contexts)
+        if self.knn_graph is not None and num_examples >= self.knn_graph.min_size:
+            # the n x n similarities would not fit in memory
+            graph = self.knn_graph(contexts, self.sim_func)
+            self.num_total_edges += graph.nnz // 2
+            return graph
         sims = self.sim_func(contexts, contexts)
-        sorted_indices = np.dstack(np.unravel_index(np.argsort(-sims.ravel()), 
-                                                    sims.shape))[0]
-        sorted_indices = [(u, v) for u, v in sorted_indices if u < v] # keep only one of two equivalent pairs
+        # the most similar pairs, keep only one of two equivalent pairs (u < v)
+        upper = np.triu(np.ones((num_examples, num_examples), dtype=bool), 1)
         num_most_similar_pairs = int(num_examples*(num_examples-1)*(1-self.similarity_threshold))
-        selected_pairs = set(pair for pair in sorted_indices[:num_most_similar_pairs])
-        sorted_within_row_indices = np.argsort(-sims)
+        adjacent = np.zeros((num_examples, num_examples), dtype=bool)
+        adjacent.flat[largest_indices(sims, num_most_similar_pairs, upper, ordered=False)] = True
+        adjacent |= adjacent.T.copy()
+        degree = adjacent.sum(axis=1)
         # add edges to low-connectivity vertices
-        degree = Counter()
-        degree.update(u for u, _ in selected_pairs)
-        degree.update(v for _, v in selected_pairs)
         adding_edges_start_sec = time()
-        for v in range(num_examples):
+        # the degrees only grow, so only these vertices can need edges, and
+        # each of them visits at most 2*minimum_vertex_degree-1 neighbours
+        # (the ones that are already adjacent count towards the degree)
+        num_candidates = 2*self.minimum_vertex_degree
+        for v in np.flatnonzero(degree < self.minimum_vertex_degree):
             if degree[v] < self.minimum_vertex_degree: 
                 self.num_low_degree_vertices += 1
-                for idx in sorted_within_row_indices[v]:
-                    if degree[v] >= self.minimum_vertex_degree: break
-                    if (v, idx) not in selected_pairs and (idx, v) not in selected_pairs:
-                        selected_pairs.add((v, idx))
-                        degree[v] += 1
-                        degree[idx] += 1
-                        self.num_added_edges += 1
+                candidates = largest_indices(sims[v], num_candidates)
+                candidates = candidates[~adjacent[v, candidates]]
+                # an edge to itself adds 2 to the degree
+                increments = np.where(candidates == v, 2, 1)
+                degree_before = degree[v] + np.cumsum(increments) - increments
+                added = candidates[degree_before < self.minimum_vertex_degree]
+                adjacent[v, added] = adjacent[added, v] = True
+                degree[added] += 1
+                degree[v] += len(added)
+                self.num_added_edges += len(added)
         self.adding_edges_elapsed_sec += (time() - adding_edges_start_sec)
-        self.num_total_edges += len(selected_pairs) 
-        # make the matrix
-        sims, rows, cols = zip(*[(sims[u,v], u,v) for u,v in selected_pairs] +
-                                [(sims[v,u], v,u) for u,v in selected_pairs])
+        self.num_total_edges += np.count_nonzero(np.triu(adjacent))
+        # make the matrix (an edge to itself is counted in both directions)
+        rows, cols = np.nonzero(adjacent)
+        sims = sims[rows, cols]
+        sims[rows == cols] *= 2
         return csr_matrix((sims, (rows, cols)), shape=(num_examples,num_examples))
         
-    def _pad(self, list_of_lists, pad_id):
-        max_len = max(len(s) for s in list_of_lists)
-        for s in list_of_lists:
-            while len(s) < max_len:
-                s.append(pad_id)
-        return list_of_lists
-        
     def _run_lstm(self, converted_data):
         print('Running LSTM...')
-        # create one big matrix of LSTM input
-        lstm_input = []
-        target_id = self.vocab['<target>']
-        pad_id = self.vocab['<pad>']
-        for lemma in converted_data:
-            for _, sentence_tokens, target_index in converted_data[lemma]:
-                sentence_as_ids = [self.vocab.get(w) or self.vocab['<unkn>'] 
-                                   for w in sentence_tokens]
-                sentence_as_ids[target_index] = target_id
-                lstm_input.append(sentence_as_ids)
-        lens = np.array([len(s) for s in lstm_input])
-        self._pad(lstm_input, pad_id)
-        lstm_input = np.array(lstm_input)
-        # process the input in batches
-        lstm_output = []
-        for batch_no, batch_start in enumerate(range(0, len(lstm_input), self.batch_size)):
-            batch_end = min(len(lstm_input), batch_start+self.batch_size)
-            lstm_output.append(self.sess.run(self.predicted_context_embs, 
-                                             {self.x: lstm_input[batch_start:batch_end], 
-                                              self.lens: lens[batch_start:batch_end]}))
-            if (batch_no+1) % 100 == 0:
-                print('Batch #%d...' %(batch_no+1))
-        lstm_output = np.vstack(lstm_output)
+        lstm_output = self.encoder.encode((sentence_tokens, target_index)
+                                          for lemma in converted_data
+                                          for _, sentence_tokens, target_index in converted_data[lemma])
+        if self.encoder.cache is not None:
+            self.encoder.cache.flush()
         # unpack the output into a mapping {lemma --> contexts}
         lemma2contexts = {}
         start = 0
@@ -166,25 +254,86 @@ class LabelPropagation(object):
         lemma2context = self._run_lstm(converted_data)
         
         output = {}
+        if self.num_workers > 1:
+            lemma2predicted_indices = self._propagate_in_parallel(converted_data, lemma2context)
         for lemma_no, (lemma, contexts) in enumerate(lemma2context.items()):
             if self.debugging and lemma_no >= 100: break # for debugging
-            print("Lemma #%d of %d: %s" %(lemma_no, len(converted_data), lemma))
-            labels = [sense for sense, _, _ in converted_data[lemma]]
-            predicted_indices = self._apply_label_propagation_model(contexts, labels)
+            if self.num_workers > 1:
+                predicted_indices = lemma2predicted_indices[lemma]
+            else:
+                print("Lemma #%d of %d: %s" %(lemma_no, len(converted_data), lemma))
+                labels = [sense for sense, _, _ in converted_data[lemma]]
+                predicted_indices = self._apply_label_propagation_model(contexts, labels, lemma)
             output[lemma] = [sense_ids[index] for index in predicted_indices]
             sense_counts[lemma].update(output[lemma])
             if self.debugging: print(sense_counts[lemma].most_common())
             
         self.predicting_elapsed_sec += (time()-start_sec)
         return output
+
+    def _propagate_in_parallel(self, converted_data, lemma2context):
+        '''
+        Run _apply_label_propagation_model for every lemma in a pool of
+        num_workers processes. The contexts are copied once into shared
+        memory, the workers only receive the rows of a lemma. The largest
+        lemmas are sent first to balance the load.
+        
+        output format: dict(lemma -> predicted indices)
+        '''
+        # Python 3.8+, only needed with several workers
+        from multiprocessing import shared_memory
+        lemmas = list(lemma2context)
+        if self.debugging: lemmas = lemmas[:100] # for debugging
+        sizes = [len(lemma2context[lemma]) for lemma in lemmas]
+        first = next((lemma2context[lemma] for lemma in lemmas if len(lemma2context[lemma])), None)
+        if first is None: 
+            return dict((lemma, []) for lemma in lemmas)
+        shape, dtype = (sum(sizes), first.shape[1]), first.dtype
+        shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape))*dtype.itemsize))
+        try:
+            contexts = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            tasks = []
+            start = 0
+            for lemma, size in zip(lemmas, sizes):
+                contexts[start:start+size] = lemma2context[lemma]
+                labels = [sense for sense, _, _ in converted_data[lemma]]
+                tasks.append((lemma, start, start+size, labels,
+                              self.lemma2distributions.get(lemma) if self.warm_start else None))
+                start += size
+            del contexts
+            tasks.sort(key=lambda task: task[2]-task[1], reverse=True)
+            settings = dict((name, getattr(self, name)) for name in WORKER_SETTINGS)
+            lemma2predicted_indices = {}
+            with Pool(self.num_workers, initializer=_init_worker,
+                      initargs=(type(self), settings, shm.name, shape, dtype)) as pool:
+                results = [pool.apply_async(_propagate_lemma, task) for task in tasks]
+                for lemma_no, result in enumerate(results):
+                    lemma, predicted_indices, counters, distributions = result.get()
+                    print("Lemma #%d of %d: %s" %(lemma_no, len(tasks), lemma))
+                    lemma2predicted_indices[lemma] = predicted_indices
+                    if distributions is not None:
+                        self.lemma2distributions[lemma] = distributions
+                    for name, value in counters.items():
+                        setattr(self, name, getattr(self, name) + value)
+        finally:
+            shm.close()
+            shm.unlink()
+        return lemma2predicted_indices
     
     def print_stats(self):
         print('Predicting time: %.2f min' %(self.predicting_elapsed_sec/60.0))
-        print('Time for adding edges: %.2f min (%.2f%% of total time)' 
-              %(self.adding_edges_elapsed_sec/60.0, 
-                self.adding_edges_elapsed_sec*100.0/self.predicting_elapsed_sec))
+        if self.num_workers > 1:
+            # the workers run at the same time, their times add up to more than the total
+            print('Time for adding edges: %.2f min (summed over the workers)' 
+                  %(self.adding_edges_elapsed_sec/60.0))
+        else:
+            print('Time for adding edges: %.2f min (%.2f%% of total time)' 
+                  %(self.adding_edges_elapsed_sec/60.0, 
+                    self.adding_edges_elapsed_sec*100.0/self.predicting_elapsed_sec))
         print('Number of vertices with low connectivity: %d (%.2f%% of all vertices)' 
               %(self.num_low_degree_vertices, self.num_low_degree_vertices*100.0/self.num_all_vertices))
+        if self.solver != 'sklearn':
+            print('Number of label propagation iterations: %d' %self.num_iterations)
         
     
 class LabelSpreading(LabelPropagation):
@@ -193,10 +342,10 @@ class LabelSpreading(LabelPropagation):
     a very skewed distribution, we might end up with infrequent senses being
     overridden. '''
     
-    def _apply_label_propagation_model(self, contexts, labels):
-        label_prop_model = semi_supervised.LabelSpreading(kernel=self.affinity_func)
-        label_prop_model.fit(contexts, labels)
-        return label_prop_model.transduction_    
+    variant = 'spreading'
+    
+    def _sklearn_model(self):
+        return semi_supervised.LabelSpreading(kernel=self.affinity_func)
     
 class NearestNeighbor(LabelPropagation):
     ''' This is a baseline to evaluate label propagation models '''
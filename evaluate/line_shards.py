@@ -0,0 +1,61 @@
+'''
+Split a text file into ranges of whole lines for worker processes.
+
+preprocess_hdn.py and test-lstm_v2.py read their input in num_workers parts.
+shard_offsets() returns the byte offsets of the parts, each of them starts at
+the beginning of a line, and read_lines() reads the lines of one part, so the
+workers only need the path and two offsets instead of the lines themselves.
+'''
+import os
+
+
+def shard_offsets(input_path, num_shards, end=None):
+    """
+    split the first end bytes of a file into ranges of whole lines
+
+    :param int end: byte offset of the end of the last range, must be the
+    start of a line (default: the whole file)
+
+    :rtype: list
+    :return: list of (start, end) byte offsets
+    """
+    if end is None:
+        end = os.path.getsize(input_path)
+    boundaries = [0]
+    with open(input_path, 'rb') as infile:
+        for shard_no in range(1, num_shards):
+            infile.seek(end * shard_no // num_shards)
+            infile.readline() # move to the start of the next line
+            boundaries.append(max(boundaries[-1], min(infile.tell(), end)))
+    boundaries.append(end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def line_offset(input_path, line_no):
+    """
+    :rtype: int
+    :return: byte offset of the start of line line_no (counted from 0), None
+    if the file has fewer lines
+    """
+    offset = 0
+    with open(input_path, 'rb') as infile:
+        for current_line_no, line in enumerate(infile):
+            if current_line_no == line_no:
+                return offset
+            offset += len(line)
+    return None
+
+
+def read_lines(input_path, start, end):
+    """
+    :rtype: generator
+    :return: the lines (str) that start in [start, end)
+    """
+    with open(input_path, 'rb') as infile:
+        infile.seek(start)
+        position = start
+        for line in infile:
+            if position >= end:
+                break
+            position += len(line)
+            yield line.decode('utf-8')
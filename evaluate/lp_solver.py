@@ -0,0 +1,179 @@
+'''
+Label propagation and label spreading on a sparse affinity matrix.
+
+LabelPropagation._apply_label_propagation_model() used to fit
+sklearn.semi_supervised.LabelPropagation (or LabelSpreading) with
+affinity_func() as kernel. propagate_labels() runs the same iterations
+(Zhu and Ghahramani, 2002; Zhou et al., 2004) directly on the csr_matrix of
+affinity_func():
+
+- propagation: F <- normalize(D^-1 W F), the labeled rows are clamped to
+  their label
+- spreading: F <- alpha D^-1/2 W D^-1/2 F + (1-alpha) Y (self-loops are
+  ignored, like sklearn does)
+
+and adds two things: it stops as soon as the labels (the argmax of F) of the
+unlabeled instances have not changed for stable_iterations iterations, and
+it can start from the label distributions of a previous run (warm start).
+With stable_iterations=None the result is that of sklearn. The warm start
+pays off for propagation; spreading returns normalized distributions, which
+are not its fixed point, and it runs at most 30 iterations anyway.
+
+Speed and agreement with sklearn on the lemmas of a label propagation input:
+
+python3 lp_solver.py -m model -v vocab.index.pkl -i system_input -s expander
+'''
+import argparse
+from time import time
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+
+VARIANTS = ('propagation', 'spreading')
+
+
+def propagation_matrix(graph):
+    ''' D^-1 W: every row sums to one '''
+    graph = csr_matrix(graph, dtype=np.float64)
+    normalizer = np.asarray(graph.sum(axis=1)).ravel()
+    return diags(1.0 / normalizer).dot(graph).tocsr()
+
+
+def spreading_matrix(graph):
+    ''' D^-1/2 W D^-1/2 without the diagonal, the degrees exclude the self-loops '''
+    graph = csr_matrix(graph, dtype=np.float64, copy=True)
+    graph.setdiag(0)
+    graph.eliminate_zeros()
+    degree = np.asarray(graph.sum(axis=1)).ravel()
+    # isolated vertices keep a zero row
+    inv_sqrt_degree = diags(1.0 / np.sqrt(np.where(degree == 0, 1, degree)))
+    return inv_sqrt_degree.dot(graph).dot(inv_sqrt_degree).tocsr()
+
+
+def propagate_labels(graph, labels, variant='propagation', alpha=0.2, max_iter=None,
+                     tol=1e-3, stable_iterations=None, initial_distributions=None):
+    '''
+    :param graph: affinity matrix [n, n] (sparse or dense)
+    :param labels: label of each instance, -1 for the unlabeled ones
+    :param variant: 'propagation' or 'spreading'
+    :param alpha: how much of the propagated distribution label spreading
+    keeps (the rest is the initial label)
+    :param max_iter: default 1000 for propagation and 30 for spreading (as sklearn)
+    :param tol: stop when the L1 change of the distributions is smaller
+    :param stable_iterations: stop when the labels of the unlabeled instances
+    have not changed for so many iterations (None: only tol)
+    :param initial_distributions: [n, number of classes], the distributions
+    that the unlabeled instances start with (warm start)
+    :rtype: tuple
+    :return: (classes, label distributions [n, number of classes], number of
+    iterations), the label of an instance is classes[argmax of its row]
+    '''
+    assert variant in VARIANTS, 'unknown variant: %s' %variant
+    if max_iter is None:
+        max_iter = 1000 if variant == 'propagation' else 30
+    labels = np.asarray(labels)
+    classes = np.unique(labels)
+    classes = classes[classes != -1]
+    unlabeled = labels == -1
+    labeled_rows = np.flatnonzero(~unlabeled)
+    distributions = np.zeros((len(labels), len(classes)))
+    distributions[labeled_rows, np.searchsorted(classes, labels[labeled_rows])] = 1
+    static = distributions.copy()
+    if variant == 'propagation':
+        matrix = propagation_matrix(graph)
+    else:
+        matrix = spreading_matrix(graph)
+        static *= 1 - alpha
+
+    if initial_distributions is not None:
+        assert initial_distributions.shape == distributions.shape, \
+                'initial distributions of a different problem'
+        distributions[unlabeled] = initial_distributions[unlabeled]
+    previous = np.zeros_like(distributions)
+    previous_labels = None
+    num_stable = 0
+    for num_iterations in range(max_iter):
+        if np.abs(distributions - previous).sum() < tol:
+            break
+        if stable_iterations is not None:
+            current_labels = np.argmax(distributions[unlabeled], axis=1)
+            if previous_labels is not None and np.array_equal(current_labels, previous_labels):
+                num_stable += 1
+                if num_stable >= stable_iterations:
+                    break
+            else:
+                num_stable = 0
+            previous_labels = current_labels
+        previous = distributions
+        distributions = matrix.dot(distributions)
+        if variant == 'propagation':
+            normalizer = distributions.sum(axis=1)
+            normalizer[normalizer == 0] = 1
+            distributions /= normalizer[:,np.newaxis]
+            distributions[labeled_rows] = static[labeled_rows]
+        else:
+            distributions *= alpha
+            distributions += static
+    else:
+        num_iterations = max_iter
+    normalizer = distributions.sum(axis=1)
+    normalizer[normalizer == 0] = 1
+    distributions /= normalizer[:,np.newaxis]
+    return classes, distributions, num_iterations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Speed and agreement of propagate_labels() and sklearn on the lemmas of a label propagation input')
+    parser.add_argument('-m', dest='model_path', required=True, help='path to model trained LSTM model')
+    parser.add_argument('-v', dest='vocab_path', required=True, help='path to LSTM vocabulary')
+    parser.add_argument('-i', dest='system_input', required=True, help='label propagation input (pickle, see debug_lp.py)')
+    parser.add_argument('-s', dest='sim', default='expander', help='expander | rbf')
+    parser.add_argument('-g', dest='gamma', type=float, default=1.0, help='gamma of the RBF kernel')
+    parser.add_argument('-a', dest='variant', default='propagation', help='propagation | spreading')
+    parser.add_argument('-n', dest='num_lemmas', type=int, default=100, help='number of lemmas (the ones with the most instances)')
+    parser.add_argument('--stable_iterations', type=int, help='see propagate_labels()')
+    parser.add_argument('--cache_dir', help='directory of the context embedding cache (no caching if not given)')
+    args = parser.parse_args()
+
+    import pickle
+    from sklearn import semi_supervised
+    from label_propagation import LabelPropagation, expander, RBF
+    sim_func = RBF(args.gamma) if args.sim == 'rbf' else expander
+    with open(args.system_input, 'rb') as infile:
+        system_input = pickle.load(infile)
+    lemmas = sorted(system_input, key=lambda lemma: len(system_input[lemma]), reverse=True)
+    sample = dict((lemma, system_input[lemma]) for lemma in lemmas[:args.num_lemmas])
+    # without a session, the NumPy implementation of the LSTM is used
+    lp = LabelPropagation(None, args.vocab_path, args.model_path, 1000, sim_func=sim_func,
+                          cache_dir=args.cache_dir)
+    converted_data, _ = lp._convert_sense_ids(sample)
+    lemma2contexts = lp._run_lstm(converted_data)
+    sklearn_class = (semi_supervised.LabelPropagation if args.variant == 'propagation'
+                     else semi_supervised.LabelSpreading)
+    print('\t'.join(['lemma', '#', 'agreement', 'iterations', 'sklearn_iterations',
+                     'native_sec', 'sklearn_sec']))
+    total_native_sec = total_sklearn_sec = 0
+    num_agreed = num_unlabeled = 0
+    for lemma, contexts in lemma2contexts.items():
+        labels = np.array([sense for sense, _, _ in converted_data[lemma]])
+        if (labels >= 0).sum() == 0 or (labels < 0).sum() == 0:
+            continue
+        # both solvers get the same graph, only the iterations are timed
+        graph = lp.affinity_func(contexts, contexts)
+        start_sec = time()
+        classes, distributions, num_iterations = propagate_labels(
+                graph, labels, args.variant, stable_iterations=args.stable_iterations)
+        native_sec = time() - start_sec
+        model = sklearn_class(kernel=lambda X, Y: graph.copy())
+        start_sec = time()
+        model.fit(contexts, labels)
+        sklearn_sec = time() - start_sec
+        predicted = classes[np.argmax(distributions, axis=1)]
+        agreed = (predicted == model.transduction_)[labels < 0].sum()
+        num_agreed += agreed
+        num_unlabeled += (labels < 0).sum()
+        total_native_sec += native_sec
+        total_sklearn_sec += sklearn_sec
+        print('%s\t%d\t%.4f\t%d\t%d\t%.3f\t%.3f' %(lemma, len(labels), agreed / float((labels < 0).sum()),
+                                                 num_iterations, model.n_iter_, native_sec, sklearn_sec))
+    print('all\t%d\t%.4f\t\t\t%.3f\t%.3f' %(num_unlabeled, num_agreed / float(max(1, num_unlabeled)),
+                                           total_native_sec, total_sklearn_sec))
@@ -0,0 +1,209 @@
+'''
+Evaluate a grid of label propagation settings on one input in one run.
+
+debug_lp.py (and das5/exp-hyperp-label-propagation.sh, which calls it once
+per setting) loads the LSTM and encodes the same input again for every
+(algo, sim, gamma). lp_sweep.py encodes the contexts once and keeps them on
+disk, memory-mapped:
+
+    <contexts_dir>/contexts.npy     the context embeddings of all instances
+    <contexts_dir>/index.pkl        input path, model fingerprint and the
+                                    rows (start, stop) of each lemma
+
+A later sweep over the same input and model reuses them without loading the
+model. The settings that share a similarity function (propagate and spread
+with the same sim and gamma) share the graph of each lemma. The groups of
+settings run in a pool of processes. For every setting the output and a
+score_lp() table are written to the output directory, and sweep.tsv has the
+accuracy of all settings:
+
+python3 lp_sweep.py -i system_input -m model -v vocab.index.pkl -o lp_sweep \\
+    -a propagate spread nearest -s expander rbf -g 1 0.5 0.1 0.01 -w 5
+'''
+import os
+import argparse
+import pickle
+from collections import OrderedDict
+from multiprocessing import Pool
+import numpy as np
+from label_propagation import LabelPropagation, LabelSpreading, NearestNeighbor, \
+    NearestNeighborOfAverage, expander, RBF
+from embedding_cache import model_fingerprint
+
+ALGOS = OrderedDict([('propagate', LabelPropagation),
+                     ('spread', LabelSpreading),
+                     ('nearest', NearestNeighbor),
+                     ('average', NearestNeighborOfAverage)])
+# these build a graph (affinity_func), the others only use sim_func
+GRAPH_ALGOS = ('propagate', 'spread')
+
+
+def setting_name(algo, sim, gamma):
+    if sim == 'rbf':
+        return '%s-%s-%s' %(algo, sim, gamma)
+    return '%s-%s' %(algo, sim)
+
+
+def encode_contexts(system_input_path, system_input, model_path, vocab_path,
+                    contexts_dir, sess=None, cache_dir=None):
+    ''' Run the LSTM over system_input and write the contexts to contexts_dir '''
+    lp = LabelPropagation(sess, vocab_path, model_path, 1000, cache_dir=cache_dir)
+    converted_data, _ = lp._convert_sense_ids(system_input)
+    lemma2contexts = lp._run_lstm(converted_data)
+    os.makedirs(contexts_dir, exist_ok=True)
+    lemma2rows = OrderedDict()
+    start = 0
+    for lemma, contexts in lemma2contexts.items():
+        lemma2rows[lemma] = (start, start+len(contexts))
+        start += len(contexts)
+    dims = max([contexts.shape[1] for contexts in lemma2contexts.values() if len(contexts)] or [0])
+    matrix = np.lib.format.open_memmap(os.path.join(contexts_dir, 'contexts.npy'), mode='w+',
+                                       dtype=np.float32, shape=(start, dims))
+    for lemma, (start, stop) in lemma2rows.items():
+        matrix[start:stop] = lemma2contexts[lemma]
+    matrix.flush()
+    del matrix
+    with open(os.path.join(contexts_dir, 'index.pkl'), 'wb') as outfile:
+        pickle.dump({'system_input': os.path.abspath(system_input_path),
+                     'model_fingerprint': model_fingerprint(model_path),
+                     'lemma2rows': lemma2rows}, outfile)
+
+
+def has_contexts(contexts_dir, system_input_path, model_path):
+    ''' whether contexts_dir has the contexts of this input and model '''
+    index_path = os.path.join(contexts_dir, 'index.pkl')
+    if not os.path.exists(index_path):
+        return False
+    with open(index_path, 'rb') as infile:
+        index = pickle.load(infile)
+    return (index['system_input'] == os.path.abspath(system_input_path) and
+            index['model_fingerprint'] == model_fingerprint(model_path))
+
+
+def load_contexts(contexts_dir):
+    ''' dict(lemma -> memory-mapped contexts) '''
+    with open(os.path.join(contexts_dir, 'index.pkl'), 'rb') as infile:
+        lemma2rows = pickle.load(infile)['lemma2rows']
+    # plain ndarray views: slicing a np.memmap is several times slower
+    matrix = np.load(os.path.join(contexts_dir, 'contexts.npy'), mmap_mode='r').view(np.ndarray)
+    return OrderedDict((lemma, matrix[start:stop]) for lemma, (start, stop) in lemma2rows.items())
+
+
+def _make_lp(algo, sim_func, lemma2contexts, solver):
+    lp = ALGOS[algo](None, None, None, 1000, sim_func=sim_func, solver=solver)
+    # the contexts are encoded already
+    lp._run_lstm = lambda converted_data: OrderedDict((lemma, lemma2contexts[lemma])
+                                                      for lemma in converted_data)
+    return lp
+
+
+def _init_worker(contexts_dir, system_input, solver):
+    global worker_contexts, worker_input, worker_solver
+    worker_contexts = load_contexts(contexts_dir)
+    worker_input = system_input
+    worker_solver = solver
+
+
+def _run_group(sim, gamma, algos):
+    '''
+    Run the settings that share a similarity function, the graph of a lemma
+    is built once for all algorithms in GRAPH_ALGOS.
+
+    :return: list of (algo, sim, gamma, output), output as in LabelPropagation.predict()
+    '''
+    sim_func = RBF(gamma) if sim == 'rbf' else expander
+    results = []
+    graph_algos = [algo for algo in algos if algo in GRAPH_ALGOS]
+    if graph_algos:
+        builder = _make_lp('propagate', sim_func, worker_contexts, worker_solver)
+        lps = [_make_lp(algo, sim_func, worker_contexts, worker_solver) for algo in graph_algos]
+        outputs = [{} for _ in lps]
+        converted_data, sense_ids = builder._convert_sense_ids(worker_input)
+        for lemma in converted_data:
+            contexts = worker_contexts[lemma]
+            labels = [sense for sense, _, _ in converted_data[lemma]]
+            graph = builder.affinity_func(contexts, contexts)
+            for lp, output in zip(lps, outputs):
+                # sklearn normalizes the graph in place
+                lp.affinity_func = lambda X1, X2, graph=graph: graph.copy()
+                predicted_indices = lp._apply_label_propagation_model(contexts, labels, lemma)
+                output[lemma] = [sense_ids[index] for index in predicted_indices]
+        results.extend((algo, sim, gamma, output) for algo, output in zip(graph_algos, outputs))
+    for algo in algos:
+        if algo not in GRAPH_ALGOS:
+            lp = _make_lp(algo, sim_func, worker_contexts, worker_solver)
+            results.append((algo, sim, gamma, lp.predict(worker_input)))
+    return results
+
+
+def sweep(system_input, gold, contexts_dir, grid, output_dir, num_workers=1, solver='native'):
+    '''
+    grid: list of (algo, sim, gamma)
+
+    :return: dict(setting name -> accuracy)
+    '''
+    from debug_lp import score_lp
+    groups = OrderedDict()
+    for algo, sim, gamma in grid:
+        groups.setdefault((sim, gamma), []).append(algo)
+    os.makedirs(output_dir, exist_ok=True)
+    name2accuracy = OrderedDict()
+    with Pool(num_workers, initializer=_init_worker,
+              initargs=(contexts_dir, system_input, solver)) as pool:
+        results = [pool.apply_async(_run_group, (sim, gamma, algos))
+                   for (sim, gamma), algos in groups.items()]
+        for result in results:
+            for algo, sim, gamma, output in result.get():
+                name = setting_name(algo, sim, gamma)
+                with open(os.path.join(output_dir, name + '.out'), 'wb') as outfile:
+                    pickle.dump(output, outfile)
+                name2accuracy[name] = score_lp(system_input, output, gold,
+                                               os.path.join(output_dir, name + '.dev_score.tsv'))
+    with open(os.path.join(output_dir, 'sweep.tsv'), 'w') as outfile:
+        outfile.write('setting\taccuracy\n')
+        for name, accuracy in name2accuracy.items():
+            outfile.write('%s\t%s\n' %(name, accuracy))
+    return name2accuracy
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate a grid of label propagation settings, encoding the contexts once')
+    parser.add_argument('-i', dest='system_input', required=True, help='label propagation input (gold: <system_input>_dev_gold, see debug_lp.py)')
+    parser.add_argument('-m', dest='model_path', required=True, help='path to model trained LSTM model')
+    parser.add_argument('-v', dest='vocab_path', required=True, help='path to LSTM vocabulary')
+    parser.add_argument('-o', dest='output_dir', required=True, help='directory of the outputs and score tables')
+    parser.add_argument('-a', dest='algos', nargs='+', default=['propagate', 'spread'], help=' | '.join(ALGOS))
+    parser.add_argument('-s', dest='sims', nargs='+', default=['expander', 'rbf'], help='expander | rbf')
+    parser.add_argument('-g', dest='gammas', nargs='+', type=float, default=[1, 0.5, 0.1, 0.01], help='gammas of the RBF kernel')
+    parser.add_argument('-w', dest='num_workers', type=int, default=1, help='number of processes')
+    parser.add_argument('--solver', default='native', help='native | sklearn (see lp_solver.py)')
+    parser.add_argument('--contexts_dir', help='where the contexts are kept, default: <output_dir>/contexts')
+    parser.add_argument('--backend', default='tensorflow', help='tensorflow | numpy, to encode the contexts')
+    parser.add_argument('--cache_dir', help='directory of the context embedding cache (no caching if not given)')
+    args = parser.parse_args()
+
+    for algo in args.algos:
+        assert algo in ALGOS, 'Unknown algorithm: %s' %algo
+    grid = [(algo, sim, gamma)
+            for sim in args.sims
+            for gamma in (args.gammas if sim == 'rbf' else [None])
+            for algo in args.algos]
+    contexts_dir = args.contexts_dir or os.path.join(args.output_dir, 'contexts')
+    with open(args.system_input, 'rb') as infile:
+        system_input = pickle.load(infile)
+    with open(args.system_input + '_dev_gold', 'rb') as infile:
+        gold = pickle.load(infile)
+    if has_contexts(contexts_dir, args.system_input, args.model_path):
+        print('Using the contexts in %s' %contexts_dir)
+    elif args.backend == 'numpy':
+        encode_contexts(args.system_input, system_input, args.model_path, args.vocab_path,
+                        contexts_dir, cache_dir=args.cache_dir)
+    else:
+        import tensorflow as tf
+        with tf.Session() as sess:
+            encode_contexts(args.system_input, system_input, args.model_path, args.vocab_path,
+                            contexts_dir, sess=sess, cache_dir=args.cache_dir)
+    name2accuracy = sweep(system_input, gold, contexts_dir, grid, args.output_dir,
+                          args.num_workers, args.solver)
+    for name, accuracy in name2accuracy.items():
+        print('%s\t%.4f' %(name, accuracy))
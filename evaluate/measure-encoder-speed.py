@@ -0,0 +1,60 @@
+'''
+Compare the throughput (and output) of the TensorFlow model and the NumPy
+encoder in numpy_lstm.py on random sentences.
+
+python3 measure-encoder-speed.py -m resources/model-h2048p512/lstm-wsd-gigaword-google
+'''
+import argparse
+from time import time
+import numpy as np
+from numpy_lstm import NumpyLSTM
+import tensor_utils as utils
+
+parser = argparse.ArgumentParser(description='Measure speed of LSTM encoders')
+parser.add_argument('-m', dest='model_path', required=True, help='path to trained LSTM model (run export-inference-model.py first)')
+parser.add_argument('-n', dest='num_sentences', type=int, default=2000, help='number of random sentences')
+parser.add_argument('-b', dest='batch_size', type=int, default=400, help='batch size')
+parser.add_argument('--min_len', type=int, default=6, help='minimum sentence length')
+parser.add_argument('--max_len', type=int, default=50, help='maximum sentence length')
+parser.add_argument('--no_tf', action='store_true', help='only measure the NumPy encoder')
+args = parser.parse_args()
+
+
+def run_batches(encoder, x, lens, batch_size):
+    outputs = []
+    for start in range(0, len(lens), batch_size):
+        stop = start + batch_size
+        batch_lens = lens[start:stop]
+        outputs.append(encoder(x[start:stop,:batch_lens.max()], batch_lens))
+    return np.vstack(outputs)
+
+
+def measure(label, encoder, x, lens, batch_size):
+    start_sec = time()
+    output = run_batches(encoder, x, lens, batch_size)
+    elapsed_sec = time() - start_sec
+    print('%s: %.1f sentences/sec (%.2f sec)' %(label, len(lens)/elapsed_sec, elapsed_sec))
+    return output
+
+
+start_sec = time()
+numpy_encoder = NumpyLSTM.load(args.model_path)
+print('NumPy encoder loaded in %.2f sec' %(time()-start_sec))
+
+rng = np.random.RandomState(2083)
+lens = rng.randint(args.min_len, args.max_len+1, size=args.num_sentences)
+x = rng.randint(numpy_encoder.word_embedding.shape[0],
+                size=(args.num_sentences, args.max_len)).astype(np.int32)
+numpy_output = measure('NumPy', numpy_encoder, x, lens, args.batch_size)
+
+if not args.no_tf:
+    import tensorflow as tf
+    with tf.Session() as sess:
+        start_sec = time()
+        x_, predicted_context_embs, lens_ = utils.load_model(sess, args.model_path)
+        print('TensorFlow model loaded in %.2f sec' %(time()-start_sec))
+        tf_encoder = lambda x, lens: sess.run(predicted_context_embs, {x_: x, lens_: lens})
+        tf_output = measure('TensorFlow', tf_encoder, x, lens, args.batch_size)
+    diff = np.abs(numpy_output - tf_output)
+    print('Max absolute difference: %g, max relative difference: %g'
+          %(diff.max(), (diff / (np.abs(tf_output)+1e-6)).max()))
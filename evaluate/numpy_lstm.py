@@ -0,0 +1,138 @@
+'''
+Forward pass of the LSTM model (WSDModel in ../model.py) in pure NumPy.
+
+Evaluation only needs predicted_context_embs: embedding lookup, an LSTM over
+the sentence, the output at the last position and the context layer. This
+module computes exactly that without TensorFlow, which makes it cheap to
+import and usable in lightweight worker processes.
+
+The weights are read from the .numpy directory written by
+export-inference-model.py. The embedding table is memory-mapped so that
+processes on the same machine share it.
+'''
+import os
+import numpy as np
+
+
+def _sigmoid(x):
+    # same as 1/(1+exp(-x)) but doesn't overflow
+    return 0.5 * (np.tanh(0.5 * x) + 1)
+
+
+class NumpyLSTM(object):
+    '''
+    Callable with the same inputs and output as the TensorFlow graph:
+    x (int matrix of word ids, padded) and lens -> predicted_context_embs.
+    '''
+
+    def __init__(self, word_embedding, kernel, bias, context_layer_weights,
+                 forget_bias=1.0):
+        self.word_embedding = word_embedding
+        self.emb_dims = word_embedding.shape[1]
+        self.hidden_size = context_layer_weights.shape[0]
+        assert kernel.shape == (self.emb_dims+self.hidden_size, 4*self.hidden_size)
+        self.kernel = np.asarray(kernel, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.context_layer_weights = np.asarray(context_layer_weights, dtype=np.float32)
+        self.forget_bias = np.float32(forget_bias)
+
+    @classmethod
+    def load(cls, model_path, mmap_mode='r'):
+        ''' model_path: the trained model (as given to tensor_utils.load_model)
+        or directly the .numpy directory written by export-inference-model.py '''
+        weights_dir = model_path
+        if not os.path.isdir(weights_dir):
+            weights_dir = model_path + '-inference.numpy'
+        assert os.path.isdir(weights_dir), \
+                'Weights not found, please run export-inference-model.py first'
+        load = lambda name, mode=None: np.load(os.path.join(weights_dir, name + '.npy'),
+                                               mmap_mode=mode)
+        return cls(load('word_embedding', mmap_mode), load('kernel'), load('bias'),
+                   load('context_layer_weights'), load('forget_bias'))
+
+    def run_lstm(self, x, lens, initial_state=None, record_rows=None, record_steps=None):
+        '''
+        Return the LSTM output at position lens-1 of each row of x.
+
+        initial_state: optional (c, h) to start from instead of zeros
+        record_rows, record_steps: optionally also return the state (c, h)
+        reached by row record_rows[k] after reading record_steps[k] words
+        (record_steps[k] <= lens[record_rows[k]])
+        '''
+        x, lens = np.asarray(x), np.asarray(lens)
+        batch_size = len(lens)
+        # longest first so that the rows still running are always a prefix
+        order = np.argsort(-lens, kind='mergesort')
+        x, lens = x[order], lens[order]
+        max_len = lens[0] if batch_size else 0
+        # num_active[t] = number of sentences longer than t
+        num_active = np.searchsorted(-lens, -np.arange(max_len+1), side='left')
+        E, H = self.emb_dims, self.hidden_size
+        inputs = np.zeros((batch_size, E+H), dtype=np.float32) # [embedding, h]
+        c = np.zeros((batch_size, H), dtype=np.float32)
+        if initial_state is not None:
+            c[:] = initial_state[0][order]
+            inputs[:,E:] = initial_state[1][order]
+        last_h = np.empty((batch_size, H), dtype=np.float32)
+        if record_rows is not None:
+            # position of each row after sorting, records grouped by step
+            sorted_pos = np.empty_like(order)
+            sorted_pos[order] = np.arange(batch_size)
+            record_steps = np.asarray(record_steps)
+            record_order = np.argsort(record_steps, kind='mergesort')
+            record_bounds = np.searchsorted(record_steps[record_order], np.arange(max_len+2))
+            recorded_c = np.empty((len(record_steps), H), dtype=np.float32)
+            recorded_h = np.empty((len(record_steps), H), dtype=np.float32)
+        for t in range(max_len+1):
+            if record_rows is not None:
+                # rows that have finished keep their last state
+                records = record_order[record_bounds[t]:record_bounds[t+1]]
+                rows = sorted_pos[np.asarray(record_rows)[records]]
+                recorded_c[records] = c[rows]
+                recorded_h[records] = inputs[rows,E:]
+            if t == max_len: break
+            n, n_next = num_active[t], num_active[t+1]
+            inputs[:n,:E] = self.word_embedding[x[:n,t]]
+            gates = np.dot(inputs[:n], self.kernel)
+            gates += self.bias
+            i, j, f, o = np.split(gates, 4, axis=1) # same order as LSTMCell
+            c[:n] = _sigmoid(f + self.forget_bias) * c[:n] + _sigmoid(i) * np.tanh(j)
+            h = _sigmoid(o) * np.tanh(c[:n])
+            inputs[:n,E:] = h
+            last_h[n_next:n] = h[n_next:] # sentences that end at t
+        output = np.empty_like(last_h)
+        output[order] = last_h
+        if record_rows is not None:
+            return output, (recorded_c, recorded_h)
+        return output
+
+    def encode_targets(self, x, lens, rows, target_indices, target_id, pad_id):
+        '''
+        Context embeddings of several targets in the same sentences, sharing
+        the computation of the words in front of the targets.
+
+        x, lens: the sentences without <target> (padded word ids)
+        rows, target_indices: one output per pair, for the sentence x[rows[k]]
+        in which the word at target_indices[k] is replaced by target_id
+
+        The sentences are run up to their last target only once and the
+        state before each target is saved. Every target then resumes from
+        its state on <target> + the rest of the sentence.
+        '''
+        x, lens = np.asarray(x), np.asarray(lens)
+        rows, target_indices = np.asarray(rows), np.asarray(target_indices)
+        prefix_lens = np.zeros_like(lens)
+        np.maximum.at(prefix_lens, rows, target_indices)
+        _, state = self.run_lstm(x, prefix_lens, record_rows=rows,
+                                 record_steps=target_indices)
+        suffix_lens = lens[rows] - target_indices
+        suffixes = np.empty((len(rows), suffix_lens.max() if len(rows) else 0), dtype=x.dtype)
+        suffixes.fill(pad_id)
+        for k, (row, target_index) in enumerate(zip(rows, target_indices)):
+            suffixes[k,:suffix_lens[k]] = x[row,target_index:lens[row]]
+        suffixes[:,0] = target_id
+        return np.dot(self.run_lstm(suffixes, suffix_lens, initial_state=state),
+                      self.context_layer_weights)
+
+    def __call__(self, x, lens):
+        return np.dot(self.run_lstm(x, lens), self.context_layer_weights)
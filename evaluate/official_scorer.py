@@ -2,17 +2,20 @@ import pandas
 import os
 import subprocess
 import json
+from candidate_index import CandidateIndex
 
 def load_synset(wn, identifier):
     """
     load wordnet synset based on identifier
 
-    :param nltk.corpus.util.LazyCorpusLoader wn: loaded wordnet instance
+    :param nltk.corpus.util.LazyCorpusLoader wn: loaded wordnet instance (or a candidate_index.CandidateIndex)
     :param str identifier: eng-VERSION-OFFSET-POS
 
     :rtype: nltk.corpus.reader.wordnet.Synset
     :return: wordnet synset
     """
+    if isinstance(wn, CandidateIndex):
+        return wn.synset(identifier)
     eng, version, offset, pos = identifier.split('-')
     synset = wn._synset_from_pos_and_offset(pos, int(offset))
     return synset
@@ -1,15 +1,17 @@
 import numpy as np
 import os
-import tensorflow as tf
+from collections import defaultdict, OrderedDict
+from time import time
 import json
 import argparse
 import pickle
 import pandas
-from nltk.corpus import wordnet as wn
-from nltk.corpus.reader.wordnet import WordNetCorpusReader
 from scipy import spatial
 import morpho_utils
-import tensor_utils as utils
+from context_encoder import open_encoder
+from sense_store import load_sense_store
+from candidate_index import CandidateIndex
+from wn_snapshot import load_wordnet
 import score_utils
 import tsne_utils
 import official_scorer
@@ -30,36 +32,10 @@ parser.add_argument('-p', dest='path_plural_freq', help='path to pickle with plu
 parser.add_argument('-b', dest='use_number_strategy', help='set to True to use morphological strategy number')
 parser.add_argument('-y', dest='path_lp', help='path to lp output')
 parser.add_argument('-z', dest='use_lp', help='set to True to use label propagation') 
-
-
-args = parser.parse_args()
-args.mfs_fallback = args.mfs_fallback == 'True'
-case_strategy = args.use_case_strategy == 'True'
-number_strategy = args.use_number_strategy == 'True'
-lp_strategy = args.use_lp == 'True'
-
-case_freq = pickle.load(open(args.path_case_freq, 'rb'))
-plural_freq = pickle.load(open(args.path_plural_freq, 'rb'))
-
-
-lp_info = dict()
-if lp_strategy:
-    lp_info = pickle.load(open(args.path_lp, 'rb'))
-
-the_wn_version = '30'
-# load relevant wordnet
-if '171' in args.wsd_df_path:
-    the_wn_version = '171'
-    cwd = os.path.dirname(os.path.realpath(__file__))
-    path_to_wn_dict_folder = os.path.join(cwd, 'resources', 'wordnet_171', 'WordNet-1.7.1', 'dict')
-    wn = WordNetCorpusReader(path_to_wn_dict_folder, None)
-
-
-with open(args.sense_embeddings_path + '.freq', 'rb') as infile:
-    meaning_freqs = pickle.load(infile)
-
-with open(args.log_path, 'w') as outfile:
-    json.dump(args.__dict__, outfile)
+parser.add_argument('-e', dest='encoder', default='tensorflow', help='tensorflow | numpy (requires export-inference-model.py)')
+parser.add_argument('--cache_dir', help='directory of the context embedding cache (no caching if not given)')
+parser.add_argument('--cache_size_mb', type=int, default=2048, help='maximum size of the embedding cache')
+parser.add_argument('--candidate_index', help='candidate index built with candidate_index.py (WordNet is only loaded for lemmas that are not in it)')
 
 
 def lp_output(row, lp_info, candidate_synsets, debug=False):
@@ -136,13 +112,17 @@ def extract_sentence_wsd_competition(row):
     return target_index, sentence_tokens, lemma, pos
 
 
-def score_synsets(target_embedding, candidate_synsets, sense_embeddings, instance_id, lemma, pos, gran, synset2higher_level):
+def score_synsets(target_embedding, candidate_synsets, sense_embeddings, instance_id, lemma, pos, gran, synset2higher_level,
+                  meaning_freqs, mfs_fallback, scores=None):
     """
     perform wsd
 
     :param numpy.ndarray target_embedding: predicted lstm embedding of sentence
     :param set candidate_synsets: candidate synset identifier of lemma, pos
-    :param dict sense_embeddings: dictionary of sense embeddings
+    :param sense_store.SenseStore sense_embeddings: meaning -> (embedding, std)
+    :param dict meaning_freqs: mapping meaning -> frequency (the .freq file of the sense embeddings)
+    :param bool mfs_fallback: if True, the first candidate is chosen when none of them has an embedding
+    :param dict scores: if a dict is given, the cosine similarity of each scored candidate is added to it
 
     :rtype: str
     :return: synset with highest cosine sim
@@ -173,6 +153,8 @@ def score_synsets(target_embedding, candidate_synsets, sense_embeddings, instanc
 
         cand_embedding, cand_std = sense_embeddings[candidate]
         sim = 1 - spatial.distance.cosine(cand_embedding, target_embedding)
+        if scores is not None:
+            scores[synset] = sim
 
         potentially_added_synset = (synset, cand_std)
 
@@ -190,7 +172,7 @@ def score_synsets(target_embedding, candidate_synsets, sense_embeddings, instanc
         highest_synset, synset_std = highest_synsets[0]
         #print('%s %s %s: 2> synsets with same conf %s: %s' % (instance_id, lemma, pos, highest_conf, highest_synsets))
     else:
-        if args.mfs_fallback:
+        if mfs_fallback:
             highest_synset = candidate_synsets[0]
             synset_std = None
             #print('%s: no highest synset -> mfs' % instance_id)
@@ -201,79 +183,171 @@ def score_synsets(target_embedding, candidate_synsets, sense_embeddings, instanc
     return highest_synset, synset_std, candidate_freq, strategy
 
 
-# load wsd competition dataframe
-wsd_df = pandas.read_pickle(args.wsd_df_path)
-
-# add output column
-wsd_df['lstm_output'] = [None for _ in range(len(wsd_df))]
-wsd_df['target_embedding'] = [None for _ in range(len(wsd_df))]
-wsd_df['std_chosen_synset'] = [None for _ in range(len(wsd_df))]
-wsd_df['lstm_acc'] = [None for _ in range(len(wsd_df))]
-wsd_df['emb_freq'] = [None for _ in range(len(wsd_df))]
-wsd_df['#_cand_synsets'] = [None for _ in range(len(wsd_df))]
-wsd_df['#_new_cand_synsets'] = [None for _ in range(len(wsd_df))]
-wsd_df['gold_in_new_cand_synsets'] = [None for _ in range(len(wsd_df))]
-wsd_df['wsd_strategy'] = [None for _ in range(len(wsd_df))]
-wsd_df['num_embeddings'] = [None for _ in range(len(wsd_df))]
-wsd_df['has_gold_embedding'] = [None for _ in range(len(wsd_df))]
-
-# load sense embeddings
-with open(args.sense_embeddings_path, 'rb') as infile:
-    sense_embeddings = pickle.load(infile)
-
-# num correct
-num_correct = 0
-
-vocab = np.load(args.vocab_path)
-with tf.Session() as sess:  # your session object
-    saver = tf.train.import_meta_graph(args.model_path + '.meta', clear_devices=True)
-    saver.restore(sess, args.model_path)
-    x, predicted_context_embs, lens = utils.load_tensors(sess)
-    #predicted_context_embs = sess.graph.get_tensor_by_name('Model/predicted_context_embs:0')
-    #x = sess.graph.get_tensor_by_name('Model/Placeholder:0')
 
+def score_synsets_batch(target_embeddings, candidate_lists, sense_store, gran, synset2higher_levels,
+                        meaning_freqs, mfs_fallback, scores=None, chunk_size=8192):
+    """
+    perform wsd for many instances at once
+
+    gives the same output as calling score_synsets for every instance
+    (the first candidate with the highest similarity wins, mfs_fallback
+    if no candidate has an embedding) but computes all similarities
+    with a few vectorized operations
+
+    :param numpy.ndarray target_embeddings: predicted lstm embeddings, one row per instance
+    :param list candidate_lists: candidate synset identifiers of each instance
+    :param sense_store.SenseStore sense_store: the sense embeddings
+    :param list synset2higher_levels: mapping to the higher abstraction level of each instance
+    (only used if gran is not synset)
+    :param dict meaning_freqs: mapping meaning -> frequency (the .freq file of the sense embeddings)
+    :param bool mfs_fallback: if True, the first candidate is chosen when none of them has an embedding
+    :param list scores: if a list is given, a dict with the cosine similarity of each
+    scored candidate is appended to it for every instance
+    :param int chunk_size: number of (instance, candidate) pairs scored together
+
+    :rtype: list
+    :return: (highest_synset, synset_std, candidate_freq, strategy) of every instance
+    """
+    # flatten the candidates, one entry per (instance, candidate)
+    meanings = []
+    candidate_freqs = []
+    for candidate_synsets, synset2higher_level in zip(candidate_lists, synset2higher_levels):
+        candidate_freq = dict()
+        for synset in candidate_synsets:
+            candidate = None
+            if gran == 'synset':
+                candidate = synset
+                candidate_freq[synset] = meaning_freqs[candidate]
+            elif gran in {'sensekey', 'blc20', 'direct_hypernym'}:
+                if synset in synset2higher_level:
+                    candidate = synset2higher_level[synset]
+                    candidate_freq[synset] = meaning_freqs[candidate]
+                else:
+                    candidate_freq[synset] = 0
+            meanings.append(candidate)
+        assert len(candidate_freq) == len(set(candidate_synsets)), (candidate_freq, candidate_synsets)
+        candidate_freqs.append(candidate_freq)
+
+    lens = np.array([len(candidate_synsets) for candidate_synsets in candidate_lists], dtype=np.int64)
+    starts = np.cumsum(lens) - lens
+    segment_ids = np.repeat(np.arange(len(lens)), lens)
+    rows = sense_store.rows(meanings)
+    has_embedding = rows >= 0
+
+    # cosine similarity as computed by scipy.spatial.distance.cosine
+    targets = np.asarray(target_embeddings, dtype=np.float64)
+    target_squared_norms = np.einsum('ij,ij->i', targets, targets)
+    sims = np.full(len(rows), np.nan)
+    scored = np.flatnonzero(has_embedding)
+    for chunk_start in range(0, len(scored), chunk_size):
+        chunk = scored[chunk_start:chunk_start+chunk_size]
+        chunk_rows, chunk_segments = rows[chunk], segment_ids[chunk]
+        candidates = np.asarray(sense_store.matrix[chunk_rows], dtype=np.float64)
+        uv = np.einsum('ij,ij->i', candidates, targets[chunk_segments])
+        uu_vv = sense_store.squared_norms()[chunk_rows] * target_squared_norms[chunk_segments]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sims[chunk] = 1 - np.clip(1.0 - uv / np.sqrt(uu_vv), 0.0, 2.0)
+
+    # first candidate with the highest similarity in each instance,
+    # NaN never wins (like in score_synsets)
+    comparable = np.where(np.isnan(sims), -np.inf, sims)
+    nonempty = lens > 0
+    highest_conf = np.full(len(lens), -np.inf)
+    first_highest = np.zeros(len(lens), dtype=np.int64)
+    if nonempty.any():
+        highest_conf[nonempty] = np.maximum.reduceat(comparable, starts[nonempty])
+        positions = np.arange(len(rows))
+        is_highest = (comparable == highest_conf[segment_ids]) & (comparable > -np.inf)
+        first_highest[nonempty] = np.minimum.reduceat(np.where(is_highest, positions, len(rows)),
+                                                      starts[nonempty])
+
+    results = []
+    for i, candidate_synsets in enumerate(candidate_lists):
+        strategy = 'lstm'
+        if highest_conf[i] > -np.inf:
+            highest_synset = candidate_synsets[first_highest[i] - starts[i]]
+            synset_std = sense_store.stds[rows[first_highest[i]]]
+        elif mfs_fallback:
+            highest_synset = candidate_synsets[0]
+            synset_std = None
+            strategy = 'mfs_fallback'
+        else:
+            highest_synset = None
+            synset_std = None
+        results.append((highest_synset, synset_std, candidate_freqs[i], strategy))
+        if scores is not None:
+            segment = slice(starts[i], starts[i] + lens[i])
+            scores.append(dict((synset, sim) for synset, sim, scored_candidate
+                               in zip(candidate_synsets, sims[segment], has_embedding[segment])
+                               if scored_candidate))
+    return results
+
+
+
+def encode_instances(wsd_df, encoder):
+    """
+    compute the context embeddings of all instances in one go
+
+    :rtype: numpy.ndarray
+    :return: one target embedding per row of wsd_df
+    """
+    instances = []
     for row_index, row in wsd_df.iterrows():
         target_index, sentence_tokens, lemma, pos =  extract_sentence_wsd_competition(row)
-        instance_id = row['token_ids'][0]
-        target_id = vocab['<target>']
-        sentence_as_ids = [vocab.get(w) or vocab['<unkn>'] for w in sentence_tokens]
-        sentence_as_ids[target_index] = target_id
+        instances.append((sentence_tokens, target_index))
+    return encoder.encode(instances)
+
 
-        target_embeddings = sess.run(predicted_context_embs, {x: [sentence_as_ids],
-                                                              lens: [len(sentence_as_ids)]})
-        for target_embedding in target_embeddings:
-            break
+def select_candidates(wsd_df, wn, the_wn_version, gran,
+                      case_strategy, number_strategy, case_freq, plural_freq,
+                      lp_strategy=False, lp_info=dict()):
+    """
+    candidate synsets of all instances
 
-        #target_embedding = sess.run(predicted_context_embs, {x: [sentence_as_ids]})[0]
+    rows with the same token, lemma, pos, morphofeat and gold lexkeys share the
+    result of morpho_utils.candidate_selection
+
+    :rtype: dict
+    :return: mapping column -> list with one value per row of wsd_df:
+    candidate_synsets, new_candidate_synsets, gold_in_candidates,
+    the_chosen_candidates, synset2higher_level, wsd_strategy
+    """
+    columns = defaultdict(list)
+    selection_cache = dict()
+
+    for row_index, row in wsd_df.iterrows():
 
         # load token object
         token_obj = row['tokens'][0]
 
         # morphology reduced polysemy
-        pos = row['pos']
-        if the_wn_version in {'171'}:
-            pos = None
-        candidate_synsets, \
-        new_candidate_synsets, \
-        gold_in_candidates = morpho_utils.candidate_selection(wn,
-                                                              token=token_obj.text,
-                                                              target_lemma=row['target_lemma'],
-                                                              pos=row['pos'],
-                                                              morphofeat=token_obj.morphofeat,
-                                                              use_case=case_strategy,
-                                                              use_number=number_strategy,
-                                                              gold_lexkeys=row['lexkeys'],
-                                                              case_freq=case_freq,
-                                                              plural_freq=plural_freq,
-                                                              debug=False)
-
-        the_chosen_candidates = [synset2identifier(synset, wn_version=the_wn_version)
-                                 for synset in new_candidate_synsets]
+        key = (token_obj.text, row['target_lemma'], row['pos'], token_obj.morphofeat,
+               frozenset(row['lexkeys']))
+        if key not in selection_cache:
+            candidate_synsets, \
+            new_candidate_synsets, \
+            gold_in_candidates = morpho_utils.candidate_selection(wn,
+                                                                  token=token_obj.text,
+                                                                  target_lemma=row['target_lemma'],
+                                                                  pos=row['pos'],
+                                                                  morphofeat=token_obj.morphofeat,
+                                                                  use_case=case_strategy,
+                                                                  use_number=number_strategy,
+                                                                  gold_lexkeys=row['lexkeys'],
+                                                                  case_freq=case_freq,
+                                                                  plural_freq=plural_freq,
+                                                                  debug=False)
+            the_chosen_candidates = [synset2identifier(synset, wn_version=the_wn_version)
+                                     for synset in new_candidate_synsets]
+            selection_cache[key] = (candidate_synsets, new_candidate_synsets,
+                                    gold_in_candidates, the_chosen_candidates)
+        candidate_synsets, new_candidate_synsets, \
+        gold_in_candidates, the_chosen_candidates = selection_cache[key]
 
         # get mapping to higher abstraction level
         synset2higher_level = dict()
-        if args.gran in {'sensekey', 'blc20', 'direct_hypernym'}:
-            label = 'synset2%s' % args.gran
+        if gran in {'sensekey', 'blc20', 'direct_hypernym'}:
+            label = 'synset2%s' % gran
             synset2higher_level = row[label]
 
         # determine wsd strategy used
@@ -296,93 +370,184 @@ with tf.Session() as sess:  # your session object
                 the_chosen_candidates = [lp_result]
                 wsd_strategy = 'lp'
 
-        # perform wsd
-        if len(the_chosen_candidates) >= 2:
-            chosen_synset, \
-            candidate_std, \
-            candidate_freq, \
-            wsd_strategy = score_synsets(target_embedding,
-                                         the_chosen_candidates,
-                                         sense_embeddings,
-                                         instance_id,
-                                         lemma,
-                                         pos,
-                                         args.gran,
-                                         synset2higher_level)
+        columns['candidate_synsets'].append(candidate_synsets)
+        columns['new_candidate_synsets'].append(new_candidate_synsets)
+        columns['gold_in_candidates'].append(gold_in_candidates)
+        columns['the_chosen_candidates'].append(the_chosen_candidates)
+        columns['synset2higher_level'].append(synset2higher_level)
+        columns['wsd_strategy'].append(wsd_strategy)
 
-            #if strategy == 'mfs_fallback':
-            #    wsd_strategy = 'mfs_fallback'
+    return columns
 
-        else:
-            chosen_synset = None
-            candidate_std = None
-            if the_chosen_candidates:
-                chosen_synset = the_chosen_candidates[0]
-            candidate_freq = dict()
-
-        # add to dataframe
-        wsd_df.set_value(row_index, col='target_embedding', value=target_embedding)
-        wsd_df.set_value(row_index, col='lstm_output', value=chosen_synset)
-        wsd_df.set_value(row_index, col='std_chosen_synset', value=candidate_std)
-
-        wsd_df.set_value(row_index, col='#_cand_synsets', value=len(candidate_synsets))
-        wsd_df.set_value(row_index, col='#_new_cand_synsets', value=len(new_candidate_synsets))
-        wsd_df.set_value(row_index, col='gold_in_new_cand_synsets', value=gold_in_candidates)
-
-        # score it
-        lstm_acc = chosen_synset in row['source_wn_engs'] # used to be wn30_engs
-
-
-        has_gold_embedding = False
-
-        for source_wn_eng in row['source_wn_engs']:
-            if source_wn_eng in candidate_freq:
-                if candidate_freq[source_wn_eng]:
-                    has_gold_embedding = True
-
-        num_embeddings = 0
-        for synset_id, freq in candidate_freq.items():
-            if synset_id in sense_embeddings:
-                num_embeddings += 1
-
-        wsd_df.set_value(row_index, col='has_gold_embedding', value=has_gold_embedding)
-        wsd_df.set_value(row_index, col='num_embeddings', value=num_embeddings)
-        wsd_df.set_value(row_index, col='lstm_acc', value=lstm_acc)
-        wsd_df.set_value(row_index, col='emb_freq', value=candidate_freq)
-        wsd_df.set_value(row_index, col='wsd_strategy', value=wsd_strategy)
-
-        if lstm_acc:
-            num_correct += 1
-
-print(num_correct)
-
-# save it
-wsd_df.to_pickle(args.output_path)
-
-with open(args.results, 'w') as outfile:
-    outfile.write('%s' % num_correct)
-
-# json output path
-output_path_json = args.results.replace('.txt', '.json')
-
-results = score_utils.experiment_results(wsd_df, args.mfs_fallback, args.wsd_df_path)
-
-with open(output_path_json, 'w') as outfile:
-    json.dump(results, outfile)
-
-# official scorer if possible
-exp_folder = args.results.replace('/results.txt', '')
-official_scorer.create_key_file(wn, exp_folder, debug=1)
-official_scorer.score_using_official_scorer(exp_folder, 
-                                            scorer_folder='resources/WSD_Unified_Evaluation_Datasets')
-
-# write tsne visualizations
-visualize = False
-if visualize:
-    output_folder = args.results.replace('/results.txt', '')
-    tsne_utils.create_tsne_visualizations(output_folder,
-                                          correct={False, True},
-                                          meanings=True,
-                                          instances=True,
-                                          polysemy=range(2, 1000),
-                                          num_embeddings=range(2, 1000))
+
+def object_column(values):
+    """
+    numpy array of dtype object, keeps values such as arrays and sets in
+    one cell each (like the None-initialized columns filled with set_value)
+    """
+    column = np.empty(len(values), dtype=object)
+    for index, value in enumerate(values):
+        column[index] = value
+    return column
+
+
+def disambiguate(wsd_df, target_embeddings, candidates, sense_embeddings, meaning_freqs, gran, mfs_fallback):
+    """
+    score the candidates of all instances and add the output columns to wsd_df
+
+    :param pandas.core.frame.DataFrame wsd_df: wsd competition dataframe
+    :param numpy.ndarray target_embeddings: output of encode_instances
+    :param dict candidates: output of select_candidates
+    :param sense_store.SenseStore sense_embeddings: meaning -> (embedding, std)
+    :param dict meaning_freqs: mapping meaning -> frequency
+    :param str gran: sensekey | synset | blc20 | direct_hypernym
+    :param bool mfs_fallback: if True, the first candidate is chosen when none of them has an embedding
+
+    :rtype: int
+    :return: number of correctly disambiguated instances
+    """
+    the_chosen_candidates = candidates['the_chosen_candidates']
+    wsd_strategies = list(candidates['wsd_strategy'])
+
+    # perform wsd: score all instances with two or more candidates at once
+    to_score = [index for index, chosen in enumerate(the_chosen_candidates) if len(chosen) >= 2]
+    scored_outputs = score_synsets_batch(target_embeddings[to_score],
+                                         [the_chosen_candidates[index] for index in to_score],
+                                         sense_embeddings,
+                                         gran,
+                                         [candidates['synset2higher_level'][index] for index in to_score],
+                                         meaning_freqs,
+                                         mfs_fallback)
+
+    chosen_synsets = [chosen[0] if chosen else None for chosen in the_chosen_candidates]
+    candidate_stds = [None] * len(the_chosen_candidates)
+    candidate_freqs = [dict() for _ in the_chosen_candidates]
+    for index, (chosen_synset, candidate_std, candidate_freq, wsd_strategy) in zip(to_score, scored_outputs):
+        chosen_synsets[index] = chosen_synset
+        candidate_stds[index] = candidate_std
+        candidate_freqs[index] = candidate_freq
+        wsd_strategies[index] = wsd_strategy
+
+    # score it
+    lstm_accs = []
+    has_gold_embeddings = []
+    nums_embeddings = []
+    for chosen_synset, candidate_freq, source_wn_engs in zip(chosen_synsets, candidate_freqs,
+                                                             wsd_df['source_wn_engs']):
+        lstm_accs.append(chosen_synset in source_wn_engs) # used to be wn30_engs
+        has_gold_embeddings.append(any(candidate_freq.get(source_wn_eng)
+                                       for source_wn_eng in source_wn_engs))
+        nums_embeddings.append(sum(1 for synset_id in candidate_freq
+                                   if synset_id in sense_embeddings))
+
+    # add to dataframe, the columns in the order in which they used to be created
+    wsd_df['lstm_output'] = object_column(chosen_synsets)
+    wsd_df['target_embedding'] = object_column(list(target_embeddings))
+    wsd_df['std_chosen_synset'] = object_column(candidate_stds)
+    wsd_df['lstm_acc'] = object_column(lstm_accs)
+    wsd_df['emb_freq'] = object_column(candidate_freqs)
+    wsd_df['#_cand_synsets'] = object_column([len(c) for c in candidates['candidate_synsets']])
+    wsd_df['#_new_cand_synsets'] = object_column([len(c) for c in candidates['new_candidate_synsets']])
+    wsd_df['gold_in_new_cand_synsets'] = object_column(candidates['gold_in_candidates'])
+    wsd_df['wsd_strategy'] = object_column(wsd_strategies)
+    wsd_df['num_embeddings'] = object_column(nums_embeddings)
+    wsd_df['has_gold_embedding'] = object_column(has_gold_embeddings)
+
+    return sum(lstm_accs)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.mfs_fallback = args.mfs_fallback == 'True'
+    case_strategy = args.use_case_strategy == 'True'
+    number_strategy = args.use_number_strategy == 'True'
+    lp_strategy = args.use_lp == 'True'
+
+    case_freq = pickle.load(open(args.path_case_freq, 'rb'))
+    plural_freq = pickle.load(open(args.path_plural_freq, 'rb'))
+
+
+    lp_info = dict()
+    if lp_strategy:
+        lp_info = pickle.load(open(args.path_lp, 'rb'))
+
+    the_wn_version = '30'
+    if '171' in args.wsd_df_path:
+        the_wn_version = '171'
+    # load relevant wordnet (the snapshot if wn_snapshot.py has created it)
+    wn = load_wordnet(the_wn_version)
+
+    if args.candidate_index:
+        wn = CandidateIndex(args.candidate_index, fallback=wn)
+        assert wn.wn_version == the_wn_version, 'candidate index of WordNet %s' %wn.wn_version
+
+    # load sense embeddings
+    sense_embeddings = load_sense_store(args.sense_embeddings_path)
+    meaning_freqs = sense_embeddings.meaning_freqs
+
+    with open(args.log_path, 'w') as outfile:
+        json.dump(args.__dict__, outfile)
+
+    timings = OrderedDict()
+    start_sec = time()
+
+    # load wsd competition dataframe
+    wsd_df = pandas.read_pickle(args.wsd_df_path)
+
+    vocab = np.load(args.vocab_path)
+    timings['loading'] = time() - start_sec
+
+    start_sec = time()
+    with open_encoder(args.model_path, vocab, args.encoder, cache_dir=args.cache_dir,
+                      cache_size_mb=args.cache_size_mb) as encoder:
+        all_target_embeddings = encode_instances(wsd_df, encoder)
+    timings['encoding'] = time() - start_sec
+
+    start_sec = time()
+    candidates = select_candidates(wsd_df, wn, the_wn_version, args.gran,
+                                   case_strategy, number_strategy, case_freq, plural_freq,
+                                   lp_strategy, lp_info)
+    timings['candidate selection'] = time() - start_sec
+
+    start_sec = time()
+    num_correct = disambiguate(wsd_df, all_target_embeddings, candidates,
+                               sense_embeddings, meaning_freqs, args.gran, args.mfs_fallback)
+    timings['scoring'] = time() - start_sec
+
+    print(num_correct)
+
+    start_sec = time()
+    # save it
+    wsd_df.to_pickle(args.output_path)
+
+    with open(args.results, 'w') as outfile:
+        outfile.write('%s' % num_correct)
+
+    # json output path
+    output_path_json = args.results.replace('.txt', '.json')
+
+    results = score_utils.experiment_results(wsd_df, args.mfs_fallback, args.wsd_df_path)
+
+    with open(output_path_json, 'w') as outfile:
+        json.dump(results, outfile)
+
+    # official scorer if possible
+    exp_folder = args.results.replace('/results.txt', '')
+    official_scorer.create_key_file(wn, exp_folder, debug=1)
+    official_scorer.score_using_official_scorer(exp_folder, 
+                                                scorer_folder='resources/WSD_Unified_Evaluation_Datasets')
+
+    timings['output'] = time() - start_sec
+    for stage, elapsed_sec in timings.items():
+        print('%s: %.2f sec' %(stage, elapsed_sec))
+
+    # write tsne visualizations
+    visualize = False
+    if visualize:
+        output_folder = args.results.replace('/results.txt', '')
+        tsne_utils.create_tsne_visualizations(output_folder,
+                                              correct={False, True},
+                                              meanings=True,
+                                              instances=True,
+                                              polysemy=range(2, 1000),
+                                              num_embeddings=range(2, 1000))
@@ -4,8 +4,7 @@ from lxml import html
 from datetime import datetime
 import pickle
 #from semantic_class_manager import BLC
-from nltk.corpus.reader.wordnet import WordNetCorpusReader
-from nltk.corpus import wordnet as wn
+import nltk
 
 
 try:
@@ -18,6 +17,7 @@ except ModuleNotFoundError:
 
 import mapping_utils
 import wn_utils
+from wn_snapshot import load_wordnet
 from collections import defaultdict
 import pandas
 from random import sample
@@ -69,14 +69,15 @@ assert os.path.exists(input_mapping_path)
 # wn version
 assert args.wn_version in {'171', '30'}, 'wordnet version: %s is not supported' % args.wn_version
 
-path_to_wn_dict_folder = str(wn._get_root())  # change this for other wn versions
+path_to_wn_dict_folder = str(nltk.data.find('corpora/wordnet'))  # change this for other wn versions
 path_to_wn_index_sense = os.path.join(path_to_wn_dict_folder, 'index.sense')  # change this for other wn versions
 
 if args.wn_version == '171':
     cwd = os.path.dirname(os.path.realpath(__file__))
     path_to_wn_dict_folder = os.path.join(cwd, 'resources', 'wordnet_171', 'WordNet-1.7.1', 'dict')
     path_to_wn_index_sense = os.path.join(path_to_wn_dict_folder, 'index.sense')
-    wn = WordNetCorpusReader(path_to_wn_dict_folder, None)
+
+wn = load_wordnet(args.wn_version)
 
 
 # competition
@@ -0,0 +1,151 @@
+'''
+Compact store of meaning (sense) embeddings.
+
+test-lstm_v2.py used to write the meaning embeddings only as a pickled dict
+meaning -> (average embedding, std) plus a pickled dict of frequencies. A
+SenseStore keeps the same information in a directory of .npy files:
+
+    matrix.npy      float32, one row per meaning
+    normalized.npy  the same rows divided by their L2 norm (optional)
+    ids.npy         meaning identifiers, ids[row]
+    stds.npy        std of each meaning
+    freqs.npy       number of instances of each meaning
+
+The files are memory-mapped so loading takes milliseconds. SenseStore also
+behaves like the old dict (store[meaning] -> (embedding, std)) so it can be
+passed to code written for the pickles.
+
+Convert existing pickles (and .instances, see embedding_accumulator.py) with:
+
+python3 sense_store.py output/meaning_embeddings.bin
+'''
+import os
+import sys
+import pickle
+from collections import defaultdict
+from collections.abc import Mapping
+import numpy as np
+
+
+class SenseStore(Mapping):
+
+    def __init__(self, ids, matrix, stds, freqs, normalized=None):
+        self.ids = ids
+        self.matrix = matrix
+        self.stds = stds
+        self.freqs = freqs
+        self.normalized = normalized
+        self._squared_norms = None
+        self.index = dict((meaning, row) for row, meaning in enumerate(ids))
+
+    @classmethod
+    def from_dicts(cls, sense2avg_embedding, meaning_freqs):
+        ''' Build a store from the dicts that test-lstm_v2.py pickles '''
+        ids = list(sense2avg_embedding)
+        if ids:
+            matrix = np.vstack([sense2avg_embedding[meaning][0] for meaning in ids])
+        else:
+            matrix = np.empty((0, 0))
+        stds = np.array([sense2avg_embedding[meaning][1] for meaning in ids], dtype=np.float32)
+        freqs = np.array([meaning_freqs.get(meaning, 0) for meaning in ids], dtype=np.int64)
+        return cls(np.array(ids, dtype=np.str_), matrix.astype(np.float32), stds, freqs)
+
+    @classmethod
+    def from_pickles(cls, path):
+        ''' path: meaning embeddings written by test-lstm_v2.py (with path + '.freq') '''
+        with open(path, 'rb') as infile:
+            sense2avg_embedding = pickle.load(infile)
+        with open(path + '.freq', 'rb') as infile:
+            meaning_freqs = pickle.load(infile)
+        return cls.from_dicts(sense2avg_embedding, meaning_freqs)
+
+    @classmethod
+    def load(cls, store_dir, mmap_mode='r'):
+        load = lambda name, mode=None: np.load(os.path.join(store_dir, name + '.npy'),
+                                               mmap_mode=mode)
+        normalized = None
+        if os.path.exists(os.path.join(store_dir, 'normalized.npy')):
+            normalized = load('normalized', mmap_mode)
+        return cls(load('ids'), load('matrix', mmap_mode), load('stds'), load('freqs'),
+                   normalized)
+
+    def save(self, store_dir, normalize=True):
+        os.makedirs(store_dir, exist_ok=True)
+        save = lambda name, array: np.save(os.path.join(store_dir, name + '.npy'), array)
+        save('ids', self.ids)
+        save('matrix', self.matrix)
+        save('stds', self.stds)
+        save('freqs', self.freqs)
+        if normalize:
+            save('normalized', self.normalized_matrix())
+
+    def normalized_matrix(self):
+        if self.normalized is None:
+            norms = np.linalg.norm(self.matrix, axis=1, keepdims=True)
+            # all-zero rows stay zero
+            self.normalized = (self.matrix / np.maximum(norms, 1e-12)).astype(np.float32)
+        return self.normalized
+
+    def squared_norms(self):
+        ''' Squared L2 norm of each row (float64), computed once '''
+        if self._squared_norms is None:
+            matrix = np.asarray(self.matrix, dtype=np.float64)
+            self._squared_norms = np.einsum('ij,ij->i', matrix, matrix)
+        return self._squared_norms
+
+    def rows(self, meanings):
+        ''' Row of each meaning, -1 for meanings that are not in the store '''
+        return np.fromiter((self.index.get(meaning, -1) for meaning in meanings),
+                           dtype=np.int64)
+
+    def gather(self, meanings, normalized=False):
+        ''' Matrix of the embeddings of meanings, all of them must be in the store '''
+        rows = self.rows(meanings)
+        assert (rows >= 0).all(), 'Unknown meanings'
+        matrix = self.normalized_matrix() if normalized else self.matrix
+        return matrix[rows]
+
+    @property
+    def meaning_freqs(self):
+        ''' The frequencies as written to the .freq pickle '''
+        return defaultdict(int, zip(self.ids.tolist(), self.freqs.tolist()))
+
+    def __getitem__(self, meaning):
+        row = self.index[meaning]
+        return self.matrix[row], self.stds[row]
+
+    def __contains__(self, meaning):
+        return meaning in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+def load_sense_store(path, mmap_mode='r'):
+    '''
+    path: meaning embeddings written by test-lstm_v2.py. Reads the store in
+    path + '.store' or, if there is none, converts the pickles.
+    '''
+    store_dir = path + '.store'
+    if os.path.isdir(store_dir):
+        return SenseStore.load(store_dir, mmap_mode)
+    return SenseStore.from_pickles(path)
+
+
+if __name__ == '__main__':
+    from embedding_accumulator import InstanceWriter
+    for path in sys.argv[1:]:
+        SenseStore.from_pickles(path).save(path + '.store')
+        print('Written %s.store' %path)
+        instances_path = path + '.instances'
+        if os.path.exists(instances_path) and not os.path.exists(instances_path + '.index'):
+            with open(instances_path, 'rb') as infile:
+                synset2context_embds = pickle.load(infile)
+            instance_writer = InstanceWriter(instances_path)
+            for meaning, embeddings in synset2context_embds.items():
+                instance_writer.add([meaning] * len(embeddings), embeddings)
+            instance_writer.close()
+            print('Written %s.index and %s.data' %(instances_path, instances_path))
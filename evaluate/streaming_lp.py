@@ -0,0 +1,242 @@
+'''
+Streaming label propagation for unbounded unlabeled data, after the
+streaming approximation of Ravi and Diao (2015) (see expander() in
+label_propagation.py).
+
+LabelPropagation.predict() builds the graph of all instances of a lemma, so
+the amount of unlabeled text is limited by memory. StreamingLabelPropagation
+reads the unlabeled instances in chunks of chunk_size, encodes them and
+connects each of them to its num_neighbors most similar nodes of its lemma.
+The nodes of a lemma are bounded: its labeled instances plus a reservoir
+sample of at most reservoir_size unlabeled instances. Instead of a
+distribution over all senses, every node has a sketch of at most sketch_size
+(sense, score) pairs:
+
+- an unlabeled instance gets the sum of the (normalized) sketches of its
+  neighbours, weighted by their similarity, truncated to the largest scores
+- the reservoir nodes among these neighbours receive the same message back,
+  so their sketches summarize the part of the stream that is close to them
+
+Memory depends on the labeled instances, reservoir_size and chunk_size, not
+on the length of the stream. With num_passes=2 the first pass only builds the
+reservoirs and their sketches and the second one labels the instances, which
+needs a stream that can be iterated twice (a list or a reader object rather
+than a generator).
+'''
+from itertools import islice
+from time import time
+import numpy as np
+from label_propagation import LabelPropagation, expander
+from knn_graph import _top_columns
+
+
+def _normalize(scores):
+    normalizer = scores.sum(axis=1)
+    normalizer[normalizer == 0] = 1
+    return scores / normalizer[:,np.newaxis]
+
+
+class LemmaSketches(object):
+    '''
+    The nodes of one lemma: rows [0, num_seeds) are the labeled instances,
+    the others the reservoir. sketch_senses holds sense indices (into
+    senses), -1 for an empty entry.
+    '''
+
+    def __init__(self, contexts, senses, reservoir_size, sketch_size, rng):
+        self.senses = sorted(set(senses))
+        sense2index = dict((sense, i) for i, sense in enumerate(self.senses))
+        self.num_seeds = len(senses)
+        self.reservoir_size = reservoir_size
+        self.rng = rng
+        capacity = self.num_seeds + reservoir_size
+        self.vectors = np.empty((capacity, contexts.shape[1]), dtype=contexts.dtype)
+        self.vectors[:self.num_seeds] = contexts
+        self.sketch_senses = np.full((capacity, sketch_size), -1, dtype=np.int32)
+        self.sketch_scores = np.zeros((capacity, sketch_size), dtype=np.float32)
+        self.sketch_senses[:self.num_seeds,0] = [sense2index[sense] for sense in senses]
+        self.sketch_scores[:self.num_seeds,0] = 1
+        self.size = self.num_seeds
+        self.num_seen = 0
+
+    def _scores(self, senses, sketch_scores):
+        ''' the dense [number of sketches, number of senses] scores of sketches '''
+        scores = np.zeros((len(senses), len(self.senses)))
+        filled = senses >= 0
+        np.add.at(scores, (np.nonzero(filled)[0], senses[filled]), sketch_scores[filled])
+        return scores
+
+    def _sketches(self, scores):
+        ''' truncate dense scores to the sketch_size largest ones '''
+        sketch_size = self.sketch_senses.shape[1]
+        top = _top_columns(scores, min(sketch_size, scores.shape[1]))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        senses = np.full((len(scores), sketch_size), -1, dtype=np.int32)
+        sketch_scores = np.zeros((len(scores), sketch_size), dtype=np.float32)
+        senses[:,:top.shape[1]] = np.where(top_scores > 0, top, -1)
+        sketch_scores[:,:top.shape[1]] = np.maximum(top_scores, 0)
+        return senses, sketch_scores
+
+    def update(self, contexts, sim_func, num_neighbors, learn=True):
+        '''
+        Propagate the sketches to a chunk of unlabeled instances of the lemma.
+        With learn, the reservoir nodes get the messages of the chunk and the
+        chunk is sampled into the reservoir.
+
+        :return: the sense index of each instance, -1 if no neighbour has a
+        positive similarity
+        '''
+        sims = np.asarray(sim_func(contexts, self.vectors[:self.size]), dtype=np.float64)
+        neighbors = _top_columns(sims, min(num_neighbors, self.size))
+        # a negative similarity (expander) is no evidence for a sense
+        weights = np.maximum(np.take_along_axis(sims, neighbors, axis=1), 0)
+        distributions = _normalize(self._scores(self.sketch_senses[:self.size],
+                                                self.sketch_scores[:self.size]))
+        scores = (weights[:,:,np.newaxis] * distributions[neighbors]).sum(axis=1)
+        senses, sketch_scores = self._sketches(scores)
+        if learn:
+            self._send_messages(neighbors, weights, _normalize(self._scores(senses, sketch_scores)))
+            self._sample(contexts, senses, sketch_scores)
+        # the sketches are not ordered
+        best = np.argmax(sketch_scores, axis=1)
+        return np.where(sketch_scores.max(axis=1) > 0, senses[np.arange(len(senses)), best], -1)
+
+    def _send_messages(self, neighbors, weights, distributions):
+        is_reservoir = neighbors >= self.num_seeds
+        if not is_reservoir.any():
+            return
+        rows = np.unique(neighbors[is_reservoir])
+        scores = self._scores(self.sketch_senses[rows], self.sketch_scores[rows])
+        instances, columns = np.nonzero(is_reservoir)
+        np.add.at(scores, np.searchsorted(rows, neighbors[instances, columns]),
+                  weights[instances, columns, np.newaxis] * distributions[instances])
+        self.sketch_senses[rows], self.sketch_scores[rows] = self._sketches(scores)
+
+    def _sample(self, contexts, senses, sketch_scores):
+        ''' reservoir sampling (algorithm R) of the chunk '''
+        num_free = min(len(contexts), self.num_seeds + self.reservoir_size - self.size)
+        rows = np.arange(self.size, self.size + num_free)
+        self.vectors[rows] = contexts[:num_free]
+        self.sketch_senses[rows], self.sketch_scores[rows] = senses[:num_free], sketch_scores[:num_free]
+        self.size += num_free
+        seen = self.num_seen + np.arange(num_free, len(contexts))
+        slots = (self.rng.random_sample(len(seen)) * (seen + 1)).astype(np.int64)
+        for i in np.flatnonzero(slots < self.reservoir_size):
+            # later instances overwrite earlier ones, like the sequential algorithm
+            row = self.num_seeds + slots[i]
+            self.vectors[row] = contexts[num_free + i]
+            self.sketch_senses[row], self.sketch_scores[row] = senses[num_free + i], sketch_scores[num_free + i]
+        self.num_seen += len(contexts)
+
+
+class StreamingLabelPropagation(LabelPropagation):
+    '''
+    num_neighbors: number of neighbours of an unlabeled instance
+    sketch_size: number of (sense, score) pairs per node
+    reservoir_size: maximum number of unlabeled nodes per lemma
+    chunk_size: number of unlabeled instances that are encoded at once
+    num_passes: 1 or 2, see the module documentation
+    '''
+
+    def __init__(self, sess, vocab_path, model_path, batch_size, sim_func=expander,
+                 cache_dir=None, num_neighbors=10, sketch_size=5, reservoir_size=2000,
+                 chunk_size=5000, num_passes=1, seed=4625):
+        LabelPropagation.__init__(self, sess, vocab_path, model_path, batch_size,
+                                  sim_func=sim_func, cache_dir=cache_dir)
+        self.num_neighbors = num_neighbors
+        self.sketch_size = sketch_size
+        self.reservoir_size = reservoir_size
+        self.chunk_size = chunk_size
+        self.num_passes = num_passes
+        self.seed = seed
+        self.num_streamed = 0
+        self.num_unreached = 0
+
+    def _encode(self, instances):
+        contexts = self.encoder.encode((sentence_tokens, target_index)
+                                       for _, sentence_tokens, target_index in instances)
+        if self.encoder.cache is not None:
+            self.encoder.cache.flush()
+        return contexts
+
+    def _seed_sketches(self, labeled_data):
+        rng = np.random.RandomState(self.seed)
+        lemma2sketches = {}
+        for lemma, instances in labeled_data.items():
+            instances = [instance for instance in instances if instance[0] is not None]
+            if instances:
+                lemma2sketches[lemma] = LemmaSketches(self._encode(instances),
+                                                      [sense for sense, _, _ in instances],
+                                                      self.reservoir_size, self.sketch_size, rng)
+        return lemma2sketches
+
+    def _stream_chunks(self, lemma2sketches, unlabeled, learn):
+        instances = iter(unlabeled)
+        while True:
+            chunk = list(islice(instances, self.chunk_size))
+            if not chunk:
+                return
+            contexts = self._encode(chunk)
+            # in the order of first occurrence, the sampling is reproducible
+            lemma2rows = {}
+            for row, (lemma, _, _) in enumerate(chunk):
+                lemma2rows.setdefault(lemma, []).append(row)
+            senses = [None] * len(chunk)
+            for lemma, rows in lemma2rows.items():
+                if lemma not in lemma2sketches:
+                    continue
+                sketches = lemma2sketches[lemma]
+                for row, index in zip(rows, sketches.update(contexts[rows], self.sim_func,
+                                                            self.num_neighbors, learn)):
+                    if index >= 0:
+                        senses[row] = sketches.senses[index]
+            yield chunk, senses
+
+    def predict_stream(self, labeled_data, unlabeled):
+        '''
+        labeled_data: dict(lemma -> list((sense_id[str], sentence_tokens, target_index))),
+        kept in memory (unlabeled instances in it are ignored)
+        unlabeled: iterable of (lemma, sentence_tokens, target_index), read
+        chunk_size instances at a time, iterated twice if num_passes is 2
+
+        output: yields (lemma, sense_id) for every unlabeled instance in the
+        input order, sense_id is None if the lemma has no labeled instance
+        or the instance no neighbour with a positive similarity
+        '''
+        assert self.num_passes in (1, 2), 'num_passes must be 1 or 2'
+        if self.num_passes == 2 and iter(unlabeled) is unlabeled:
+            raise ValueError('Two passes need a stream that can be iterated twice, not an iterator')
+        start_sec = time()
+        lemma2sketches = self._seed_sketches(labeled_data)
+        if self.num_passes == 2:
+            for _ in self._stream_chunks(lemma2sketches, unlabeled, learn=True):
+                pass
+        for chunk, senses in self._stream_chunks(lemma2sketches, unlabeled,
+                                                 learn=(self.num_passes == 1)):
+            self.num_streamed += len(chunk)
+            self.num_unreached += senses.count(None)
+            self.predicting_elapsed_sec += time() - start_sec
+            for (lemma, _, _), sense in zip(chunk, senses):
+                yield lemma, sense
+            start_sec = time()
+
+    def predict(self, data):
+        '''
+        Same input and output as LabelPropagation.predict(), the unlabeled
+        instances are streamed in their order in data.
+        '''
+        unlabeled = [(lemma, sentence_tokens, target_index)
+                     for lemma in data
+                     for sense, sentence_tokens, target_index in data[lemma]
+                     if sense is None]
+        predicted = self.predict_stream(data, unlabeled)
+        output = {}
+        for lemma in data:
+            output[lemma] = [sense if sense is not None else next(predicted)[1]
+                             for sense, _, _ in data[lemma]]
+        return output
+
+    def print_stats(self):
+        print('Predicting time: %.2f min' %(self.predicting_elapsed_sec/60.0))
+        print('Number of streamed instances: %d, without a label: %d'
+              %(self.num_streamed, self.num_unreached))
@@ -1,11 +1,14 @@
 import numpy as np
-import tensorflow as tf
 from collections import defaultdict 
 import argparse
 import pickle
 from datetime import datetime
 from itertools import islice
-import tensor_utils as utils
+from multiprocessing import Pool
+from context_encoder import open_encoder
+from embedding_accumulator import SenseAccumulator, InstanceWriter, remove_instances
+from sense_store import SenseStore
+from line_shards import shard_offsets, line_offset, read_lines
 
 
 parser = argparse.ArgumentParser(description='Trains meaning embeddings based on precomputed LSTM model')
@@ -18,9 +21,12 @@ parser.add_argument('-o',dest='output_path', required=True, help='path where sen
 parser.add_argument('-b', dest='batch_size', required=True, help='batch size')
 parser.add_argument('-t', dest='max_lines', required=True, help='maximum number of lines you want to train on')
 parser.add_argument('-s', dest='setting', required=True, help='sensekey | synset | hdn')
-args = parser.parse_args()
-
-print('loaded arguments for training meaning embeddings')
+parser.add_argument('-e', dest='encoder', default='tensorflow', help='tensorflow | numpy (requires export-inference-model.py)')
+parser.add_argument('--cache_dir', help='directory of the context embedding cache (no caching if not given)')
+parser.add_argument('--cache_size_mb', type=int, default=2048, help='maximum size of the embedding cache')
+parser.add_argument('--instances', default='memmap', help='how to store the instance embeddings: memmap (.instances.data + .instances.index) | pickle (.instances, needs memory for all of them) | none')
+parser.add_argument('--instances_dtype', default='float32', help='float32 | float16, for --instances memmap')
+parser.add_argument('-n', dest='num_workers', type=int, default=1, help='number of worker processes, each encodes a part of the input (-e numpy recommended)')
 
 def ctx_embd_input(sentence):
     """
@@ -47,41 +53,52 @@ def ctx_embd_input(sentence):
     return tokens, annotation_indices
 
 
+def input_end(input_path, max_lines, batch_size):
+    """
+    the byte offset where the unsharded loop stops reading, i.e. the batch
+    that reaches max_lines is not used
 
-    
-vocab = np.load(args.vocab_path)
-print('loaded vocab')
-
-synset2context_embds = defaultdict(list)
-synset2instances = dict()
-meaning_freqs = defaultdict(int)
-batch_size = int(args.batch_size)
-counter = 0
+    :rtype: int
+    :return: byte offset, None for the whole input
+    """
+    if line_offset(input_path, max(max_lines, 1) - 1) is None:
+        return None
+    return line_offset(input_path, max(0, (max_lines-1) // batch_size * batch_size))
 
 
-with tf.Session() as sess:  # your session object
-    saver = tf.train.import_meta_graph(args.model_path + '.meta', clear_devices=True)
-    saver.restore(sess, args.model_path)
-    x, predicted_context_embs, lens = utils.load_tensors(sess)
-    #x = sess.graph.get_tensor_by_name('Model_1/x:0')
-    #predicted_context_embs = sess.graph.get_tensor_by_name('Model_1/predicted_context_embs:0')
-    #lens = sess.graph.get_tensor_by_name('Model_1/lens:0')
+def encode_shard(args, start, end, instances_path):
+    """
+    compute the context embeddings of the lines in [start, end)
 
+    :param str instances_path: where the instance embeddings are written
+    (with --instances memmap)
 
-    with open(args.input_path) as infile:
-        for n_lines in iter(lambda: tuple(islice(infile, batch_size)), ()):
+    :rtype: tuple
+    :return: (meaning_freqs, accumulator, synset2context_embds) of the shard,
+    synset2context_embds is None unless --instances pickle
+    """
+    vocab = np.load(args.vocab_path)
+    batch_size = int(args.batch_size)
+    meaning_freqs = defaultdict(int)
+    accumulator = SenseAccumulator()
+    synset2context_embds = defaultdict(list) if args.instances == 'pickle' else None
+    instance_writer = None
+    if args.instances == 'memmap':
+        instance_writer = InstanceWriter(instances_path, dtype=args.instances_dtype)
+    counter = 0
+
+    with open_encoder(args.model_path, vocab, args.encoder, cache_dir=args.cache_dir,
+                      cache_size_mb=args.cache_size_mb) as encoder:
+
+        lines = read_lines(args.input_path, start, end)
+        for n_lines in iter(lambda: tuple(islice(lines, batch_size)), ()):
 
             counter += len(n_lines)
-            if counter >= int(args.max_lines):
-                break
-            
-
-            print(counter, datetime.now())
+            print(start, counter, datetime.now())
 
             identifiers = []  # list of sy_ids
-            annotated_sentences = []
-            sentence_lens = []  # list of ints
-            
+            instances = []  # list of (tokens, target index)
+
             for line in n_lines:
 
                 sentence = line.strip()
@@ -92,44 +109,78 @@ with tf.Session() as sess:  # your session object
                     if args.setting == 'hdn':
                         base_synset, synset_id = synset_id.split('_')
 
-                    sentence_as_ids = [vocab.get(w) or vocab['<unkn>'] for w in tokens]
-                    target_id = vocab['<target>']
-                    sentence_as_ids[index] = target_id
-
                     meaning_freqs[synset_id] += 1
 
                     # update batch information
                     identifiers.append(synset_id)
-                    annotated_sentences.append(sentence_as_ids)
-                    sentence_lens.append(len(sentence_as_ids))
+                    instances.append((tokens, index))
 
             # compute embeddings for batch
-            max_length  = max([len(_list) for _list in annotated_sentences])
-            for _list in annotated_sentences:
-                length_diff = max_length - len(_list)
-                [_list.append(vocab['<unkn>']) for _ in range(length_diff)]
-
-            target_embeddings = sess.run(predicted_context_embs, {x: annotated_sentences,
-                                                                  lens: sentence_lens})
+            target_embeddings = encoder.encode(instances)
 
             for synset_id, target_embedding in zip(identifiers, target_embeddings):
-                synset2context_embds[synset_id].append(target_embedding)
-
-
-
-synset2avg_embedding = dict()
-for synset, embeddings in synset2context_embds.items():
-    average = sum(embeddings) / len(embeddings)
-    std = np.std(embeddings)
-    if len(embeddings) == 1:
-        assert all(average == embeddings[0])
-    synset2avg_embedding[synset] = average, std
-
-with open(args.output_path, 'wb') as outfile:
-    pickle.dump(synset2avg_embedding, outfile)
-
-with open(args.output_path + '.instances', 'wb') as outfile:
-    pickle.dump(synset2context_embds, outfile)
-
-with open(args.output_path + '.freq', 'wb') as outfile:
-    pickle.dump(meaning_freqs, outfile)
+                accumulator.add(synset_id, target_embedding)
+                if synset2context_embds is not None:
+                    synset2context_embds[synset_id].append(target_embedding)
+            if instance_writer is not None:
+                instance_writer.add(identifiers, target_embeddings)
+
+    if instance_writer is not None:
+        instance_writer.close()
+    return meaning_freqs, accumulator, synset2context_embds
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.num_workers > 1 and args.cache_dir:
+        parser.error('the embedding cache does not support concurrent writers, use one worker')
+
+    print('loaded arguments for training meaning embeddings')
+
+    shards = shard_offsets(args.input_path, args.num_workers,
+                           input_end(args.input_path, int(args.max_lines), int(args.batch_size)))
+    instances_path = args.output_path + '.instances'
+    if len(shards) == 1:
+        shard_instances_paths = [instances_path]
+    else:
+        shard_instances_paths = ['%s.part%d' %(instances_path, shard_no)
+                                 for shard_no in range(len(shards))]
+    shard_args = [(args, start, end, shard_instances_path)
+                  for (start, end), shard_instances_path in zip(shards, shard_instances_paths)]
+    if args.num_workers > 1:
+        with Pool(args.num_workers) as pool:
+            partials = pool.starmap(encode_shard, shard_args)
+    else:
+        partials = [encode_shard(*a) for a in shard_args]
+
+    # reduce: shards are merged in input order so that the instances keep their order
+    meaning_freqs = defaultdict(int)
+    accumulator = SenseAccumulator()
+    synset2context_embds = defaultdict(list)
+    for shard_freqs, shard_accumulator, shard_embds in partials:
+        for synset_id, freq in shard_freqs.items():
+            meaning_freqs[synset_id] += freq
+        accumulator.merge(shard_accumulator)
+        if shard_embds is not None:
+            for synset_id, embeddings in shard_embds.items():
+                synset2context_embds[synset_id].extend(embeddings)
+
+    if args.instances == 'memmap' and len(shards) > 1:
+        instance_writer = InstanceWriter(instances_path, dtype=args.instances_dtype)
+        for shard_instances_path in shard_instances_paths:
+            instance_writer.append_file(shard_instances_path)
+            remove_instances(shard_instances_path)
+        instance_writer.close()
+
+    synset2avg_embedding = accumulator.averages()
+    with open(args.output_path, 'wb') as outfile:
+        pickle.dump(synset2avg_embedding, outfile)
+    SenseStore.from_dicts(synset2avg_embedding, meaning_freqs).save(args.output_path + '.store')
+
+    if args.instances == 'pickle':
+        remove_instances(instances_path) # or load_instances() would read them
+        with open(instances_path, 'wb') as outfile:
+            pickle.dump(synset2context_embds, outfile)
+
+    with open(args.output_path + '.freq', 'wb') as outfile:
+        pickle.dump(meaning_freqs, outfile)
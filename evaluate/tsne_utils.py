@@ -8,6 +8,8 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.manifold import TSNE
 from sklearn.decomposition import PCA
+from embedding_accumulator import load_instances
+from sense_store import load_sense_store
 
 
 def load_id_2meta_info(df):
@@ -76,11 +78,11 @@ def create_tsne_visualizations(output_folder,
 
     # load sense embeddings
     sense_embeddings_path = os.path.join(output_folder, 'meaning_embeddings.bin')
-    sense_embeddings = pandas.read_pickle(sense_embeddings_path)
+    sense_embeddings = load_sense_store(sense_embeddings_path)
 
     # load sense instances embeddings
     sense_instances_path = os.path.join(output_folder, 'meaning_embeddings.bin.instances')
-    sense_instance_embeddings = pandas.read_pickle(sense_instances_path)
+    sense_instance_embeddings = load_instances(sense_instances_path)
 
 
     # loop over all identifiers
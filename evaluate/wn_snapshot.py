@@ -0,0 +1,476 @@
+'''
+Compiled snapshot of WordNet that loads in milliseconds.
+
+NLTK's WordNetCorpusReader parses the index and exception files when it is
+created and reads the data files line by line, so scripts that construct it
+(or iterate wn.all_synsets()) spend tens of seconds before doing any work. A
+snapshot stores what the scripts of this repository need in a directory of
+.npy files that are memory-mapped:
+
+    meta.json                           WordNet version and sizes
+    exceptions.json                     the morphological exception lists
+    synset_keys, synset_order           (offset, data file) of each synset, sorted
+    synset_offsets, synset_pos          offset and pos of each synset
+    synset_name_blob/_offsets           synset names, e.g. dog.n.01
+    lemma_offsets                       the lemmas of each synset
+    lemma_name_blob/_offsets            lemma names
+    lemma_key_blob/_offsets             lemma sense keys
+    hypernym_offsets, hypernyms         hypernyms of each synset (rows)
+    instance_hypernym_offsets, ...      instance hypernyms of each synset (rows)
+    entry_blob/_offsets                 the lemma index: 'form<TAB>pos'
+    entry_table                         open addressing hash table: slot -> entry
+    entry_synset_offsets, entry_synsets synsets of each entry, in WordNet order
+
+WordNetSnapshot answers the calls that the scripts make on a WordNet reader
+(synsets with morphy, all_synsets, all_lemma_names,
+_synset_from_pos_and_offset) and its synsets support the Synset methods they
+use (offset, pos, name, lemmas, hypernyms, hypernym_paths,
+lowest_common_hypernyms, shortest_path_distance, ...) with the same results
+as NLTK 3.2, the version this code was written with (newer versions changed
+morphy and no longer sort the related synsets).
+
+Create the snapshots once with:
+
+python3 wn_snapshot.py -w 30
+python3 wn_snapshot.py -w 171
+
+load_wordnet(wn_version) then returns the snapshot, or the NLTK reader if
+there is none.
+'''
+import os
+import json
+import zlib
+import argparse
+from collections import deque
+import numpy as np
+
+
+POS_LIST = ['n', 'v', 'a', 'r']
+
+# the data file of each pos ('s' synsets are in the adjective file)
+FILE_POS = {'n': 'n', 'v': 'v', 'a': 'a', 's': 'a', 'r': 'r'}
+FILE_POS_CODE = {'n': 0, 'v': 1, 'a': 2, 'r': 3}
+
+# same as nltk.corpus.reader.wordnet.WordNetCorpusReader.MORPHOLOGICAL_SUBSTITUTIONS
+MORPHOLOGICAL_SUBSTITUTIONS = {
+    'n': [('s', ''), ('ses', 's'), ('ves', 'f'), ('xes', 'x'), ('zes', 'z'),
+          ('ches', 'ch'), ('shes', 'sh'), ('men', 'man'), ('ies', 'y')],
+    'v': [('s', ''), ('ies', 'y'), ('es', 'e'), ('es', ''), ('ed', 'e'),
+          ('ed', ''), ('ing', 'e'), ('ing', '')],
+    'a': [('er', ''), ('est', ''), ('er', 'e'), ('est', 'e')],
+    'r': []}
+MORPHOLOGICAL_SUBSTITUTIONS['s'] = MORPHOLOGICAL_SUBSTITUTIONS['a']
+
+
+def default_snapshot_path(wn_version):
+    cwd = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(cwd, 'resources', 'wordnet-%s.snapshot' %wn_version)
+
+
+def load_nltk_wordnet(wn_version):
+    ''' The NLTK reader of WordNet 3.0 or of the 1.7.1 copy in resources '''
+    if wn_version == '171':
+        from nltk.corpus.reader.wordnet import WordNetCorpusReader
+        cwd = os.path.dirname(os.path.realpath(__file__))
+        path_to_wn_dict_folder = os.path.join(cwd, 'resources', 'wordnet_171', 'WordNet-1.7.1', 'dict')
+        return WordNetCorpusReader(path_to_wn_dict_folder, None)
+    from nltk.corpus import wordnet
+    return wordnet
+
+
+def load_wordnet(wn_version):
+    ''' The snapshot of wn_version if it has been created, otherwise the NLTK reader '''
+    snapshot_dir = default_snapshot_path(wn_version)
+    if os.path.isdir(snapshot_dir):
+        return WordNetSnapshot(snapshot_dir)
+    return load_nltk_wordnet(wn_version)
+
+
+def _pack_strings(strings):
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in encoded])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def _unpack_string(blob, offsets, i):
+    return blob[offsets[i]:offsets[i+1]].tobytes().decode('utf-8')
+
+
+def _pack_lists(lists):
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(values) for values in lists])
+    values = np.array([value for values in lists for value in values], dtype=np.int32)
+    return values, offsets
+
+
+def _hash(key):
+    return zlib.crc32(key.encode('utf-8'))
+
+
+class SnapshotLemma(object):
+
+    def __init__(self, synset, name, key):
+        self._synset = synset
+        self._name = name
+        self._key = key
+
+    def name(self):
+        return self._name
+
+    def key(self):
+        return self._key
+
+    def synset(self):
+        return self._synset
+
+    def __repr__(self):
+        return "Lemma('%s.%s')" %(self._synset.name(), self._name)
+
+
+class SnapshotSynset(object):
+    '''
+    A synset of a WordNetSnapshot. Synsets compare and hash by name like
+    NLTK's; row None is the root that simulate_root adds.
+    '''
+
+    def __init__(self, snapshot, row, name):
+        self._snapshot = snapshot
+        self._row = row
+        self._name = name
+        self._max_depth = None
+        self._min_depth = None
+        self._all_hypernyms = None
+
+    def offset(self):
+        return int(self._snapshot.synset_offsets[self._row])
+
+    def pos(self):
+        return self._snapshot.synset_pos[self._row].decode('ascii')
+
+    def name(self):
+        return self._name
+
+    def lemmas(self):
+        snapshot = self._snapshot
+        return [SnapshotLemma(self,
+                              _unpack_string(snapshot.lemma_name_blob, snapshot.lemma_name_offsets, i),
+                              _unpack_string(snapshot.lemma_key_blob, snapshot.lemma_key_offsets, i))
+                for i in range(snapshot.lemma_offsets[self._row], snapshot.lemma_offsets[self._row+1])]
+
+    def lemma_names(self):
+        return [lemma.name() for lemma in self.lemmas()]
+
+    def hypernyms(self):
+        if self._row is None: return []
+        return self._snapshot._related(self._snapshot.hypernyms, self._snapshot.hypernym_offsets,
+                                       self._row)
+
+    def instance_hypernyms(self):
+        if self._row is None: return []
+        return self._snapshot._related(self._snapshot.instance_hypernyms,
+                                       self._snapshot.instance_hypernym_offsets, self._row)
+
+    def _all_direct_hypernyms(self):
+        return self.hypernyms() + self.instance_hypernyms()
+
+    def hypernym_paths(self):
+        paths = []
+        hypernyms = self._all_direct_hypernyms()
+        if len(hypernyms) == 0:
+            paths = [[self]]
+        for hypernym in hypernyms:
+            for ancestor_list in hypernym.hypernym_paths():
+                ancestor_list.append(self)
+                paths.append(ancestor_list)
+        return paths
+
+    def max_depth(self):
+        if self._max_depth is None:
+            hypernyms = self._all_direct_hypernyms()
+            self._max_depth = 1 + max(h.max_depth() for h in hypernyms) if hypernyms else 0
+        return self._max_depth
+
+    def min_depth(self):
+        if self._min_depth is None:
+            hypernyms = self._all_direct_hypernyms()
+            self._min_depth = 1 + min(h.min_depth() for h in hypernyms) if hypernyms else 0
+        return self._min_depth
+
+    def common_hypernyms(self, other):
+        for synset in (self, other):
+            if synset._all_hypernyms is None:
+                ancestors = set()
+                todo = [synset]
+                while todo:
+                    ancestors.update(todo)
+                    todo = [hypernym for s in todo for hypernym in s._all_direct_hypernyms()
+                            if hypernym not in ancestors]
+                synset._all_hypernyms = ancestors
+        return list(self._all_hypernyms.intersection(other._all_hypernyms))
+
+    def lowest_common_hypernyms(self, other, simulate_root=False, use_min_depth=False):
+        synsets = self.common_hypernyms(other)
+        if simulate_root:
+            synsets.append(self._snapshot.root)
+        if not synsets:
+            return []
+        depth = SnapshotSynset.min_depth if use_min_depth else SnapshotSynset.max_depth
+        max_depth = max(depth(s) for s in synsets)
+        return sorted(s for s in synsets if depth(s) == max_depth)
+
+    def _shortest_hypernym_paths(self, simulate_root):
+        if self._row is None:
+            return {self: 0}
+        queue = deque([(self, 0)])
+        path = {}
+        while queue:
+            synset, depth = queue.popleft()
+            if synset in path:
+                continue
+            path[synset] = depth
+            depth += 1
+            queue.extend((hypernym, depth) for hypernym in synset.hypernyms())
+            queue.extend((hypernym, depth) for hypernym in synset.instance_hypernyms())
+        if simulate_root:
+            path[self._snapshot.root] = max(path.values()) + 1
+        return path
+
+    def shortest_path_distance(self, other, simulate_root=False):
+        if self == other:
+            return 0
+        dist_dict1 = self._shortest_hypernym_paths(simulate_root)
+        dist_dict2 = other._shortest_hypernym_paths(simulate_root)
+        path_distance = float('inf')
+        for synset, d1 in dist_dict1.items():
+            path_distance = min(path_distance, d1 + dist_dict2.get(synset, float('inf')))
+        return None if path_distance == float('inf') else path_distance
+
+    def __eq__(self, other):
+        return self._name == getattr(other, '_name', None)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self._name < other._name
+
+    def __hash__(self):
+        return hash(self._name)
+
+    def __repr__(self):
+        return "Synset('%s')" %self._name
+
+
+class WordNetSnapshot(object):
+    ''' snapshot_dir: directory written by build_snapshot() '''
+
+    def __init__(self, snapshot_dir, mmap_mode='r'):
+        with open(os.path.join(snapshot_dir, 'meta.json')) as infile:
+            self.meta = json.load(infile)
+        self.wn_version = self.meta['wn_version']
+        with open(os.path.join(snapshot_dir, 'exceptions.json')) as infile:
+            self.exceptions = json.load(infile)
+        self.exceptions['s'] = self.exceptions['a']
+        load = lambda name: np.load(os.path.join(snapshot_dir, name + '.npy'), mmap_mode=mmap_mode)
+        for name in ['synset_keys', 'synset_order', 'synset_offsets', 'synset_pos',
+                     'synset_name_blob', 'synset_name_offsets',
+                     'lemma_offsets', 'lemma_name_blob', 'lemma_name_offsets',
+                     'lemma_key_blob', 'lemma_key_offsets',
+                     'hypernyms', 'hypernym_offsets',
+                     'instance_hypernyms', 'instance_hypernym_offsets',
+                     'entry_blob', 'entry_offsets', 'entry_table',
+                     'entry_synsets', 'entry_synset_offsets']:
+            setattr(self, name, load(name))
+        self._synsets = dict()
+        self.root = SnapshotSynset(self, None, '*ROOT*')
+
+    def _synset(self, row):
+        synset = self._synsets.get(row)
+        if synset is None:
+            name = _unpack_string(self.synset_name_blob, self.synset_name_offsets, row)
+            synset = self._synsets[row] = SnapshotSynset(self, row, name)
+        return synset
+
+    def _related(self, rows, offsets, row):
+        return [self._synset(int(related)) for related in rows[offsets[row]:offsets[row+1]]]
+
+    def _entry(self, form, pos):
+        ''' Row of the lemma index entry of (form, pos), -1 if there is none '''
+        key = '%s\t%s' %(form, pos)
+        mask = len(self.entry_table) - 1
+        slot = _hash(key) & mask
+        while True:
+            entry = self.entry_table[slot]
+            if entry < 0 or _unpack_string(self.entry_blob, self.entry_offsets, entry) == key:
+                return int(entry)
+            slot = (slot + 1) & mask
+
+    def _morphy(self, form, pos, check_exceptions=True):
+        ''' Same as WordNetCorpusReader._morphy of NLTK 3.2 '''
+        exceptions = self.exceptions[pos]
+        substitutions = MORPHOLOGICAL_SUBSTITUTIONS[pos]
+
+        def apply_rules(forms):
+            return [form[:-len(old)] + new
+                    for form in forms
+                    for old, new in substitutions
+                    if form.endswith(old)]
+
+        def filter_forms(forms):
+            result = []
+            seen = set()
+            for form in forms:
+                if form not in seen and self._entry(form, pos) >= 0:
+                    result.append(form)
+                    seen.add(form)
+            return result
+
+        if check_exceptions and form in exceptions:
+            return filter_forms([form] + exceptions[form])
+
+        forms = apply_rules([form])
+        results = filter_forms([form] + forms)
+        if results:
+            return results
+
+        while forms:
+            forms = apply_rules(forms)
+            results = filter_forms(forms)
+            if results:
+                return results
+        return []
+
+    def morphy(self, form, pos=None, check_exceptions=True):
+        if pos is None:
+            analyses = [analysis for p in POS_LIST for analysis in self._morphy(form, p, check_exceptions)]
+        else:
+            analyses = self._morphy(form, pos, check_exceptions)
+        return analyses[0] if analyses else None
+
+    def synsets(self, lemma, pos=None, check_exceptions=True):
+        ''' Same as WordNetCorpusReader.synsets '''
+        lemma = lemma.lower()
+        pos_tags = POS_LIST if pos is None else [pos]
+        synsets = []
+        for p in pos_tags:
+            for form in self._morphy(lemma, p, check_exceptions):
+                entry = self._entry(form, p)
+                synsets.extend(self._related(self.entry_synsets, self.entry_synset_offsets, entry))
+        return synsets
+
+    def synset_from_pos_and_offset(self, pos, offset):
+        key = offset * 4 + FILE_POS_CODE[FILE_POS[pos]]
+        i = np.searchsorted(self.synset_keys, key)
+        if i == len(self.synset_keys) or self.synset_keys[i] != key:
+            raise ValueError('no WordNet synset with pos %s and offset %s' %(pos, offset))
+        return self._synset(int(self.synset_order[i]))
+
+    _synset_from_pos_and_offset = synset_from_pos_and_offset
+
+    def all_synsets(self, pos=None):
+        ''' In the order of WordNetCorpusReader.all_synsets '''
+        for row in range(len(self.synset_offsets)):
+            synset_pos = self.synset_pos[row].decode('ascii')
+            if pos is None or synset_pos == pos or (pos == 'a' and synset_pos == 's'):
+                yield self._synset(row)
+
+    def all_lemma_names(self, pos=None):
+        seen = set()
+        for entry in range(len(self.entry_offsets) - 1):
+            form, form_pos = _unpack_string(self.entry_blob, self.entry_offsets, entry).split('\t')
+            if pos is None:
+                if form not in seen:
+                    seen.add(form)
+                    yield form
+            elif form_pos == pos:
+                yield form
+
+    def get_version(self):
+        return self.meta['version']
+
+
+def build_snapshot(wn, wn_version, snapshot_dir):
+    '''
+    Write the snapshot of the NLTK WordNet reader wn to snapshot_dir
+    '''
+    synsets = list(wn.all_synsets())
+    file_keys = [synset.offset() * 4 + FILE_POS_CODE[FILE_POS[synset.pos()]] for synset in synsets]
+    row_of_key = dict((key, row) for row, key in enumerate(file_keys))
+    row_of = lambda synset: row_of_key[synset.offset() * 4 + FILE_POS_CODE[FILE_POS[synset.pos()]]]
+
+    lemma_names = []
+    lemma_keys = []
+    lemma_offsets = [0]
+    for synset in synsets:
+        for lemma in synset.lemmas():
+            lemma_names.append(lemma.name())
+            lemma_keys.append(lemma.key())
+        lemma_offsets.append(len(lemma_names))
+
+    # the lemma index, in the order of _lemma_pos_offset_map
+    entry_keys = []
+    entry_synsets = []
+    for form, pos2offsets in wn._lemma_pos_offset_map.items():
+        for pos, offsets in pos2offsets.items():
+            entry_keys.append('%s\t%s' %(form, pos))
+            entry_synsets.append([row_of_key[offset * 4 + FILE_POS_CODE[FILE_POS[pos]]]
+                                  for offset in offsets])
+
+    # open addressing with linear probing, at most half full
+    entry_table = np.full(1 << max(1, (2 * len(entry_keys) - 1).bit_length()), -1, dtype=np.int32)
+    mask = len(entry_table) - 1
+    for entry, key in enumerate(entry_keys):
+        slot = _hash(key) & mask
+        while entry_table[slot] >= 0:
+            slot = (slot + 1) & mask
+        entry_table[slot] = entry
+
+    exceptions = dict((pos, wn._exception_map[pos]) for pos in POS_LIST)
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    save = lambda name, array: np.save(os.path.join(snapshot_dir, name + '.npy'), array)
+    save_strings = lambda name, strings: [save(name + suffix, array)
+                                          for suffix, array in zip(['_blob', '_offsets'],
+                                                                   _pack_strings(strings))]
+    save_lists = lambda name, offsets_name, lists: [save(name_, array)
+                                                    for name_, array in zip([name, offsets_name],
+                                                                            _pack_lists(lists))]
+    file_keys = np.array(file_keys, dtype=np.int64)
+    order = np.argsort(file_keys, kind='stable')
+    save('synset_keys', file_keys[order])
+    save('synset_order', order.astype(np.int32))
+    save('synset_offsets', np.array([synset.offset() for synset in synsets], dtype=np.int64))
+    save('synset_pos', np.array([synset.pos() for synset in synsets], dtype=np.bytes_))
+    save_strings('synset_name', [synset.name() for synset in synsets])
+    save('lemma_offsets', np.array(lemma_offsets, dtype=np.int64))
+    save_strings('lemma_name', lemma_names)
+    save_strings('lemma_key', lemma_keys)
+    # sorted like in NLTK 3.2 (newer versions return the pointers in set order)
+    save_lists('hypernyms', 'hypernym_offsets',
+               [[row_of(hypernym) for hypernym in sorted(synset.hypernyms())] for synset in synsets])
+    save_lists('instance_hypernyms', 'instance_hypernym_offsets',
+               [[row_of(hypernym) for hypernym in sorted(synset.instance_hypernyms())]
+                for synset in synsets])
+    save_strings('entry', entry_keys)
+    save('entry_table', entry_table)
+    save_lists('entry_synsets', 'entry_synset_offsets', entry_synsets)
+    with open(os.path.join(snapshot_dir, 'exceptions.json'), 'w') as outfile:
+        json.dump(exceptions, outfile)
+    with open(os.path.join(snapshot_dir, 'meta.json'), 'w') as outfile:
+        json.dump({'wn_version': wn_version,
+                   'version': wn.get_version(),
+                   'num_synsets': len(synsets),
+                   'num_entries': len(entry_keys)}, outfile)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile a WordNet snapshot')
+    parser.add_argument('-w', dest='wn_version', default='30', help='30 | 171')
+    parser.add_argument('-o', dest='output_dir', help='default: resources/wordnet-<wn_version>.snapshot')
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or default_snapshot_path(args.wn_version)
+    build_snapshot(load_nltk_wordnet(args.wn_version), args.wn_version, output_dir)
+    print('Written %s' %output_dir)
@@ -0,0 +1,284 @@
+'''
+Local WSD server: load the LSTM, the vocabulary, WordNet and the sense
+embeddings once and disambiguate words on request.
+
+Concurrent requests are merged into micro-batches: the first request waits at
+most --max_latency_ms for others to arrive (or until --max_batch_size requests
+are queued) and the whole batch goes through one ContextEncoder call, which
+sorts the sentences by length so that batches are padded as little as possible.
+Scoring is done by perform_wsd.score_synsets_batch().
+
+python3 wsd_server.py -m resources/model-h2048p512/lstm-wsd-gigaword-google \
+        -v resources/model-h2048p512/gigaword-lstm-wsd.index.pkl \
+        -s output/meaning_embeddings.bin -p 8000
+
+curl -d '{"sentence": "he sat on the bank of the river", "target_index": 4, \
+          "lemma": "bank", "pos": "n"}' localhost:8000/disambiguate
+curl localhost:8000/metrics
+
+The body of /disambiguate can also be a list of such objects, sentence can be
+a list of tokens. pos is one of n, v, a, s, r or missing (all of them). A
+request that fails gets {"error": ...} and the reply then has status 500, the
+other requests of its batch are not affected. Only the synset granularity is
+supported because the other ones need a mapping to higher levels that is only
+available for the competition dataframes.
+'''
+import os
+import sys
+import json
+import argparse
+import threading
+import queue
+from collections import deque
+from time import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn, UnixStreamServer
+import numpy as np
+from context_encoder import open_encoder
+from perform_wsd import synset2identifier, score_synsets_batch
+from sense_store import load_sense_store
+from wn_snapshot import load_wordnet
+
+# the parts of speech of WordNet, None: all of them
+POS_TAGS = (None, 'n', 'v', 'a', 's', 'r')
+
+
+class WSDRequest(object):
+
+    def __init__(self, sentence_tokens, target_index, lemma, pos):
+        self.sentence_tokens = sentence_tokens
+        self.target_index = target_index
+        self.lemma = lemma
+        self.pos = pos
+        self.arrival_sec = time()
+        self.done = threading.Event()
+        self.result = None
+
+
+class MicroBatcher(object):
+    '''
+    Collect requests from the handler threads and disambiguate them in
+    batches in a single worker thread (which owns the encoder).
+
+    encoder: a ContextEncoder
+    wn: the WordNet corpus reader of wn_version
+    sense_embeddings: a sense_store.SenseStore, meaning_freqs: its frequencies
+    '''
+
+    def __init__(self, encoder, wn, wn_version, sense_embeddings, meaning_freqs,
+                 mfs_fallback=True, max_batch_size=64, max_latency_ms=5,
+                 num_latencies=10000):
+        self.encoder = encoder
+        self.wn = wn
+        self.wn_version = wn_version
+        self.sense_embeddings = sense_embeddings
+        self.meaning_freqs = meaning_freqs
+        self.mfs_fallback = mfs_fallback
+        self.max_batch_size = max_batch_size
+        self.max_latency_sec = max_latency_ms / 1000.0
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=num_latencies)
+        self.batch_sizes = deque(maxlen=num_latencies)
+        self.num_requests = 0
+        self.num_batches = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, requests):
+        ''' Called from the handler threads, blocks until all requests are done '''
+        # queue all before waiting so that they can end up in the same batch
+        for request in requests:
+            self.queue.put(request)
+        for request in requests:
+            request.done.wait()
+        return [request.result for request in requests]
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = batch[0].arrival_sec + self.max_latency_sec
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time()
+            if timeout <= 0: break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                embeddings = self.encoder.encode((r.sentence_tokens, r.target_index)
+                                                 for r in batch)
+                for request, result in zip(batch, self._score(batch, embeddings)):
+                    request.result = result
+            except Exception as e:
+                sys.stderr.write('Failed to process batch: %s\n' %e)
+                for request in batch:
+                    request.result = {'error': str(e)}
+            end_sec = time()
+            with self.lock:
+                self.num_batches += 1
+                self.num_requests += len(batch)
+                self.batch_sizes.append(len(batch))
+                self.latencies.extend(end_sec-r.arrival_sec for r in batch)
+            for request in batch:
+                request.done.set()
+
+    def _candidates(self, request):
+        return [synset2identifier(synset, self.wn_version)
+                for synset in self.wn.synsets(request.lemma, request.pos)]
+
+    def _score(self, batch, target_embeddings):
+        # a request whose candidates cannot be looked up fails on its own
+        candidate_lists, errors = [], {}
+        for i, request in enumerate(batch):
+            try:
+                candidate_lists.append(self._candidates(request))
+            except Exception as e:
+                sys.stderr.write('Failed to look up the candidates of %r: %s\n' %(request.lemma, e))
+                candidate_lists.append([])
+                errors[i] = str(e)
+        polysemous = [i for i, candidates in enumerate(candidate_lists) if len(candidates) >= 2]
+        scores = []
+        outputs = score_synsets_batch(target_embeddings[polysemous],
+                                      [candidate_lists[i] for i in polysemous],
+                                      self.sense_embeddings, 'synset', [{}] * len(polysemous),
+                                      self.meaning_freqs, self.mfs_fallback, scores=scores)
+        outputs = dict(zip(polysemous, zip(outputs, scores)))
+        results = []
+        for i, candidates in enumerate(candidate_lists):
+            instance_scores = {}
+            if i in errors:
+                results.append({'error': errors[i]})
+                continue
+            if i in outputs:
+                (chosen_synset, _, _, strategy), instance_scores = outputs[i]
+            elif candidates:
+                chosen_synset, strategy = candidates[0], 'monosemous'
+            else:
+                chosen_synset, strategy = None, 'no_candidates'
+            results.append({'synset': chosen_synset,
+                            'strategy': strategy,
+                            'scores': dict((synset, float(sim))
+                                           for synset, sim in instance_scores.items())})
+        return results
+
+    def metrics(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            batch_sizes = np.array(self.batch_sizes)
+            metrics = {'num_requests': self.num_requests,
+                       'num_batches': self.num_batches}
+        if len(latencies):
+            metrics['latency_p50_ms'] = float(np.percentile(latencies, 50))
+            metrics['latency_p99_ms'] = float(np.percentile(latencies, 99))
+            metrics['mean_batch_size'] = float(batch_sizes.mean())
+            metrics['batch_fill'] = float(batch_sizes.mean() / self.max_batch_size)
+        return metrics
+
+
+class WSDRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/metrics':
+            self._reply(200, self.server.batcher.metrics())
+        else:
+            self._reply(404, {'error': 'unknown path %s' %self.path})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/disambiguate':
+            return self._reply(404, {'error': 'unknown path %s' %self.path})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length).decode('utf-8'))
+            is_list = isinstance(body, list)
+            requests = [self._parse(obj) for obj in (body if is_list else [body])]
+        except (ValueError, KeyError, TypeError) as e:
+            return self._reply(400, {'error': 'bad request: %s' %e})
+        results = self.server.batcher.submit(requests)
+        status = 500 if any('error' in result for result in results) else 200
+        self._reply(status, results if is_list else results[0])
+
+    def _parse(self, obj):
+        sentence_tokens = obj['sentence']
+        if isinstance(sentence_tokens, str):
+            sentence_tokens = sentence_tokens.split()
+        target_index = int(obj['target_index'])
+        if not 0 <= target_index < len(sentence_tokens):
+            raise ValueError('target_index out of range')
+        pos = obj.get('pos')
+        if pos not in POS_TAGS:
+            raise ValueError('unknown pos %r, expected one of n, v, a, s, r' %(pos,))
+        return WSDRequest(sentence_tokens, target_index, obj['lemma'], pos)
+
+    def _reply(self, status, obj):
+        data = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # client_address is an empty string for Unix sockets
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve WSD requests over HTTP')
+    parser.add_argument('-m', dest='model_path', required=True, help='path to model trained LSTM model')
+    parser.add_argument('-v', dest='vocab_path', required=True, help='path to LSTM vocabulary')
+    parser.add_argument('-s', dest='sense_embeddings_path', required=True, help='path where sense embeddings are stored (synset granularity)')
+    parser.add_argument('-w', dest='wn_version', default='30', help='30 | 171')
+    parser.add_argument('-f', dest='mfs_fallback', default='True', help='True or False')
+    parser.add_argument('-e', dest='encoder', default='tensorflow', help='tensorflow | numpy (requires export-inference-model.py)')
+    parser.add_argument('-p', dest='port', type=int, default=8000, help='port to listen on')
+    parser.add_argument('--host', default='localhost', help='host to listen on')
+    parser.add_argument('--socket', help='listen on this Unix socket instead of a TCP port')
+    parser.add_argument('--max_batch_size', type=int, default=64, help='maximum number of requests in a batch')
+    parser.add_argument('--max_latency_ms', type=int, default=5, help='how long a request waits for others to fill the batch')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    wn = load_wordnet(args.wn_version)
+
+    sense_embeddings = load_sense_store(args.sense_embeddings_path)
+    meaning_freqs = sense_embeddings.meaning_freqs
+    vocab = np.load(args.vocab_path)
+
+    with open_encoder(args.model_path, vocab, args.encoder,
+                      max_batch_size=args.max_batch_size) as encoder:
+        batcher = MicroBatcher(encoder, wn, args.wn_version, sense_embeddings, meaning_freqs,
+                               mfs_fallback=args.mfs_fallback == 'True',
+                               max_batch_size=args.max_batch_size,
+                               max_latency_ms=args.max_latency_ms)
+        if args.socket:
+            if os.path.exists(args.socket): os.remove(args.socket)
+            server = ThreadingUnixHTTPServer(args.socket, WSDRequestHandler)
+            print('Listening on %s' %args.socket)
+        else:
+            server = ThreadingHTTPServer((args.host, args.port), WSDRequestHandler)
+            print('Listening on http://%s:%d' %(args.host, args.port))
+        server.batcher = batcher
+        server.verbose = args.verbose
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
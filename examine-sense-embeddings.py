@@ -1,7 +1,7 @@
 from gensim.models import Word2Vec
 import sys
 import re
-from nltk.corpus import wordnet as wn
+from evaluate.wn_snapshot import load_wordnet
 
 def examine_synset(s):
     m = re.search(r'^(?:eng-30-)?(\d+)-(\w)', s)
@@ -19,6 +19,7 @@ def examine_synset(s):
     print()
 
 if __name__ == '__main__':
+    wn = load_wordnet('30')
     data_path = sys.argv[1]
     sys.stdout.write('Loading from %s... ' %data_path)
     sys.stdout.flush()
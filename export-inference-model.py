@@ -0,0 +1,85 @@
+"""
+Export the inference part of a trained LSTM model.
+
+The checkpoints written by train-lstm-wsd.py contain the whole training graph:
+the output layer (context_embedding), the optimizer and the Adagrad
+accumulators. Evaluation only needs x, lens -> predicted_context_embs, so
+this script builds just that subgraph, restores its variables from the full
+checkpoint and saves it as <model_path>-inference (.meta, .index, .data-*).
+tensor_utils.load_model() in evaluate/ picks it up automatically.
+
+The same weights are also dumped as .npy files into <output_path>.numpy/ for
+the TensorFlow-free encoder in evaluate/numpy_lstm.py.
+
+The weights are kept in a checkpoint rather than frozen into graph constants
+because the embedding table of the big models doesn't fit in a 2GB protobuf.
+
+Usage: python3 export-inference-model.py --model_path=output/.../lstm-wsd-gigaword-google
+"""
+import os
+import sys
+from time import time
+
+import numpy as np
+import tensorflow as tf
+from model import WSDInferenceModel
+from configs import DefaultConfig
+
+flags = tf.flags
+
+flags.DEFINE_string("model_path", None,
+                    "Path of the trained model (without .meta).")
+flags.DEFINE_string("output_path", '',
+                    "Where to save the inference model, default: <model_path>-inference")
+FLAGS = flags.FLAGS
+
+
+def export_inference_model(model_path, output_path):
+    start_sec = time()
+    # read the sizes off the checkpoint so that any config (and vocabulary) works
+    reader = tf.train.NewCheckpointReader(model_path)
+    shapes = reader.get_variable_to_shape_map()
+    config = DefaultConfig()
+    config.vocab_size, config.emb_dims = shapes['Model/word_embedding']
+    config.hidden_size = shapes['Model/context_layer_weights'][0]
+    with tf.Graph().as_default():
+        with tf.variable_scope("Model"):
+            WSDInferenceModel(config)
+        saver = tf.train.Saver() # only the variables of the inference graph
+        with tf.Session() as sess:
+            saver.restore(sess, model_path)
+            saver.save(sess, output_path)
+    sys.stderr.write('Exported inference model to %s (%.0f sec)\n' 
+                     %(output_path, time()-start_sec))
+
+
+def export_numpy_weights(model_path, output_dir):
+    ''' Dump the weights needed by evaluate/numpy_lstm.py as .npy files 
+    (that can be memory-mapped). '''
+    reader = tf.train.NewCheckpointReader(model_path)
+    names = reader.get_variable_to_shape_map()
+    # LSTMCell variables are called kernel/bias or weights/biases depending
+    # on the version of TensorFlow
+    lstm_kernel, = [n for n in names if 'lstm_cell' in n and 
+                    n.split('/')[-1] in ('kernel', 'weights')]
+    lstm_bias, = [n for n in names if 'lstm_cell' in n and 
+                  n.split('/')[-1] in ('bias', 'biases')]
+    os.makedirs(output_dir, exist_ok=True)
+    for var_name, file_name in (('Model/word_embedding', 'word_embedding'),
+                                (lstm_kernel, 'kernel'), (lstm_bias, 'bias'),
+                                ('Model/context_layer_weights', 'context_layer_weights')):
+        np.save(os.path.join(output_dir, file_name + '.npy'), reader.get_tensor(var_name))
+    # default of tf.contrib.rnn.LSTMCell, which is what WSDModel uses
+    np.save(os.path.join(output_dir, 'forget_bias.npy'), np.float32(1.0))
+    sys.stderr.write('Exported NumPy weights to %s\n' %output_dir)
+
+
+def main(_):
+    if not FLAGS.model_path:
+        raise ValueError("Must set --model_path")
+    output_path = FLAGS.output_path or FLAGS.model_path + '-inference'
+    export_inference_model(FLAGS.model_path, output_path)
+    export_numpy_weights(output_path, output_path + '.numpy')
+
+if __name__ == "__main__":
+    tf.app.run()
@@ -0,0 +1,188 @@
+'''
+Binary HDN training set: preprocess_hdn.py writes it, WSIModel (model.py)
+reads it without any parsing.
+
+An example is a sentence in which a monosemous noun is replaced by <target>,
+the HDN (hypernym of the noun) to predict and the list of candidate HDNs.
+The sentences are grouped into padded batches of roughly batch_size tokens,
+in the format of prepare-lstm-wsd.py (<pad> after the sentence, <eos> at
+its end). For a path P:
+
+- P.tokens: the token matrices (int32) of all batches, one after another
+- P.examples: one row (int32) per example: length, position of <target>,
+  HDN id and candidate list id
+- P.index: pickled meta data: the shape of each batch, the HDNs and the
+  candidate table (the HDN ids of each candidate list)
+
+Both .tokens and .examples are memory-mapped, a batch is only read when it
+is used.
+'''
+import os
+import pickle
+import shutil
+import numpy as np
+from collections.abc import Sequence
+from tensor_utils import pad
+
+
+class HDNBatchWriter(object):
+    '''
+    path: see the module documentation
+    word2id: vocabulary of prepare-lstm-wsd.py (<fname>.index.pkl)
+    hdns, hdn_lists: all HDNs and HDN lists, their positions are their ids
+    batch_size: maximum number of tokens in a batch
+    window_size: number of tokens that are sorted by length before they are
+    divided into batches (sorting reduces the padding)
+    '''
+
+    def __init__(self, path, word2id, hdns, hdn_lists,
+                 batch_size=60000, window_size=6000000):
+        self.path = path
+        self.word2id = word2id
+        self.batch_size = batch_size
+        self.window_size = window_size
+        self.unkn_id = word2id['<unkn>']
+        self.pad_id = word2id['<pad>']
+        self.eos_id = word2id.get('<eos>')
+        self.target_id = word2id['<target>']
+        self.hdns = hdns
+        self.hdn_lists = hdn_lists
+        self.batch_shapes = []
+        self.num_examples = 0
+        self.window = []
+        self.window_tokens = 0
+        self.tokens_file = open(path + '.tokens', 'wb')
+        self.examples_file = open(path + '.examples', 'wb')
+
+    def lookup(self, words):
+        return [self.word2id.get(word, self.unkn_id) for word in words]
+
+    def add(self, hdn_id, hdn_list_id, token_ids, position):
+        ''' token_ids: the sentence, the token at position is replaced by <target> '''
+        token_ids = list(token_ids)
+        token_ids[position] = self.target_id
+        self.window.append((token_ids, position, hdn_id, hdn_list_id))
+        self.window_tokens += len(token_ids)
+        if self.window_tokens >= self.window_size:
+            self._flush()
+
+    def _write_batch(self, batch):
+        sents = [example[0] for example in batch]
+        x = pad(sents, max(len(s) for s in sents), self.pad_id, self.eos_id)
+        x.tofile(self.tokens_file)
+        examples = np.array([(len(s), position, hdn_id, hdn_list_id)
+                             for s, position, hdn_id, hdn_list_id in batch], dtype=np.int32)
+        examples.tofile(self.examples_file)
+        self.batch_shapes.append(x.shape)
+        self.num_examples += len(batch)
+
+    def _flush(self):
+        # like pad_batches() of prepare-lstm-wsd.py, on the sorted window
+        self.window.sort(key=lambda example: len(example[0]))
+        batch = []
+        max_len = 0
+        for example in self.window:
+            new_size = (len(batch)+1) * max(max_len, len(example[0]))
+            if batch and new_size > self.batch_size:
+                self._write_batch(batch)
+                batch = []
+                max_len = 0
+            max_len = max(max_len, len(example[0]))
+            batch.append(example)
+        if batch:
+            self._write_batch(batch)
+        self.window = []
+        self.window_tokens = 0
+
+    def append_file(self, path):
+        ''' Append the batches written by another (closed) HDNBatchWriter '''
+        self._flush()
+        with open(path + '.index', 'rb') as infile:
+            meta = pickle.load(infile)
+        assert meta['hdns'] == self.hdns and meta['hdn_lists'] == self.hdn_lists
+        for suffix, outfile in (('.tokens', self.tokens_file), ('.examples', self.examples_file)):
+            with open(path + suffix, 'rb') as infile:
+                shutil.copyfileobj(infile, outfile)
+        self.batch_shapes.extend(tuple(shape) for shape in meta['batch_shapes'])
+        self.num_examples += meta['num_examples']
+
+    def close(self):
+        self._flush()
+        self.tokens_file.close()
+        self.examples_file.close()
+        hdn2id = dict((hdn, i) for i, hdn in enumerate(self.hdns))
+        candidate_offsets = np.zeros(len(self.hdn_lists) + 1, dtype=np.int64)
+        candidate_offsets[1:] = np.cumsum([len(hdn_list) for hdn_list in self.hdn_lists])
+        candidates = np.array([hdn2id[hdn] for hdn_list in self.hdn_lists for hdn in hdn_list],
+                              dtype=np.int32)
+        meta = {'batch_shapes': np.array(self.batch_shapes, dtype=np.int64).reshape(-1, 2),
+                'num_examples': self.num_examples,
+                'hdns': self.hdns,
+                'hdn_lists': self.hdn_lists,
+                'candidate_offsets': candidate_offsets,
+                'candidates': candidates}
+        with open(self.path + '.index', 'wb') as outfile:
+            pickle.dump(meta, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def remove_hdn_batches(path):
+    for suffix in ('.index', '.tokens', '.examples'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+class HDNBatches(Sequence):
+    '''
+    Read-only list of batches (x, lens, positions, hdn_ids, hdn_list_ids),
+    read on access. candidates() gives the HDN ids of a candidate list.
+    '''
+
+    def __init__(self, path, mmap_mode='r'):
+        with open(path + '.index', 'rb') as infile:
+            meta = pickle.load(infile)
+        self.hdns = meta['hdns']
+        self.hdn_lists = meta['hdn_lists']
+        self.candidate_offsets = meta['candidate_offsets']
+        self.candidate_table = meta['candidates']
+        self.batch_shapes = meta['batch_shapes']
+        sizes = self.batch_shapes[:,0] * self.batch_shapes[:,1]
+        self.token_offsets = np.concatenate([[0], np.cumsum(sizes)])
+        self.example_offsets = np.concatenate([[0], np.cumsum(self.batch_shapes[:,0])])
+        self.tokens = self.examples = None
+        if len(self.batch_shapes) > 0:
+            self.tokens = np.memmap(path + '.tokens', dtype=np.int32, mode=mmap_mode,
+                                    shape=(int(self.token_offsets[-1]),))
+            self.examples = np.memmap(path + '.examples', dtype=np.int32, mode=mmap_mode,
+                                      shape=(int(self.example_offsets[-1]), 4))
+
+    def __getitem__(self, i):
+        rows, cols = self.batch_shapes[i]
+        x = self.tokens[self.token_offsets[i]:self.token_offsets[i+1]].reshape(rows, cols)
+        examples = self.examples[self.example_offsets[i]:self.example_offsets[i+1]]
+        return x, examples[:,0], examples[:,1], examples[:,2], examples[:,3]
+
+    def __len__(self):
+        return len(self.batch_shapes)
+
+    def candidates(self, hdn_list_id):
+        return self.candidate_table[self.candidate_offsets[hdn_list_id]:
+                                    self.candidate_offsets[hdn_list_id+1]]
+
+    def candidate_matrix(self, hdn_list_ids, hdn_ids):
+        '''
+        The candidate lists of a batch, padded with 0
+        
+        :return: (candidates [batch, max_candidates], number of candidates of
+        each example, column of the HDN of each example)
+        '''
+        starts = self.candidate_offsets[hdn_list_ids]
+        num_candidates = (self.candidate_offsets[hdn_list_ids+1] - starts).astype(np.int32)
+        columns = np.arange(num_candidates.max() if len(num_candidates) else 0)
+        mask = columns[np.newaxis,:] < num_candidates[:,np.newaxis]
+        candidates = np.where(mask, self.candidate_table[np.where(mask, starts[:,np.newaxis] + columns, 0)], 0)
+        y = np.argmax(mask & (candidates == hdn_ids[:,np.newaxis]), axis=1).astype(np.int32)
+        return candidates.astype(np.int32), num_candidates, y
+
+
+def load_hdn_batches(path, mmap_mode='r'):
+    return HDNBatches(path, mmap_mode)
@@ -6,7 +6,7 @@ from scipy.sparse.csr import csr_matrix
 import sys
 from sklearn import semi_supervised
 from _collections import defaultdict
-from tensor_utils import pad
+from tensor_utils import pad, load_model
 
 class RBF(object):
     def __init__(self, gamma):
@@ -22,6 +22,30 @@ def expander(X, Y):
     '''
     return X.dot(Y.T)
 
+def largest_indices(values, k, mask=None, ordered=True):
+    '''
+    Flat indices of the k largest values, ties are broken by position, i.e.
+    the first k of a stable argsort of -values, without sorting all values.
+    
+    mask: only consider the positions where mask is True
+    ordered: return the indices in the order of the argsort
+    '''
+    values = values.ravel()
+    candidates = values if mask is None else values[mask.ravel()]
+    k = max(0, min(k, len(candidates)))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    threshold = np.partition(candidates, len(candidates)-k)[len(candidates)-k]
+    above, ties = values > threshold, values == threshold
+    if mask is not None:
+        above &= mask.ravel()
+        ties &= mask.ravel()
+    above = np.flatnonzero(above)
+    indices = np.concatenate([above, np.flatnonzero(ties)[:k-len(above)]])
+    if ordered:
+        indices = indices[np.lexsort((indices, -values[indices]))]
+    return indices
+
 class LabelPropagation(object):
     
     def __init__(self, sess, vocab_path, model_path, batch_size, sim_func=expander):
@@ -29,15 +53,10 @@ class LabelPropagation(object):
         self.batch_size = batch_size
         self.sim_func = sim_func
         self.vocab = np.load(vocab_path)
-        import tensorflow as tf
-        saver = tf.train.import_meta_graph(model_path + '.meta', clear_devices=True)
         start_sec = time()
         sys.stdout.write('Loading model from %s... ' %model_path)
-        saver.restore(sess, model_path)
+        self.x, self.predicted_context_embs, self.lens = load_model(sess, model_path)
         sys.stdout.write('Done (%.0f sec).\n' %(time()-start_sec))
-        self.x = sess.graph.get_tensor_by_name('Model_1/x:0')
-        self.predicted_context_embs = sess.graph.get_tensor_by_name('Model_1/predicted_context_embs:0')
-        self.lens = sess.graph.get_tensor_by_name('Model_1/lens:0')
         self.similarity_threshold = 0.95
         self.minimum_vertex_degree = 10
         self.predicting_elapsed_sec = 0
@@ -74,32 +93,38 @@ class LabelPropagation(object):
         contexts = X1
         num_examples = len(contexts)
         sims = self.sim_func(contexts, contexts)
-        sorted_indices = np.dstack(np.unravel_index(np.argsort(-sims.ravel()), 
-                                                    sims.shape))[0]
-        sorted_indices = [(u, v) for u, v in sorted_indices if u < v] # keep only one of two equivalent pairs
+        # the most similar pairs, keep only one of two equivalent pairs (u < v)
+        upper = np.triu(np.ones((num_examples, num_examples), dtype=bool), 1)
         num_most_similar_pairs = int(num_examples*(num_examples-1)*(1-self.similarity_threshold))
-        selected_pairs = set(pair for pair in sorted_indices[:num_most_similar_pairs])
-        sorted_within_row_indices = np.argsort(-sims)
+        adjacent = np.zeros((num_examples, num_examples), dtype=bool)
+        adjacent.flat[largest_indices(sims, num_most_similar_pairs, upper, ordered=False)] = True
+        adjacent |= adjacent.T.copy()
+        degree = adjacent.sum(axis=1)
         # add edges to low-connectivity vertices
-        degree = Counter()
-        degree.update(u for u, _ in selected_pairs)
-        degree.update(v for _, v in selected_pairs)
         adding_edges_start_sec = time()
-        for v in range(num_examples):
+        # the degrees only grow, so only these vertices can need edges, and
+        # each of them visits at most 2*minimum_vertex_degree-1 neighbours
+        # (the ones that are already adjacent count towards the degree)
+        num_candidates = 2*self.minimum_vertex_degree
+        for v in np.flatnonzero(degree < self.minimum_vertex_degree):
             if degree[v] < self.minimum_vertex_degree: 
                 self.num_low_degree_vertices += 1
-                for idx in sorted_within_row_indices[v]:
-                    if degree[v] >= self.minimum_vertex_degree: break
-                    if (v, idx) not in selected_pairs and (idx, v) not in selected_pairs:
-                        selected_pairs.add((v, idx))
-                        degree[v] += 1
-                        degree[idx] += 1
-                        self.num_added_edges += 1
+                candidates = largest_indices(sims[v], num_candidates)
+                candidates = candidates[~adjacent[v, candidates]]
+                # an edge to itself adds 2 to the degree
+                increments = np.where(candidates == v, 2, 1)
+                degree_before = degree[v] + np.cumsum(increments) - increments
+                added = candidates[degree_before < self.minimum_vertex_degree]
+                adjacent[v, added] = adjacent[added, v] = True
+                degree[added] += 1
+                degree[v] += len(added)
+                self.num_added_edges += len(added)
         self.adding_edges_elapsed_sec += (time() - adding_edges_start_sec)
-        self.num_total_edges += len(selected_pairs) 
-        # make the matrix
-        sims, rows, cols = zip(*[(sims[u,v], u,v) for u,v in selected_pairs] +
-                                [(sims[v,u], v,u) for u,v in selected_pairs])
+        self.num_total_edges += np.count_nonzero(np.triu(adjacent))
+        # make the matrix (an edge to itself is counted in both directions)
+        rows, cols = np.nonzero(adjacent)
+        sims = sims[rows, cols]
+        sims[rows == cols] *= 2
         return csr_matrix((sims, (rows, cols)), shape=(num_examples,num_examples))
         
     def _run_lstm(self, converted_data):
@@ -2,8 +2,8 @@ import numpy as np
 import tensorflow as tf
 import time
 import sys
-import collections
-from configs import special_symbols
+from checkpoint_utils import AsyncCheckpointWriter, is_optimizer_slot
+from hdn_batches import load_hdn_batches
 from sklearn.cross_validation import train_test_split
 from sklearn.utils import shuffle
 
@@ -213,11 +213,51 @@ class WSDModel(object):
         return total_cost / total_examples, total_hit / total_examples
 
 
+class WSDInferenceModel(WSDModel):
+    """Only the forward pass of WSDModel (x, lens -> predicted_context_embs),
+    without output layer and optimizer. Used to export slim models for
+    evaluation (see export-inference-model.py)."""
+
+    def _build_logits(self):
+        pass
+
+    def _build_cost(self):
+        pass
+
+
 class WSIModel(WSDModel):
-    """A LSTM word sense induction (WSI) model designed for fast training."""
+    """A LSTM word sense induction (WSI) model designed for fast training.
+    
+    With candidate_softmax=True, the model is trained on HDN examples (see
+    hdn_batches.py): the softmax of each example only covers its candidate
+    HDNs, given as a padded [batch, max_candidates] matrix, so the cost of
+    the output layer depends on the number of candidates instead of the
+    vocabulary. config.num_hdns is the number of HDNs."""
+
+    def __init__(self, config, optimized=False, reuse_variables=False, use_eos=False,
+                 candidate_softmax=False):
+        self.candidate_softmax = candidate_softmax
+        WSDModel.__init__(self, config, optimized, reuse_variables, use_eos)
+
+    def _build_inputs(self):
+        WSDModel._build_inputs(self)
+        if self.candidate_softmax:
+            self._candidates = tf.placeholder(tf.int32, shape=[None, None], name='candidates')
+            self._num_candidates = tf.placeholder(tf.int32, shape=[None], name='num_candidates')
 
     def _build_logits(self):
-        if self.optimized and self.config.sampled_softmax:
+        if self.candidate_softmax:
+            E_hdns = tf.get_variable("hdn_embedding", 
+                    [self.config.num_hdns, self.config.emb_dims], dtype=float_dtype)
+            candidate_embs = tf.nn.embedding_lookup(E_hdns, self._candidates)
+            # [batch, max_candidates, emb_dims] x [batch, emb_dims, 1]
+            candidate_logits = tf.squeeze(tf.matmul(candidate_embs, 
+                    tf.expand_dims(self._predicted_context_embs, 2)), axis=2)
+            mask = tf.sequence_mask(self._num_candidates, tf.shape(self._candidates)[1])
+            # padding gets no probability mass
+            self._logits = tf.where(mask, candidate_logits, 
+                                    tf.fill(tf.shape(candidate_logits), -1e30))
+        elif self.optimized and self.config.sampled_softmax:
             E_contexts = tf.get_variable("context_embedding", 
                     [self.config.vocab_size, self.config.num_senses, self.config.emb_dims], 
                     dtype=float_dtype)
@@ -234,50 +274,86 @@ class WSIModel(WSDModel):
             self._logits = tf.reduce_max(tf.reshape(sense_logits,
                     (-1, self.config.vocab_size, self.config.num_senses)), axis=2)
             
-    def _load_data2(self, data_path):
-        examples = []
-        with open(data_path) as f:
-            for line in f:
-                target, candidates, sentence = line.split(maxsplit=3)
-                candidates = candidates.split('/')
-                sentence = sentence.rtrim().split()
-                examples.append((target, candidates, sentence))
-
-        min_count = 5
-        vocab_size = 10**6
-        counter = collections.Counter()
-        for _, _, sentence in examples:
-            counter.update(sentence)
-        sys.stderr.write('Total unique words: %d\n' %len(counter))
-        for sym in special_symbols: assert sym not in counter
-        input_vocab = special_symbols + [w for w, c in counter.most_common(vocab_size) 
-                                         if c >= min_count] 
-        sys.stderr.write('Retained %d words\n' %len(input_vocab))
-        input_word2id = {word: i for i, word in enumerate(input_vocab)}
-        
-        output_vocab = list(set(word for _, candidates, _ in examples
-                                for word in candidates))
-        output_word2id = {word: i for i, word in enumerate(output_vocab)}
-        examples = [(output_word2id[target], 
-                     [output_word2id[w] for w in candidates],
-                     [input_word2id[w] for w in sentence])
-                    for target, candidates, sentence in examples]
-        
-        train_examples, valid_examples = \
-                train_test_split(examples, test_size=0.1, random_state=2852852)
-        train_examples = shuffle(train_examples, random_state=5729568)
-        
+    def _load_data2(self, data_path, dev_size=0.1):
+        '''
+        Load the batches that preprocess_hdn.py writes with --vocab_path (see
+        hdn_batches.py) and split them into training and development batches.
+        Nothing is parsed: the batches are memory-mapped and only read when
+        they are used.
         
+        :return: (batches, train_batch_ids, dev_batch_ids)
+        '''
+        batches = load_hdn_batches(data_path)
+        sys.stderr.write('Loaded %d batches of HDN examples, %d HDNs, %d candidate lists\n'
+                         %(len(batches), len(batches.hdns), len(batches.hdn_lists)))
+        train_batch_ids, dev_batch_ids = \
+                train_test_split(np.arange(len(batches)), test_size=dev_size, random_state=2852852)
+        train_batch_ids = shuffle(train_batch_ids, random_state=5729568)
+        return batches, train_batch_ids, dev_batch_ids
+
+    def _build_cost(self):
+        WSDModel._build_cost(self)
+        if self.candidate_softmax:
+            self._accuracy = tf.reduce_mean(tf.cast(
+                    tf.nn.in_top_k(self._logits, self._y, 1), float_dtype))
+
+    def _feed_dict2(self, session, batches, batch_id):
+        x, lens, _, hdn_ids, hdn_list_ids = batches[batch_id]
+        candidates, num_candidates, y = batches.candidate_matrix(hdn_list_ids, hdn_ids)
+        feed_dict = {self._x: x, self._y: y, self._lens: lens,
+                     self._candidates: candidates, self._num_candidates: num_candidates}
+        state = session.run(self._initial_state, feed_dict)
+        c, h = self._initial_state
+        feed_dict[c] = state.c
+        feed_dict[h] = state.h
+        return feed_dict
+
+    def train_epoch2(self, session, batches, batch_ids, verbose=False):
+        '''Runs the model (candidate_softmax=True) on the given HDN batches.'''
+        total_cost = 0.0
+        total_rows = 0
+        samples = np.random.permutation(batch_ids)
+        for batch_no, batch_id in enumerate(samples):
+            feed_dict = self._feed_dict2(session, batches, batch_id)
+            batch_cost, _ = session.run([self._cost, self._train_op], feed_dict,
+                                        options=self.run_options, 
+                                        run_metadata=self.run_metadata)
+            batch_size = len(feed_dict[self._y])
+            total_cost += batch_cost * batch_size # because the cost is averaged
+            total_rows += batch_size              # over rows in a batch
+            if verbose and (batch_no+1) % 1000 == 0:
+                print("\tfinished %d of %d batches, sample batch cost: %.7f" 
+                      %(batch_no+1, len(samples), batch_cost))
+        return total_cost / total_rows
 
-    def train2(self, data_path, dev_size=0.1):
+    def measure_dev_cost2(self, session, batches, batch_ids):
+        total_examples = 0
+        total_cost = 0.0
+        total_correct = 0.0
+        for batch_id in batch_ids:
+            feed_dict = self._feed_dict2(session, batches, batch_id)
+            cost, accuracy = session.run([self._cost, self._accuracy], feed_dict)
+            batch_size = len(feed_dict[self._y])
+            total_cost += cost * batch_size
+            total_correct += accuracy * batch_size
+            total_examples += batch_size
+        return total_cost / total_examples, total_correct / total_examples
+
+    def train2(self, data_path, m_evaluate, FLAGS, dev_size=0.1):
         '''
-        Train the model on a data set stored in a CSV file in the format:
-        <TARGET_WORD> <SPACE> <CANDIDATES> <SPACE> <SENTENCE>
-        where the sentence is a list of words separate by a space.   
+        Train the model (candidate_softmax=True) on the binary HDN batches at
+        data_path (written by preprocess_hdn.py, see hdn_batches.py).
+        m_evaluate is the evaluation model or None.
         '''
-        
-            
-            
+        batches, train_batch_ids, dev_batch_ids = self._load_data2(data_path, dev_size)
+        train_epoch = lambda sess: self.train_epoch2(sess, batches, train_batch_ids, verbose=True)
+        measure_dev_cost = None
+        if m_evaluate:
+            measure_dev_cost = lambda sess: m_evaluate.measure_dev_cost2(sess, batches, dev_batch_ids)
+        run_training(self, train_epoch, measure_dev_cost, FLAGS, self.config, 
+                     dev_metric='accuracy')
+
+
 def from_npz_to_batches(npz, full_vocab, prepare_subvocabs):
     batches = []
     num_batches = sum(1 for key in npz if key.startswith('batch'))
@@ -313,7 +389,21 @@ def load_data(FLAGS, prepare_subvocabs=False):
 def train_model(m_train, m_evaluate, FLAGS, config):
     vocab, train_batches, dev_batches = load_data(FLAGS, prepare_subvocabs=config.sampled_softmax)
     target_id = vocab['<target>']
+    train_epoch = lambda sess: m_train.train_epoch(sess, train_batches, target_id, verbose=True)
+    measure_dev_cost = None
+    if m_evaluate:
+        measure_dev_cost = lambda sess: m_evaluate.measure_dev_cost(sess, dev_batches, target_id)
+    run_training(m_train, train_epoch, measure_dev_cost, FLAGS, config)
+
 
+def run_training(m_train, train_epoch, measure_dev_cost, FLAGS, config, dev_metric='hit@100'):
+    '''
+    The epoch loop of train_model(): checkpoints, best model, early stopping.
+    
+    :param train_epoch: function session -> training cost of an epoch
+    :param measure_dev_cost: function session -> (development cost, dev_metric)
+    or None
+    '''
     best_cost = None # don't know how to update this within a managed session yet
     stagnant_count = tf.get_variable("stagnant_count", initializer=0, dtype=tf.int32, trainable=False)
     reset_stag = tf.assign(stagnant_count, 0)
@@ -321,37 +411,64 @@ def train_model(m_train, m_evaluate, FLAGS, config):
     epoch = tf.get_variable("epoch", initializer=0, dtype=tf.int32, trainable=False)
     inc_epoch = tf.assign_add(epoch, 1)
     
-    saver = tf.train.Saver(max_to_keep=FLAGS.max_to_keep if hasattr(FLAGS, 'max_to_keep') else 1)
-    best_model_saver = tf.train.Saver()
+    max_to_keep = FLAGS.max_to_keep if hasattr(FLAGS, 'max_to_keep') else 1
+    saver = tf.train.Saver(max_to_keep=max_to_keep)
+    if getattr(FLAGS, 'best_model_without_slots', False):
+        # the best model is only used for inference, optimizer slots are dead weight
+        best_model_vars = [v for v in tf.global_variables() if not is_optimizer_slot(v)]
+    else:
+        best_model_vars = tf.global_variables()
+    best_model_saver = tf.train.Saver(var_list=best_model_vars)
+    if getattr(FLAGS, 'async_checkpoints', False):
+        checkpoint_writer = AsyncCheckpointWriter(saver, tf.global_variables(), max_to_keep)
+        best_model_writer = AsyncCheckpointWriter(best_model_saver, best_model_vars)
+    else:
+        checkpoint_writer, best_model_writer = saver, best_model_saver
     sv = tf.train.Supervisor(logdir=FLAGS.save_path, saver=saver) #, save_model_secs=60) # for testing
-    with sv.managed_session() as sess:
-        start_time = time.time()
-        for i in range(sess.run(epoch), config.max_epoch):
-            # only turn it on after 5 epochs because first epochs spend time 
-            # on GPU initialization routines
-            if hasattr(FLAGS, 'trace_timeline') and FLAGS.trace_timeline and i == 5: 
-                m_train.trace_timeline() # start tracing timeline
-            print("Epoch #%d:" % (i + 1))
-#             train_cost = 0 # for debugging
-            train_cost = m_train.train_epoch(sess, train_batches, target_id, verbose=True)
-            print("Epoch #%d finished:" %(i + 1))
-            print("\tTrain cost: %.3f" %train_cost) 
-            saver.save(sess, FLAGS.save_path, global_step=i)
-            if m_evaluate:
-                dev_cost, hit_at_100 = m_evaluate.measure_dev_cost(sess, dev_batches, target_id)
-                print("\tDev cost: %.3f, hit@100: %.1f%%" %(dev_cost, hit_at_100))
-                if best_cost is None or dev_cost < best_cost:
-                    best_cost = dev_cost
-                    save_path = best_model_saver.save(sess, FLAGS.save_path + '-best-model')
-                    print("\tSaved best model to %s" %save_path)
-                    sess.run(reset_stag)
-                else:
-                    sess.run(inc_stag)
-                    if (config.max_stagnant_count > 0 and 
-                        sess.run(stagnant_count) >= config.max_stagnant_count):
-                        print("Stopped early because development cost "
-                              "didn't decrease for %d consecutive epochs." 
-                              %config.max_stagnant_count)
-                        break
-            print("\tElapsed time: %.1f minutes" %((time.time()-start_time)/60))
-            sess.run(inc_epoch)
+    try:
+        with sv.managed_session() as sess:
+            start_time = time.time()
+            for i in range(sess.run(epoch), config.max_epoch):
+                # only turn it on after 5 epochs because first epochs spend time 
+                # on GPU initialization routines
+                if hasattr(FLAGS, 'trace_timeline') and FLAGS.trace_timeline and i == 5: 
+                    m_train.trace_timeline() # start tracing timeline
+                print("Epoch #%d:" % (i + 1))
+#                 train_cost = 0 # for debugging
+                train_cost = train_epoch(sess)
+                print("Epoch #%d finished:" %(i + 1))
+                print("\tTrain cost: %.3f" %train_cost) 
+                checkpoint_writer.save(sess, FLAGS.save_path, global_step=i)
+                if measure_dev_cost:
+                    dev_cost, dev_score = measure_dev_cost(sess)
+                    print("\tDev cost: %.3f, %s: %.1f%%" %(dev_cost, dev_metric, dev_score*100))
+                    if best_cost is None or dev_cost < best_cost:
+                        best_cost = dev_cost
+                        save_path = best_model_writer.save(sess, FLAGS.save_path + '-best-model')
+                        print("\tSaved best model to %s" %save_path)
+                        sess.run(reset_stag)
+                    else:
+                        sess.run(inc_stag)
+                        if (config.max_stagnant_count > 0 and 
+                            sess.run(stagnant_count) >= config.max_stagnant_count):
+                            print("Stopped early because development cost "
+                                  "didn't decrease for %d consecutive epochs." 
+                                  %config.max_stagnant_count)
+                            break
+                print("\tElapsed time: %.1f minutes" %((time.time()-start_time)/60))
+                sess.run(inc_epoch)
+    finally:
+        # make sure checkpoints still in the queue reach the disk: every writer
+        # is closed even if another one fails, and an error of a writer does
+        # not hide an exception of the training loop
+        in_flight = sys.exc_info()[1] is not None
+        close_error = None
+        for writer in (checkpoint_writer, best_model_writer):
+            if isinstance(writer, AsyncCheckpointWriter):
+                try:
+                    writer.close()
+                except Exception as e:
+                    sys.stderr.write('Failed to close checkpoint writer: %s\n' %e)
+                    close_error = close_error or e
+        if close_error is not None and not in_flight:
+            raise close_error
@@ -1,9 +1,16 @@
-from nltk.corpus import wordnet as wn
+from evaluate.wn_snapshot import load_wordnet
+from evaluate.hypernym_index import load_hypernym_index
+from evaluate.line_shards import shard_offsets, read_lines
 from collections import defaultdict
 from tqdm import tqdm
+import os
+import shutil
+import pickle
 import random
-from itertools import islice
+import argparse
+from multiprocessing import Pool
 from version import version
+from hdn_batches import HDNBatchWriter, remove_hdn_batches
 
 def synset2identifier(synset, wn_version):
     """
@@ -28,7 +35,7 @@ def synset2identifier(synset, wn_version):
 
     return identifier
 
-def synsets_graph_info(wn_instance, wn_version, lemma, pos):
+def synsets_graph_info(wn_instance, wn_version, lemma, pos, hypernym_index=None):
     """
     extract:
     1. hyponym under lowest least common subsumer
@@ -38,6 +45,8 @@ def synsets_graph_info(wn_instance, wn_version, lemma, pos):
     :param str wn_version: supported: '171' | '21' | '30'
     :param str lemma: a lemma
     :param str pos: a pos
+    :param hypernym_index.HypernymIndex hypernym_index: if given, the lowest
+    common hypernyms are looked up in this index (same output, much faster)
 
     :rtype: dict
     :return: mapping synset_id
@@ -59,6 +68,19 @@ def synsets_graph_info(wn_instance, wn_version, lemma, pos):
                                                 'path_to_under_lcs': []}
         return sy_id2under_lcs_info
 
+    if hypernym_index is not None:
+        for sy1 in synsets:
+            under_lcs_info = hypernym_index.under_lcs(wn_instance, sy1, synsets)
+            if under_lcs_info is None:
+                continue
+            under_lcs, path_to_under_lcs = under_lcs_info
+            target_sy_iden = synset2identifier(sy1, wn_version)
+            sy_id2under_lcs_info[target_sy_iden] = {'under_lcs': synset2identifier(under_lcs, wn_version),
+                                                    'under_lcs_obj': under_lcs,
+                                                    'sy_obj' : sy1,
+                                                    'path_to_under_lcs': [synset2identifier(synset, wn_version)
+                                                                          for synset in path_to_under_lcs]}
+        return sy_id2under_lcs_info
 
     for sy1 in synsets:
 
@@ -102,9 +124,94 @@ def synsets_graph_info(wn_instance, wn_version, lemma, pos):
 
     return sy_id2under_lcs_info
 
+def init_worker(noun2related_hdns, hdns, vocab=None):
+    """
+    :param vocab: (word2id, all hdns, all hdn lists) to write binary batches
+    (see hdn_batches.py), None to write text
+    """
+    global monosemous_noun2related_hdns, all_hdns, batch_vocab
+    monosemous_noun2related_hdns = noun2related_hdns
+    all_hdns = hdns
+    batch_vocab = vocab
+
+
+def hdn_shard(input_path, shard_no, start, end, output_path, seed):
+    """
+    find the monosemous nouns in the lines between byte offsets start and end
+    and write two training examples (hdn, hdn list, sentence with <target>)
+    for each of them to output_path, as text lines or, if init_worker() got
+    a vocabulary, as binary batches
+
+    the random choices of a shard only depend on seed and shard_no
+
+    :rtype: tuple
+    :return: (number of monosemous words found, set of the monosemous words
+    found, set of the used hdn lists)
+    """
+    r = random.Random('%d-%d' %(seed, shard_no))
+    num_found = 0
+    found_words = set()
+    used_hdn_lists = set()
+    if batch_vocab is None:
+        f_out, writer = open(output_path, 'w'), None
+    else:
+        word2id, hdns, hdn_lists = batch_vocab
+        hdn2id = dict((hdn, i) for i, hdn in enumerate(hdns))
+        hdn_list2id = dict((hdn_list, i) for i, hdn_list in enumerate(hdn_lists))
+        f_out, writer = None, HDNBatchWriter(output_path, word2id, hdns, hdn_lists)
+    with tqdm(total=end-start, unit='B', unit_scale=True, position=shard_no) as progress:
+        for line in read_lines(input_path, start, end):
+            progress.update(len(line)) # characters, close enough to bytes
+            sent = line.split()
+            text = token_ids = None
+            word_start = 0
+            for i, word in enumerate(sent):
+                if word in monosemous_noun2related_hdns:
+                    if writer is not None:
+                        if token_ids is None:
+                            token_ids = writer.lookup(sent)
+                    else:
+                        if text is None:
+                            text = line.strip()
+                            # the offsets below assume single spaces between words
+                            if (len(text) != sum(map(len, sent)) + len(sent) - 1 or
+                                    text.count(' ') != len(sent) - 1):
+                                text = ' '.join(sent)
+                        new_sent = text[:word_start] + '<target>' + text[word_start+len(word):]
+                    num_found += 1
+                    found_words.add(word)
+                    for _ in range(2):
+                        hdn = r.choice(monosemous_noun2related_hdns[word])
+                        hdn_list = r.choice(all_hdns[hdn])
+                        used_hdn_lists.add(hdn_list)
+                        if writer is not None:
+                            writer.add(hdn2id[hdn], hdn_list2id[hdn_list], token_ids, i)
+                        else:
+                            f_out.write(' '.join((hdn, '/'.join(hdn_list), new_sent)))
+                            f_out.write('\n')
+                word_start += len(word) + 1
+    if writer is not None:
+        writer.close()
+    else:
+        f_out.close()
+    return num_found, found_words, used_hdn_lists
+
+
 if __name__ == '__main__':
-    gigaword_path = 'preprocessed-data/gigaword.txt'
-    output_path = 'output/gigaword-hdn-training.%s.txt' %version
+    parser = argparse.ArgumentParser(description='Turn Gigaword into a training set of hypernyms (HDNs) of monosemous nouns')
+    parser.add_argument('-i', dest='gigaword_path', default='preprocessed-data/gigaword.txt', help='one tokenized sentence per line')
+    parser.add_argument('-o', dest='output_path', default='output/gigaword-hdn-training.%s.txt' %version)
+    parser.add_argument('-n', dest='num_workers', type=int, default=os.cpu_count(), help='number of worker processes, each reads a part of the input')
+    parser.add_argument('--keep_shards', action='store_true', help='keep the output of each worker in <output_path>.part<i> instead of concatenating them')
+    parser.add_argument('--vocab_path', help='vocabulary of prepare-lstm-wsd.py (<fname>.index.pkl). If given, training-ready binary batches are written to <output_path>.index/.tokens/.examples (see hdn_batches.py) instead of text')
+    args = parser.parse_args()
+
+    # the snapshot (evaluate/wn_snapshot.py) if it has been created
+    wn = load_wordnet('30')
+    # built into evaluate/resources on the first run (evaluate/hypernym_index.py)
+    hypernym_index = load_hypernym_index(wn, '30')
+    gigaword_path = args.gigaword_path
+    output_path = args.output_path
     
     id2synset = {synset2identifier(s, '30'): s for s in wn.all_synsets()}
     all_noun_lemmas = {lemma.name()
@@ -117,7 +224,8 @@ if __name__ == '__main__':
         graph_info = synsets_graph_info(wn_instance=wn,
                                     wn_version='30',
                                     lemma=lemma,
-                                    pos='n')
+                                    pos='n',
+                                    hypernym_index=hypernym_index)
         hdns = tuple([info['under_lcs'] 
                      for synset, info in graph_info.items() 
                      if info['under_lcs']])
@@ -125,7 +233,8 @@ if __name__ == '__main__':
         for hdn in hdns:
             all_hdns[hdn].add(hdns)
     for hdn in all_hdns:
-        all_hdns[hdn] = list(all_hdns[hdn])
+        # sorted: the order of a set changes from run to run
+        all_hdns[hdn] = sorted(all_hdns[hdn])
     
     # # Getting monosemous words
     monosemous_noun2related_hdns = defaultdict(list)
@@ -146,39 +255,58 @@ if __name__ == '__main__':
     print('Proportion monosemous/all:', 
           len(monosemous_noun2related_hdns) / len(all_noun_lemmas))
 
-    # # Find all monsemous words in Gigaword
-    found_monosemous = []
-    with open(gigaword_path) as f:
-        for line in tqdm(f, total=175771829):
-            for word in line.split():
-                if word in monosemous_noun2related_hdns:
-                    found_monosemous.append(word)
-    print('Found monosemous words: ', len(found_monosemous))
-    
-    # # Turn Gigaword into a supervised training set
-    r = random.Random(5328952)
+    # # Find all monsemous words in Gigaword and turn it into a supervised
+    # # training set, in one pass split over the workers
+    all_hdn_lists = set(hdn_list 
+                        for hdn_lists in all_hdns.values()
+                        for hdn_list in hdn_lists)
+    vocab = None
+    if args.vocab_path:
+        with open(args.vocab_path, 'rb') as f:
+            word2id = pickle.load(f)
+        vocab = (word2id, sorted(all_hdns), sorted(all_hdn_lists))
+    shards = shard_offsets(gigaword_path, args.num_workers)
+    shard_paths = ['%s.part%d' %(output_path, shard_no) for shard_no in range(len(shards))]
+    shard_args = [(gigaword_path, shard_no, start, end, shard_path, 5328952)
+                  for shard_no, ((start, end), shard_path) in enumerate(zip(shards, shard_paths))]
+    with Pool(args.num_workers, initializer=init_worker,
+              initargs=(monosemous_noun2related_hdns, all_hdns, vocab)) as pool:
+        partials = pool.starmap(hdn_shard, shard_args)
+
+    num_found = 0
+    found_words = set()
     used_hdn_lists = set()
+    for shard_found, shard_words, shard_hdn_lists in partials:
+        num_found += shard_found
+        found_words.update(shard_words)
+        used_hdn_lists.update(shard_hdn_lists)
+    print('Found monosemous words: ', num_found)
     available_hdn_lists = set()
-    with open(gigaword_path) as f, open(output_path, 'w') as f_out:
-        for line in tqdm(f, total=175771829):
-            sent = line.split()
-            for i, word in enumerate(sent):
-                if word in monosemous_noun2related_hdns:
-                    new_sent = sent[:]
-                    new_sent[i] = '<target>'
-                    for hdn in monosemous_noun2related_hdns[word]:
-                        available_hdn_lists.update(all_hdns[hdn])
-                    for _ in range(2):
-                        hdn = r.choice(monosemous_noun2related_hdns[word])
-                        hdn_list = r.choice(all_hdns[hdn])
-                        used_hdn_lists.add(hdn_list)
-                        f_out.write(' '.join((hdn, '/'.join(hdn_list), ' '.join(new_sent))))
-                        f_out.write('\n')
+    for word in found_words:
+        for hdn in monosemous_noun2related_hdns[word]:
+            available_hdn_lists.update(all_hdns[hdn])
+
+    if args.keep_shards:
+        print('Written %s' %', '.join(shard_paths))
+    elif vocab is not None:
+        # shards are concatenated in input order
+        writer = HDNBatchWriter(output_path, *vocab)
+        for shard_path in shard_paths:
+            writer.append_file(shard_path)
+            remove_hdn_batches(shard_path)
+        writer.close()
+        print('Written %s.index/.tokens/.examples' %output_path)
+    else:
+        # shards are concatenated in input order
+        with open(output_path, 'wb') as f_out:
+            for shard_path in shard_paths:
+                with open(shard_path, 'rb') as f_shard:
+                    shutil.copyfileobj(f_shard, f_out)
+                os.remove(shard_path)
+        print('Written %s' %output_path)
+
     print('Used HDNs:', len(used_hdn_lists))
     print('HDNs availble in GigaWord:', len(available_hdn_lists))
-    all_hdn_lists = set(hdn_list 
-                        for hdn_lists in all_hdns.values()
-                        for hdn_list in hdn_lists)
     print('HDNs in WordNet:', len(available_hdn_lists))
     
     l = all_hdn_lists.difference(used_hdn_lists)
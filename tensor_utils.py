@@ -1,11 +1,48 @@
+import os
+import sys
 import numpy as np
 
 def load_tensors(sess):
-    x = sess.graph.get_tensor_by_name('Model_1/x:0')
-    predicted_context_embs = sess.graph.get_tensor_by_name('Model_1/predicted_context_embs:0')
-    lens = sess.graph.get_tensor_by_name('Model_1/lens:0')
+    # training graphs contain the evaluation model under Model_1 while 
+    # exported inference graphs (see export-inference-model.py) only have Model
+    scope = 'Model_1'
+    try:
+        sess.graph.get_operation_by_name('Model_1/x')
+    except KeyError:
+        scope = 'Model'
+    x = sess.graph.get_tensor_by_name(scope + '/x:0')
+    predicted_context_embs = sess.graph.get_tensor_by_name(scope + '/predicted_context_embs:0')
+    lens = sess.graph.get_tensor_by_name(scope + '/lens:0')
     
     return x, predicted_context_embs, lens
+
+def _is_stale(export_path, model_path):
+    ''' whether a checkpoint file of model_path is newer than the export '''
+    export_sec = os.path.getmtime(export_path + '.meta')
+    return any(os.path.getmtime(path) > export_sec
+               for path in (model_path + '.meta', model_path + '.index')
+               if os.path.exists(path))
+
+def load_model(sess, model_path):
+    '''
+    Restore a trained LSTM into sess and return (x, predicted_context_embs, lens).
+
+    If the model has been exported with export-inference-model.py, the slim
+    inference graph is loaded instead of the full training graph, unless the
+    checkpoint is newer than the export (retrained or overwritten).
+    '''
+    import tensorflow as tf
+    inference_path = model_path + '-inference'
+    if os.path.exists(inference_path + '.meta'):
+        if _is_stale(inference_path, model_path):
+            sys.stderr.write('Warning: %s is older than %s, ignoring it (run '
+                             'export-inference-model.py again)\n' %(inference_path, model_path))
+        else:
+            model_path = inference_path
+    print('Loading graph %s.meta' %model_path)
+    saver = tf.train.import_meta_graph(model_path + '.meta', clear_devices=True)
+    saver.restore(sess, model_path)
+    return load_tensors(sess)
             
 def pad(sents, max_len, pad_id, eos_id):
     if eos_id is not None: 
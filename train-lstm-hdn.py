@@ -14,7 +14,8 @@ import numpy as np
 import tensorflow as tf
 from tensorflow.python.client import timeline
 import sys
-from model import WSDModel, train_model
+from model import WSIModel
+from hdn_batches import load_hdn_batches
 from configs import get_config
 import random
 
@@ -26,17 +27,20 @@ flags.DEFINE_integer("seed", 192,
 flags.DEFINE_string("model", "small",
                     "A type of model. Possible options are: small, medium, large, google.")
 flags.DEFINE_string("data_path", None,
-                    "Where the training/valid data is stored.")
-flags.DEFINE_string("dev_path", '',
-                    "Where the valid data is stored, if it cannot be inferred from data_path.")
-flags.DEFINE_string("vocab_path", '',
-                    "Where the vocabulary is stored, if it cannot be inferred from data_path.")
+                    "Where the HDN batches are stored (preprocess_hdn.py --vocab_path, "
+                    "see hdn_batches.py).")
+flags.DEFINE_float("dev_size", 0.1,
+                   "Proportion of the batches that is used as development set.")
 flags.DEFINE_string("save_path", None,
                     "Model output directory.")
 flags.DEFINE_bool("trace_timeline", False,
                   "Trace execution time to find out bottlenecks.")
 flags.DEFINE_integer("max_to_keep", 1, 
                      "Number of models (at different epochs) to keep around")
+flags.DEFINE_bool("async_checkpoints", True,
+                  "Write checkpoints in a background thread instead of stalling training.")
+flags.DEFINE_bool("best_model_without_slots", False,
+                  "Leave optimizer slots out of the best model (only good for inference).")
 FLAGS = flags.FLAGS
 
 def main(_):
@@ -45,17 +49,18 @@ def main(_):
     tf.set_random_seed(random.randint(0, 10**6))
     if not FLAGS.data_path:
         raise ValueError("Must set --data_path to the base path of "
-                         "prepared input (e.g. output/gigaword)")
+                         "the HDN batches (e.g. output/gigaword-hdn-training)")
     config = get_config(FLAGS)
+    # the size of the output layer
+    config.num_hdns = len(load_hdn_batches(FLAGS.data_path).hdns)
     with tf.Graph().as_default():
         initializer = tf.random_uniform_initializer(-config.init_scale,
                                                     config.init_scale)
     with tf.variable_scope("Model", reuse=None, initializer=initializer):
-        m_train = WSDModel(config, optimized=True)
+        m_train = WSIModel(config, optimized=True, candidate_softmax=True)
     with tf.variable_scope("Model", reuse=True):
-        m_evaluate = WSDModel(config, reuse_variables=True)
-#     m_train.print_device_placement() # for debugging
-    train_model(m_train, m_evaluate, FLAGS, config)
+        m_evaluate = WSIModel(config, reuse_variables=True, candidate_softmax=True)
+    m_train.train2(FLAGS.data_path, m_evaluate, FLAGS, dev_size=FLAGS.dev_size)
 
     if FLAGS.trace_timeline:
         tl = timeline.Timeline(m_train.run_metadata.step_stats)
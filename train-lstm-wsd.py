@@ -37,6 +37,10 @@ flags.DEFINE_bool("trace_timeline", False,
                   "Trace execution time to find out bottlenecks.")
 flags.DEFINE_integer("max_to_keep", 1, 
                      "Number of models (at different epochs) to keep around")
+flags.DEFINE_bool("async_checkpoints", True,
+                  "Write checkpoints in a background thread instead of stalling training.")
+flags.DEFINE_bool("best_model_without_slots", False,
+                  "Leave optimizer slots out of the best model (only good for inference).")
 FLAGS = flags.FLAGS
 
 def main(_):